@@ -1,6 +1,31 @@
 #!/usr/bin/env bash
 
 set -euo pipefail
+
+exec_python_directly() {
+  build_gcc_root=$( cd "${BASH_SOURCE[0]%/*}" && cd .. && pwd )
+  python_interpreter=python3
+  if [[ -x $build_gcc_root/venv/bin/python3 ]]; then
+    python_interpreter=$build_gcc_root/venv/bin/python3
+  fi
+  PYTHONPATH=$build_gcc_root/src exec "$python_interpreter" \
+    "$build_gcc_root/src/build_gcc/build_gcc_main.py" "$@"
+}
+
+# Subcommands other than the build itself, and the --plan mode, which only prints the resolved
+# build plan, skip the virtualenv activation, the yugabyte-bash-common update and the build log to
+# keep them fast.
+case ${1:-} in
+  verify|submit|fetch|gc|registry)
+    exec_python_directly "$@"
+  ;;
+esac
+for arg in "$@"; do
+  if [[ $arg == "--plan" ]]; then
+    exec_python_directly "$@"
+  fi
+done
+
 # shellcheck source=bin/common.sh
 . "${BASH_SOURCE[0]%/*}/common.sh"
 
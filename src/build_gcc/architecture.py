@@ -1,10 +1,11 @@
-from sys_detection import is_macos
-from typing import List, Set, Tuple
+from typing import List, Optional, Set, Tuple
 
 import logging
 import os
 import subprocess
 
+from build_gcc.host_facts import is_macos
+
 
 MACOS_CPU_ARCHITECTURES = ['x86_64', 'arm64']
 
@@ -66,39 +67,60 @@ def get_architectures_of_file(file_path: str) -> Tuple[Set[str], str]:
     return arch_set, file_cmd_output
 
 
+def is_arch_validation_candidate(file_path: str) -> bool:
+    """
+    Whether the architecture of the given file should be validated: object files, dynamic
+    libraries and executables, except for scripts that are obviously not native code.
+    """
+    file_name = os.path.basename(file_path)
+    if (file_name.endswith(('.css', '.py')) or os.path.islink(file_path) or
+            not os.path.isfile(file_path)):
+        return False
+    return (file_name.endswith(('.o', '.dylib')) or
+            os.stat(file_path).st_mode & 0o111 != 0)
+
+
+def check_file_arch(target_arch: str, file_path: str) -> Tuple[Optional[bool], Set[str]]:
+    """
+    Returns whether the file is built for the target architecture, or None if it is not a native
+    executable, and the set of architectures the file is built for.
+    """
+    arch_set, file_cmd_output = get_architectures_of_file(file_path)
+    if len(arch_set) == 0:
+        logging.warning("File %s is not a native executable, skipping", file_path)
+        return None, arch_set
+    if target_arch not in arch_set:
+        logging.error(
+            "File %s is not built for the correct architecture %s "
+            "(found arhictectures: %s). Output of the file command:\n%s",
+            file_path, target_arch, sorted(arch_set), file_cmd_output)
+        return False, arch_set
+    return True, arch_set
+
+
 def validate_build_output_arch(target_arch: str, top_dir: str) -> None:
     if not is_macos():
         return
-    other_macos_arch = get_other_macos_arch(target_arch)
-    disallowed_suffix = ' ' + other_macos_arch
+    get_other_macos_arch(target_arch)
     logging.info(
         "Verifying achitecture of object files and libraries in %s (should be %s)",
         top_dir, target_arch)
-    files_of_interest = subprocess.check_output([
-            'find', top_dir, '-type', 'f', '-and', '(',
-            '-name', '*.o', '-or',
-            '-name', '*.dylib', '-or',
-            '-perm', '+111',
-            ')',
-            '-and', '-not', '-name', '*.css',
-            '-and', '-not', '-name', '*.py'
-        ]).strip().decode('utf-8').split('\n')
-    errors_found = False
+    files_of_interest = [
+        os.path.join(root, file_name)
+        for root, _, file_names in os.walk(top_dir)
+        for file_name in file_names
+        if is_arch_validation_candidate(os.path.join(root, file_name))
+    ]
 
     num_one_arch = 0
     num_multi_arch = 0
     num_errors = 0
 
     for file_of_interest in files_of_interest:
-        arch_set, file_cmd_output = get_architectures_of_file(file_of_interest)
-        if len(arch_set) == 0:
-            logging.warning("File %s is not a native executable, skipping", file_of_interest)
+        is_valid, arch_set = check_file_arch(target_arch, file_of_interest)
+        if is_valid is None:
             continue
-        if target_arch not in arch_set:
-            logging.error(
-                "File %s is not built for the correct architecture %s "
-                "(found arhictectures: %s). Output of the file command:\n%s",
-                file_of_interest, target_arch, sorted(arch_set), file_cmd_output)
+        if not is_valid:
             num_errors += 1
         if len(arch_set) == 1:
             num_one_arch += 1
@@ -0,0 +1,234 @@
+"""
+A host-wide autoconf cache shared by GCC builds. A config.site file, passed to configure using the
+CONFIG_SITE environment variable, points configure runs that use the host compiler (the top-level
+configure, and the stage1 and build machine subdirectories) to a cache file per subdirectory. The
+other configure runs, which use the compiler being built, are not affected.
+
+Cache entries are keyed by the host, the host compiler, the GCC version and the configure
+options. A build works on a private copy of the entry, which is merged back into the shared entry
+under a lock after a successful build. Values that refer to the directories of a particular build
+and the saved values of precious variables (which configure compares to the current environment,
+failing on any difference) are not shared. Entries for an earlier version of the host compiler at
+the same path are removed when the compiler changes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shlex
+import shutil
+import time
+
+from typing import Any, Dict, List, Optional
+
+from build_gcc.helpers import mkdir_p, rm_rf, write_file_atomically
+from build_gcc.locking import get_path_lock
+
+
+AUTOCONF_CACHE_FORMAT_VERSION = 1
+
+CONFIG_SITE_FILE_NAME = 'config.site'
+METADATA_FILE_NAME = 'metadata.json'
+CACHE_FILE_SUFFIX = '.cache'
+
+
+def compute_autoconf_cache_key(key_inputs: Dict[str, Any]) -> str:
+    """
+    >>> compute_autoconf_cache_key({'b': 1, 'a': 2}) == compute_autoconf_cache_key({'a': 2, 'b': 1})
+    True
+    """
+    key_json = json.dumps(
+        dict(key_inputs, format_version=AUTOCONF_CACHE_FORMAT_VERSION), sort_keys=True)
+    return hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+
+
+def get_configure_args_without_prefix(configure_args: List[str]) -> List[str]:
+    """
+    Returns the configure arguments other than the installation prefix, for cache keys that should
+    not depend on the directories of a particular build.
+
+    >>> get_configure_args_without_prefix(['--prefix=/opt/a', '--disable-nls'])
+    ['--disable-nls']
+    """
+    return [arg for arg in configure_args if not arg.startswith('--prefix=')]
+
+
+def get_config_site_content(
+        c_compilers: List[str], build_dir: str, cache_files_dir: str) -> str:
+    """
+    c_compilers are the host compiler and the wrappers around it that configure may be run with,
+    e.g. for distributed compilation.
+    """
+    return '\n'.join([
+        '# Generated by build-gcc. Points configure runs that use the host compiler to a cache',
+        '# file per build subdirectory.',
+        'case "x$CC" in',
+        '  %s)' % '|'.join('x' + shlex.quote(c_compiler) for c_compiler in c_compilers),
+        '    yb_cache_subdir=`pwd | sed -e %s -e "s|^/||" -e "s|/|__|g"`' % shlex.quote(
+            's|^%s||' % build_dir),
+        '    cache_file=%s/"${yb_cache_subdir:-top}%s"' % (
+            shlex.quote(cache_files_dir), CACHE_FILE_SUFFIX),
+        '    ;;',
+        'esac',
+        '',
+    ])
+
+
+def filter_cache_file_content(content: str, build_specific_paths: List[str]) -> str:
+    """
+    Removes the values that must not be shared between builds.
+
+    >>> filter_cache_file_content(
+    ...     "ac_cv_env_CC_set=set\\nac_cv_prog_AWK=${ac_cv_prog_AWK=gawk}\\n"
+    ...     "ac_cv_path_X=${ac_cv_path_X=/opt/b1/build/x}\\n", ['/opt/b1'])
+    'ac_cv_prog_AWK=${ac_cv_prog_AWK=gawk}\\n'
+    """
+    return ''.join(
+        line for line in content.splitlines(keepends=True)
+        if not line.startswith('ac_cv_env_') and
+        not any(path in line for path in build_specific_paths))
+
+
+class ConfigureCheckStats:
+    """
+    Counts the cached and uncached autoconf checks in the build output, and estimates the time
+    saved by the cached ones using the average time of the uncached ones. Autoconf prints the
+    result of a check on the same line as the check, so the time since the previous output line
+    approximates the duration of a check.
+    """
+    num_cached_checks: int
+    num_uncached_checks: int
+    uncached_checks_time_sec: float
+    last_line_time_sec: float
+
+    def __init__(self) -> None:
+        self.num_cached_checks = 0
+        self.num_uncached_checks = 0
+        self.uncached_checks_time_sec = 0.0
+        self.last_line_time_sec = time.time()
+
+    def handle_output_line(self, line: str) -> None:
+        current_time_sec = time.time()
+        if line.startswith('checking '):
+            if '(cached)' in line:
+                self.num_cached_checks += 1
+            else:
+                self.num_uncached_checks += 1
+                self.uncached_checks_time_sec += current_time_sec - self.last_line_time_sec
+        self.last_line_time_sec = current_time_sec
+
+    def get_estimated_time_saved_sec(self) -> float:
+        if not self.num_uncached_checks:
+            return 0.0
+        return (self.num_cached_checks * self.uncached_checks_time_sec /
+                self.num_uncached_checks)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'num_cached_checks': self.num_cached_checks,
+            'num_uncached_checks': self.num_uncached_checks,
+            'estimated_time_saved_sec': self.get_estimated_time_saved_sec(),
+        }
+
+
+class AutoconfCache:
+    cache_dir: str
+    install_parent_dir: str
+    key_inputs: Dict[str, Any]
+    key: str
+
+    def __init__(
+            self,
+            cache_dir: str,
+            install_parent_dir: str,
+            key_inputs: Dict[str, Any]) -> None:
+        self.cache_dir = cache_dir
+        self.install_parent_dir = install_parent_dir
+        self.key_inputs = key_inputs
+        self.key = compute_autoconf_cache_key(key_inputs)
+
+    def get_entry_dir(self, key: Optional[str] = None) -> str:
+        return os.path.join(self.cache_dir, key or self.key)
+
+    def read_metadata(self, key: str) -> Optional[Dict[str, Any]]:
+        metadata_path = os.path.join(self.get_entry_dir(key), METADATA_FILE_NAME)
+        if not os.path.exists(metadata_path):
+            return None
+        with open(metadata_path) as metadata_file:
+            metadata: Dict[str, Any] = json.load(metadata_file)
+        return metadata
+
+    def remove_entries_for_changed_compiler(self) -> None:
+        """
+        Removes the entries created with a different version of the host compiler at the same
+        path, which can never be used again.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        c_compiler = self.key_inputs['compilers']['c_compiler']
+        for key in os.listdir(self.cache_dir):
+            if key == self.key:
+                continue
+            metadata = self.read_metadata(key)
+            if metadata is None:
+                continue
+            key_inputs = metadata['key_inputs']
+            if (key_inputs['compilers']['c_compiler'] != c_compiler or
+                    key_inputs['compiler_fingerprint'] == self.key_inputs['compiler_fingerprint']):
+                continue
+            entry_lock = get_path_lock(self.install_parent_dir, self.get_entry_dir(key))
+            if entry_lock.acquire(blocking=False):
+                try:
+                    logging.info("Removing autoconf cache entry %s for an earlier version of %s",
+                                 key, c_compiler)
+                    rm_rf(self.get_entry_dir(key))
+                finally:
+                    entry_lock.release()
+
+    def prepare(self, private_dir: str, build_dir: str, c_compilers: List[str]) -> str:
+        """
+        Copies the shared cache entry into private_dir and writes a config.site file using it.
+        Returns the path of the config.site file.
+        """
+        self.remove_entries_for_changed_compiler()
+        cache_files_dir = os.path.join(private_dir, 'cache')
+        rm_rf(private_dir)
+        mkdir_p(cache_files_dir)
+        entry_dir = self.get_entry_dir()
+        num_files = 0
+        with get_path_lock(self.install_parent_dir, entry_dir):
+            if os.path.isdir(entry_dir):
+                for file_name in os.listdir(entry_dir):
+                    if file_name.endswith(CACHE_FILE_SUFFIX):
+                        shutil.copy2(os.path.join(entry_dir, file_name), cache_files_dir)
+                        num_files += 1
+        logging.info("Using autoconf cache entry %s with %d cache files", self.key, num_files)
+        config_site_path = os.path.join(private_dir, CONFIG_SITE_FILE_NAME)
+        with open(config_site_path, 'w') as config_site_file:
+            config_site_file.write(get_config_site_content(
+                c_compilers, build_dir, cache_files_dir))
+        return config_site_path
+
+    def merge_back(self, private_dir: str, build_specific_paths: List[str]) -> None:
+        """
+        Adds the cache files created by this build to the shared cache entry. Existing files in
+        the shared entry are kept.
+        """
+        cache_files_dir = os.path.join(private_dir, 'cache')
+        entry_dir = self.get_entry_dir()
+        num_new_files = 0
+        with get_path_lock(self.install_parent_dir, entry_dir):
+            mkdir_p(entry_dir)
+            for file_name in sorted(os.listdir(cache_files_dir)):
+                shared_path = os.path.join(entry_dir, file_name)
+                if os.path.exists(shared_path):
+                    continue
+                with open(os.path.join(cache_files_dir, file_name)) as cache_file:
+                    content = filter_cache_file_content(cache_file.read(), build_specific_paths)
+                write_file_atomically(shared_path, content)
+                num_new_files += 1
+            write_file_atomically(
+                os.path.join(entry_dir, METADATA_FILE_NAME),
+                json.dumps({'key_inputs': self.key_inputs}, indent=2, sort_keys=True) + '\n')
+        logging.info("Added %d cache files to autoconf cache entry %s", num_new_files, self.key)
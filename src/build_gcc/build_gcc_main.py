@@ -1,16 +1,40 @@
 #!/usr/bin/env python3
 
+import importlib
 import logging
+import sys
 
 from build_gcc.gcc_builder import GCCBuilder
 
 
+# Maps each subcommand to the module and the function implementing it. The function takes the
+# remaining command line arguments and returns the exit code. Modules are imported only when their
+# subcommand is used. Without a subcommand, GCC is built.
+SUBCOMMANDS = {
+    'verify': ('build_gcc.manifest', 'verify_main'),
+    'fetch': ('build_gcc.fetch', 'fetch_main'),
+    'gc': ('build_gcc.garbage_collector', 'gc_main'),
+    'registry': ('build_gcc.registry', 'registry_main'),
+    'serve': ('build_gcc.build_service', 'serve_main'),
+    'submit': ('build_gcc.build_service', 'submit_main'),
+}
+
+
 def main() -> None:
     logging.basicConfig(
         level=logging.INFO,
         format="[%(filename)s:%(lineno)d] %(asctime)s %(levelname)s: %(message)s")
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        module_name, function_name = SUBCOMMANDS[sys.argv[1]]
+        subcommand_main = getattr(importlib.import_module(module_name), function_name)
+        sys.exit(subcommand_main(sys.argv[2:]))
+
     builder = GCCBuilder()
     builder.parse_args()
+    if builder.args.plan:
+        from build_gcc.build_plan import print_build_plan
+        print_build_plan(builder.args, builder.build_conf)
+        return
     builder.run()
 
 
@@ -0,0 +1,296 @@
+"""
+A local SQLite database of earlier GCC builds on this host. It is used to estimate the progress of
+the current build and to check the disk and memory requirements before a build starts. It also
+keeps the run times of the parts of the GCC testsuite, used to balance the testsuite shards.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from build_gcc.helpers import get_cache_dir, mkdir_p
+from build_gcc.host_facts import is_macos
+
+
+BUILD_HISTORY_FILE_NAME = 'build_history.sqlite'
+
+# How many earlier builds to consider when estimating progress and requirements.
+NUM_RECENT_BUILDS = 5
+
+# Safety margins applied to the largest disk and memory usage seen in earlier builds.
+DISK_SPACE_SAFETY_FACTOR = 1.2
+MEMORY_SAFETY_FACTOR = 1.2
+
+CREATE_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    gcc_version TEXT NOT NULL,
+    profile TEXT NOT NULL,
+    target_arch TEXT NOT NULL,
+    parallelism INTEGER NOT NULL,
+    start_time REAL NOT NULL,
+    elapsed_time_sec REAL NOT NULL,
+    num_compiled_files INTEGER NOT NULL,
+    stages_json TEXT NOT NULL,
+    disk_usage_bytes INTEGER,
+    max_rss_bytes INTEGER,
+    success INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS builds_by_config ON builds (gcc_version, profile, target_arch);
+CREATE TABLE IF NOT EXISTS testsuite_unit_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    gcc_version TEXT NOT NULL,
+    target_arch TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    run_time REAL NOT NULL,
+    elapsed_time_sec REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS testsuite_unit_runs_by_config
+    ON testsuite_unit_runs (gcc_version, target_arch);
+"""
+
+
+class StageRecord:
+    """
+    The start of a build stage, relative to the start of the build.
+    """
+    name: str
+    start_offset_sec: float
+    start_num_compiled_files: int
+
+    def __init__(self, name: str, start_offset_sec: float, start_num_compiled_files: int) -> None:
+        self.name = name
+        self.start_offset_sec = start_offset_sec
+        self.start_num_compiled_files = start_num_compiled_files
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'start_offset_sec': self.start_offset_sec,
+            'start_num_compiled_files': self.start_num_compiled_files,
+        }
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> 'StageRecord':
+        return StageRecord(
+            name=d['name'],
+            start_offset_sec=d['start_offset_sec'],
+            start_num_compiled_files=d['start_num_compiled_files'])
+
+
+class BuildRecord:
+    gcc_version: str
+    profile: str
+    target_arch: str
+    parallelism: int
+    start_time: float
+    elapsed_time_sec: float
+    num_compiled_files: int
+    stages: List[StageRecord]
+    disk_usage_bytes: Optional[int]
+    max_rss_bytes: Optional[int]
+    success: bool
+
+    def __init__(
+            self,
+            gcc_version: str,
+            profile: str,
+            target_arch: str,
+            parallelism: int,
+            start_time: float,
+            elapsed_time_sec: float,
+            num_compiled_files: int,
+            stages: List[StageRecord],
+            disk_usage_bytes: Optional[int],
+            max_rss_bytes: Optional[int],
+            success: bool) -> None:
+        self.gcc_version = gcc_version
+        self.profile = profile
+        self.target_arch = target_arch
+        self.parallelism = parallelism
+        self.start_time = start_time
+        self.elapsed_time_sec = elapsed_time_sec
+        self.num_compiled_files = num_compiled_files
+        self.stages = stages
+        self.disk_usage_bytes = disk_usage_bytes
+        self.max_rss_bytes = max_rss_bytes
+        self.success = success
+
+    def find_stage(self, stage_name: str) -> Optional[int]:
+        for i, stage in enumerate(self.stages):
+            if stage.name == stage_name:
+                return i
+        return None
+
+
+class BuildHistory:
+    db_path: str
+
+    def __init__(self, db_path: Optional[str] = None) -> None:
+        self.db_path = db_path or os.path.join(get_cache_dir(), BUILD_HISTORY_FILE_NAME)
+        mkdir_p(os.path.dirname(self.db_path))
+        with self.connect() as connection:
+            connection.executescript(CREATE_TABLES_SQL)
+
+    def connect(self) -> sqlite3.Connection:
+        # Concurrent builds on the same host may write to the database at the same time.
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    def add_build(self, build: BuildRecord) -> None:
+        with self.connect() as connection:
+            connection.execute(
+                """
+                INSERT INTO builds (
+                    gcc_version, profile, target_arch, parallelism, start_time,
+                    elapsed_time_sec, num_compiled_files, stages_json, disk_usage_bytes,
+                    max_rss_bytes, success
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (build.gcc_version, build.profile, build.target_arch, build.parallelism,
+                 build.start_time, build.elapsed_time_sec, build.num_compiled_files,
+                 json.dumps([stage.to_dict() for stage in build.stages]),
+                 build.disk_usage_bytes, build.max_rss_bytes, int(build.success)))
+
+    def get_recent_builds(
+            self,
+            gcc_version: str,
+            profile: str,
+            target_arch: str,
+            limit: int = NUM_RECENT_BUILDS) -> List[BuildRecord]:
+        """
+        Returns the most recent successful builds of the given configuration, newest first.
+        """
+        with self.connect() as connection:
+            rows = connection.execute(
+                """
+                SELECT gcc_version, profile, target_arch, parallelism, start_time,
+                       elapsed_time_sec, num_compiled_files, stages_json, disk_usage_bytes,
+                       max_rss_bytes, success
+                FROM builds
+                WHERE gcc_version = ? AND profile = ? AND target_arch = ? AND success = 1
+                ORDER BY start_time DESC
+                LIMIT ?
+                """,
+                (gcc_version, profile, target_arch, limit)).fetchall()
+        return [
+            BuildRecord(
+                gcc_version=row[0],
+                profile=row[1],
+                target_arch=row[2],
+                parallelism=row[3],
+                start_time=row[4],
+                elapsed_time_sec=row[5],
+                num_compiled_files=row[6],
+                stages=[StageRecord.from_dict(d) for d in json.loads(row[7])],
+                disk_usage_bytes=row[8],
+                max_rss_bytes=row[9],
+                success=bool(row[10]))
+            for row in rows
+        ]
+
+    def add_testsuite_unit_times(
+            self,
+            gcc_version: str,
+            target_arch: str,
+            unit_times: Dict[Tuple[str, str], float]) -> None:
+        run_time = time.time()
+        with self.connect() as connection:
+            connection.executemany(
+                """
+                INSERT INTO testsuite_unit_runs (
+                    gcc_version, target_arch, tool, unit, run_time, elapsed_time_sec
+                ) VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [(gcc_version, target_arch, tool, unit, run_time, elapsed_time_sec)
+                 for (tool, unit), elapsed_time_sec in unit_times.items()])
+
+    def get_testsuite_unit_times(
+            self,
+            gcc_version: str,
+            target_arch: str) -> Dict[Tuple[str, str], float]:
+        """
+        Returns the most recent run time of each testsuite unit, keyed by tool and unit name.
+        """
+        with self.connect() as connection:
+            rows = connection.execute(
+                """
+                SELECT tool, unit, elapsed_time_sec
+                FROM testsuite_unit_runs
+                WHERE gcc_version = ? AND target_arch = ?
+                ORDER BY run_time
+                """,
+                (gcc_version, target_arch)).fetchall()
+        # Later runs overwrite earlier ones.
+        return {(row[0], row[1]): row[2] for row in rows}
+
+
+def get_available_memory_bytes() -> Optional[int]:
+    if is_macos():
+        return int(subprocess.check_output(['sysctl', '-n', 'hw.memsize']).strip())
+    if not os.path.exists('/proc/meminfo'):
+        return None
+    with open('/proc/meminfo') as meminfo_file:
+        for line in meminfo_file:
+            items = line.split()
+            if items[0] == 'MemAvailable:':
+                return int(items[1]) * 1024
+    return None
+
+
+def get_nearest_existing_dir(dir_path: str) -> str:
+    dir_path = os.path.abspath(dir_path)
+    while not os.path.exists(dir_path):
+        dir_path = os.path.dirname(dir_path)
+    return dir_path
+
+
+def check_build_requirements(
+        recent_builds: List[BuildRecord],
+        install_parent_dir: str,
+        parallelism: int) -> None:
+    """
+    Compares the disk and memory usage of earlier builds of the same configuration with what is
+    available on this host. Raises an error if there is not enough disk space, and warns if there
+    might not be enough memory.
+
+    The memory usage recorded for a build is the peak of its largest single process (ru_maxrss of
+    the children), so it is multiplied by the parallelism of this build, assuming that many
+    processes of that size may run at the same time.
+    """
+    if not recent_builds:
+        logging.info("No earlier builds of this configuration, skipping the requirements check")
+        return
+
+    disk_usages = [b.disk_usage_bytes for b in recent_builds if b.disk_usage_bytes]
+    if disk_usages:
+        required_disk_bytes = int(max(disk_usages) * DISK_SPACE_SAFETY_FACTOR)
+        free_disk_bytes = shutil.disk_usage(get_nearest_existing_dir(install_parent_dir)).free
+        logging.info(
+            "Disk space: %.1f GiB required based on earlier builds, %.1f GiB free in %s",
+            required_disk_bytes / 1024 ** 3, free_disk_bytes / 1024 ** 3, install_parent_dir)
+        if free_disk_bytes < required_disk_bytes:
+            raise IOError(
+                "Not enough disk space in %s: %d bytes free, %d bytes required" % (
+                    install_parent_dir, free_disk_bytes, required_disk_bytes))
+
+    max_rss_values = [b.max_rss_bytes for b in recent_builds if b.max_rss_bytes]
+    available_memory_bytes = get_available_memory_bytes()
+    if max_rss_values and available_memory_bytes is not None:
+        required_memory_bytes = int(max(max_rss_values) * parallelism * MEMORY_SAFETY_FACTOR)
+        logging.info(
+            "Memory: the largest process of earlier builds used %.1f GiB, %.1f GiB required "
+            "with parallelism %d, %.1f GiB available",
+            max(max_rss_values) / 1024 ** 3, required_memory_bytes / 1024 ** 3, parallelism,
+            available_memory_bytes / 1024 ** 3)
+        if available_memory_bytes < required_memory_bytes:
+            logging.warning(
+                "Available memory (%d bytes) may not be enough for this build (%d bytes "
+                "required), consider reducing --parallelism",
+                available_memory_bytes, required_memory_bytes)
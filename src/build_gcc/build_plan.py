@@ -0,0 +1,77 @@
+"""
+Computes the fully resolved build plan (tag, directories, configure and make command lines)
+without cloning or building anything. Used by the --plan mode.
+"""
+
+import argparse
+import json
+import os
+
+from typing import Any, Dict, Optional
+
+from build_gcc.devtoolset import activate_devtoolset
+from build_gcc.gcc_build_conf import GCCBuildConf
+from build_gcc.host_facts import get_compiler_facts, get_host_facts
+from build_gcc.prerequisites import (
+    get_download_prerequisites_path,
+    get_prerequisite_versions,
+    get_prerequisites_prefix_dir,
+)
+
+
+def get_planned_prerequisites_prefix(
+        args: argparse.Namespace, build_conf: GCCBuildConf) -> Optional[str]:
+    """
+    Returns the prebuilt prerequisites prefix the build would use, without building it. The
+    library versions are read from the source tree if it has already been cloned, and are replaced
+    with a placeholder otherwise.
+    """
+    if not args.use_prebuilt_prerequisites:
+        return None
+    gcc_clone_dir = build_conf.get_gcc_clone_dir()
+    versions = None
+    if os.path.exists(get_download_prerequisites_path(gcc_clone_dir)):
+        versions = get_prerequisite_versions(gcc_clone_dir)
+    return get_prerequisites_prefix_dir(
+        build_conf.install_parent_dir, versions, get_host_facts().short_os_name_and_version,
+        build_conf.target_arch)
+
+
+def get_build_plan(args: argparse.Namespace, build_conf: GCCBuildConf) -> Dict[str, Any]:
+    # The compilers we would use depend on the devtoolset being active.
+    activate_devtoolset()
+    compiler_facts = get_compiler_facts()
+    prerequisites_prefix = get_planned_prerequisites_prefix(args, build_conf)
+
+    return {
+        'gcc_version': build_conf.version,
+        'tag': build_conf.get_tag(),
+        'target_arch': build_conf.target_arch,
+        'host': get_host_facts().to_dict(),
+        'compilers': compiler_facts.to_dict(),
+        'directories': {
+            'build_parent': build_conf.get_gcc_build_parent_dir(),
+            'source': build_conf.get_gcc_clone_dir(),
+            'build': build_conf.get_gcc_build_dir(),
+            'install': build_conf.get_final_install_dir(),
+            'install_prefix': build_conf.get_install_prefix(),
+            'build_info': build_conf.get_gcc_build_info_dir(),
+        },
+        'archive_path': build_conf.get_archive_path(),
+        'clone_url': f'https://github.com/{args.github_org}/gcc.git',
+        'git_tag': 'releases/gcc-%s' % build_conf.version,
+        'patch_series': (
+            build_conf.patch_series.to_dict() if build_conf.patch_series is not None else None),
+        'prerequisites_prefix': prerequisites_prefix,
+        'configure_cmd_line': build_conf.get_configure_cmd_line(
+            compiler_facts.c_compiler, compiler_facts.cxx_compiler, prerequisites_prefix),
+        'make_build_cmd_line': build_conf.get_make_build_args(),
+        'make_install_cmd_line': build_conf.get_make_install_args(),
+        'clean_build': build_conf.clean_build,
+        'skip_build': args.skip_build,
+        'skip_upload': args.skip_upload,
+    }
+
+
+def print_build_plan(args: argparse.Namespace, build_conf: GCCBuildConf) -> None:
+    print(json.dumps(get_build_plan(args, build_conf), indent=2, sort_keys=True))
@@ -0,0 +1,250 @@
+"""
+Tracks the progress of a GCC bootstrap by parsing make output. Detects bootstrap stage transitions
+and counts compiled files, and estimates the percentage complete and the remaining time based on
+earlier builds of the same configuration.
+"""
+
+import logging
+import re
+import resource
+import threading
+import time
+
+from typing import List, Optional, Tuple
+
+from build_gcc.build_history import BuildRecord, StageRecord
+from build_gcc.host_facts import is_macos
+
+
+# Build stages in the order they happen in a profiledbootstrap. Plain bootstraps use stage2 and
+# stage3 instead of the profile, train and feedback stages.
+BUILD_STAGES = [
+    'configure',
+    'stage1',
+    'stage2',
+    'stageprofile',
+    'stagetrain',
+    'stage3',
+    'stagefeedback',
+    'target-libs',
+    'install',
+]
+
+# E.g. "Configuring stage 1 in ./libiberty" or "Configuring stage feedback in ./gcc".
+CONFIGURING_STAGE_RE = re.compile(r'^Configuring stage (\w+) in ')
+
+# E.g. "Configuring in x86_64-pc-linux-gnu/libgomp", for target libraries that are only built
+# once, after the final stage. Host directories are printed with a leading "./" instead.
+CONFIGURING_TARGET_LIB_RE = re.compile(r'^Configuring in (\./)?[^/\s]+-[^/\s]+-[^/\s]+/lib')
+
+SOURCE_FILE_RE = re.compile(r'\S+\.(?:c|cc|cpp|cxx|C)(?:\s|$)')
+COMPILE_FLAG_RE = re.compile(r'(?:^|\s)-c(?:\s|$)')
+
+PROGRESS_REPORT_INTERVAL_SEC = 60
+
+# The window over which the current compilation throughput is computed.
+THROUGHPUT_WINDOW_SEC = 120
+
+
+def is_compile_command(line: str) -> bool:
+    """
+    >>> is_compile_command('g++ -fno-PIE -c -g -O2 -I. ../../src/gcc/gcc/tree.cc -o tree.o')
+    True
+    >>> is_compile_command('g++ -o cc1plus c-lang.o tree.o')
+    False
+    >>> is_compile_command('/bin/sh ./libtool --mode=compile gcc -c foo.c')
+    False
+    """
+    if '--mode=compile' in line:
+        # Libtool echoes the commands it actually runs, count those instead.
+        return False
+    return bool(COMPILE_FLAG_RE.search(line) and SOURCE_FILE_RE.search(line))
+
+
+def parse_stage_transition(line: str) -> Optional[str]:
+    """
+    >>> parse_stage_transition('Configuring stage profile in ./gcc')
+    'stageprofile'
+    >>> parse_stage_transition('Configuring stage 1 in ./libiberty')
+    'stage1'
+    >>> parse_stage_transition('Configuring in x86_64-pc-linux-gnu/libgomp')
+    'target-libs'
+    >>> parse_stage_transition('Configuring in ./x86_64-pc-linux-gnu/libstdc++-v3')
+    'target-libs'
+    >>> parse_stage_transition('Configuring in ./lto-plugin')
+    """
+    match = CONFIGURING_STAGE_RE.match(line)
+    if match:
+        stage_name = 'stage' + match.group(1)
+        if stage_name in BUILD_STAGES:
+            return stage_name
+        return None
+    if CONFIGURING_TARGET_LIB_RE.match(line):
+        return 'target-libs'
+    return None
+
+
+def format_duration(seconds: float) -> str:
+    """
+    >>> format_duration(3725.2)
+    '1:02:05'
+    """
+    seconds_int = int(seconds)
+    return '%d:%02d:%02d' % (seconds_int // 3600, seconds_int // 60 % 60, seconds_int % 60)
+
+
+def get_max_child_rss_bytes() -> int:
+    """
+    The peak resident set size of the largest single child process, not of all of them together.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux.
+    return max_rss if is_macos() else max_rss * 1024
+
+
+class BuildProgressTracker:
+    # The most recent earlier build of the same configuration, if any.
+    reference_build: Optional[BuildRecord]
+
+    start_time_sec: float
+    stages: List[StageRecord]
+    num_compiled_files: int
+
+    # Times of recent compile commands, for computing the current throughput.
+    recent_compile_times: List[float]
+
+    last_report_time_sec: float
+    lock: threading.Lock
+
+    def __init__(self, reference_build: Optional[BuildRecord]) -> None:
+        self.reference_build = reference_build
+        self.start_time_sec = time.time()
+        self.stages = []
+        self.num_compiled_files = 0
+        self.recent_compile_times = []
+        self.last_report_time_sec = self.start_time_sec
+        self.lock = threading.Lock()
+        self.set_stage('configure')
+
+    def get_current_stage(self) -> str:
+        return self.stages[-1].name
+
+    def set_stage(self, stage_name: str) -> None:
+        with self.lock:
+            if self.stages and (BUILD_STAGES.index(stage_name) <=
+                                BUILD_STAGES.index(self.get_current_stage())):
+                # Stages only move forward. Sub-directories of the same stage are configured one
+                # after another.
+                return
+            self.stages.append(StageRecord(
+                name=stage_name,
+                start_offset_sec=time.time() - self.start_time_sec,
+                start_num_compiled_files=self.num_compiled_files))
+        logging.info("Build stage: %s", stage_name)
+        self.report_progress()
+
+    def handle_output_line(self, line: str) -> None:
+        stage_name = parse_stage_transition(line)
+        if stage_name is not None:
+            self.set_stage(stage_name)
+        elif is_compile_command(line):
+            current_time_sec = time.time()
+            with self.lock:
+                self.num_compiled_files += 1
+                self.recent_compile_times.append(current_time_sec)
+            if current_time_sec - self.last_report_time_sec >= PROGRESS_REPORT_INTERVAL_SEC:
+                self.report_progress()
+
+    def get_throughput(self) -> float:
+        """
+        Returns the number of files compiled per second over the recent time window.
+        """
+        current_time_sec = time.time()
+        with self.lock:
+            self.recent_compile_times = [
+                t for t in self.recent_compile_times
+                if t >= current_time_sec - THROUGHPUT_WINDOW_SEC
+            ]
+            num_recent = len(self.recent_compile_times)
+        window_sec = min(THROUGHPUT_WINDOW_SEC, current_time_sec - self.start_time_sec)
+        return num_recent / window_sec if window_sec > 0 else 0.0
+
+    def get_reference_position_sec(self) -> Optional[float]:
+        """
+        Returns the point in time of the reference build that corresponds to the current progress
+        of this build, based on the current stage and the number of files compiled in it.
+        """
+        reference_build = self.reference_build
+        if reference_build is None:
+            return None
+        stage_index = reference_build.find_stage(self.get_current_stage())
+        if stage_index is None:
+            return None
+        stage = reference_build.stages[stage_index]
+        if stage_index + 1 < len(reference_build.stages):
+            next_stage = reference_build.stages[stage_index + 1]
+            stage_end_offset_sec = next_stage.start_offset_sec
+            stage_end_num_files = next_stage.start_num_compiled_files
+        else:
+            stage_end_offset_sec = reference_build.elapsed_time_sec
+            stage_end_num_files = reference_build.num_compiled_files
+
+        files_in_stage = self.num_compiled_files - self.stages[-1].start_num_compiled_files
+        reference_files_in_stage = stage_end_num_files - stage.start_num_compiled_files
+        fraction_of_stage = 0.0
+        if reference_files_in_stage > 0:
+            fraction_of_stage = min(1.0, files_in_stage / reference_files_in_stage)
+        return stage.start_offset_sec + fraction_of_stage * (
+            stage_end_offset_sec - stage.start_offset_sec)
+
+    def get_percent_and_eta(self) -> Tuple[float, Optional[float]]:
+        elapsed_time_sec = time.time() - self.start_time_sec
+        reference_position_sec = self.get_reference_position_sec()
+        if (reference_position_sec is None or self.reference_build is None or
+                self.reference_build.elapsed_time_sec <= 0):
+            # Without an earlier build, all we know is the stage.
+            stage_index = BUILD_STAGES.index(self.get_current_stage())
+            return 100.0 * stage_index / len(BUILD_STAGES), None
+
+        reference_elapsed_time_sec = self.reference_build.elapsed_time_sec
+        percent = min(99.9, 100.0 * reference_position_sec / reference_elapsed_time_sec)
+        eta_sec = None
+        if reference_position_sec > 0 and elapsed_time_sec > 0:
+            # How fast this build is going compared to the reference build.
+            speed_ratio = reference_position_sec / elapsed_time_sec
+            eta_sec = (reference_elapsed_time_sec - reference_position_sec) / speed_ratio
+        return percent, eta_sec
+
+    def report_progress(self) -> None:
+        self.last_report_time_sec = time.time()
+        percent, eta_sec = self.get_percent_and_eta()
+        logging.info(
+            "Build progress: stage %s, %.1f%% complete, %d files compiled, %.1f files/min, "
+            "elapsed %s, ETA %s",
+            self.get_current_stage(),
+            percent,
+            self.num_compiled_files,
+            self.get_throughput() * 60,
+            format_duration(self.last_report_time_sec - self.start_time_sec),
+            format_duration(eta_sec) if eta_sec is not None else 'unknown')
+
+    def create_build_record(
+            self,
+            gcc_version: str,
+            profile: str,
+            target_arch: str,
+            parallelism: int,
+            disk_usage_bytes: Optional[int],
+            success: bool) -> BuildRecord:
+        return BuildRecord(
+            gcc_version=gcc_version,
+            profile=profile,
+            target_arch=target_arch,
+            parallelism=parallelism,
+            start_time=self.start_time_sec,
+            elapsed_time_sec=time.time() - self.start_time_sec,
+            num_compiled_files=self.num_compiled_files,
+            stages=list(self.stages),
+            disk_usage_bytes=disk_usage_bytes,
+            max_rss_bytes=get_max_child_rss_bytes(),
+            success=success)
@@ -0,0 +1,435 @@
+"""
+A long-running local build service and its client. The service listens on a local HTTP port,
+accepts build requests with the same arguments as build_gcc.sh, and runs them on a queue with a
+limited number of concurrent builds. A request identical to a queued or running one is merged
+into it instead of starting another build.
+
+The service keeps an index of the GCC source checkouts under the install parent directory, so
+that builds it starts are told which checkout to clone from instead of searching for one, and
+keeps the host facts cache warm. Each build runs in a separate process, so that the state of one
+build (environment variables, atexit handlers) cannot leak into another one.
+
+Endpoints:
+  POST /builds               Submit a build. The body is {"args": [...]}.
+  GET  /builds               List all builds known to the service.
+  GET  /builds/<id>          Status of one build.
+  GET  /builds/<id>/log      Stream the build log, starting at the byte offset given by the
+                             "offset" query parameter, until the build finishes.
+"""
+
+import argparse
+import concurrent.futures
+import http.server
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from build_gcc.cmd_line_args import parse_args
+from build_gcc.constants import DEFAULT_INSTALL_PARENT_DIR
+from build_gcc.git_helpers import find_gcc_source_checkouts, get_tags_at_head
+from build_gcc.helpers import get_current_timestamp_str, mkdir_p
+from build_gcc.host_facts import get_host_facts
+
+
+DEFAULT_BUILD_SERVICE_PORT = 8742
+BUILD_SERVICE_URL_ENV_VAR_NAME = 'BUILD_GCC_SERVICE_URL'
+
+BUILD_STATUS_QUEUED = 'queued'
+BUILD_STATUS_RUNNING = 'running'
+BUILD_STATUS_SUCCEEDED = 'succeeded'
+BUILD_STATUS_FAILED = 'failed'
+
+# How long a log streaming request waits for new output before checking the file again.
+LOG_POLL_INTERVAL_SEC = 1.0
+LOG_CHUNK_SIZE = 65536
+
+BUILD_GCC_MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build_gcc_main.py')
+BUILD_GCC_SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_default_build_service_url() -> str:
+    return os.environ.get(BUILD_SERVICE_URL_ENV_VAR_NAME) or (
+        'http://127.0.0.1:%d' % DEFAULT_BUILD_SERVICE_PORT)
+
+
+class ServiceBuild:
+    """
+    A build started by the service. Any number of identical requests may be merged into it.
+    """
+    build_id: str
+    args: List[str]
+    dedup_key: str
+    gcc_version: str
+    log_path: str
+
+    status: str
+    num_requests: int
+    submit_time: float
+    start_time: Optional[float]
+    end_time: Optional[float]
+    exit_code: Optional[int]
+    clone_from: Optional[str]
+
+    # Notified when the build writes more output or finishes.
+    condition: threading.Condition
+
+    def __init__(
+            self,
+            build_id: str,
+            args: List[str],
+            dedup_key: str,
+            gcc_version: str,
+            log_path: str) -> None:
+        self.build_id = build_id
+        self.args = args
+        self.dedup_key = dedup_key
+        self.gcc_version = gcc_version
+        self.log_path = log_path
+        self.status = BUILD_STATUS_QUEUED
+        self.num_requests = 1
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self.exit_code = None
+        self.clone_from = None
+        self.condition = threading.Condition()
+
+    def is_finished(self) -> bool:
+        return self.status in (BUILD_STATUS_SUCCEEDED, BUILD_STATUS_FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.build_id,
+            'args': self.args,
+            'gcc_version': self.gcc_version,
+            'status': self.status,
+            'num_requests': self.num_requests,
+            'submit_time': self.submit_time,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'exit_code': self.exit_code,
+            'clone_from': self.clone_from,
+            'log_path': self.log_path,
+        }
+
+
+class SourceCheckoutIndex:
+    """
+    Maps git tags to the GCC source checkouts under the install parent directory that are at that
+    tag. Refreshed when the service starts and after every build.
+    """
+    install_parent_dir: str
+    checkouts_by_tag: Dict[str, List[str]]
+    lock: threading.Lock
+
+    def __init__(self, install_parent_dir: str) -> None:
+        self.install_parent_dir = install_parent_dir
+        self.checkouts_by_tag = {}
+        self.lock = threading.Lock()
+
+    def refresh(self) -> None:
+        start_time_sec = time.time()
+        checkouts_by_tag: Dict[str, List[str]] = {}
+        for src_dir in find_gcc_source_checkouts(self.install_parent_dir):
+            for tag_name in get_tags_at_head(src_dir):
+                checkouts_by_tag.setdefault(tag_name, []).append(src_dir)
+        with self.lock:
+            self.checkouts_by_tag = checkouts_by_tag
+        logging.info("Indexed GCC source checkouts of %d tags in %.1f seconds",
+                     len(checkouts_by_tag), time.time() - start_time_sec)
+
+    def get_checkout(self, tag_name: str) -> Optional[str]:
+        with self.lock:
+            for src_dir in self.checkouts_by_tag.get(tag_name, []):
+                if os.path.isdir(src_dir):
+                    return src_dir
+        return None
+
+
+class BuildService:
+    install_parent_dir: str
+    log_dir: str
+    executor: concurrent.futures.ThreadPoolExecutor
+    checkout_index: SourceCheckoutIndex
+
+    builds: Dict[str, ServiceBuild]
+    lock: threading.Lock
+
+    def __init__(self, install_parent_dir: str, max_concurrent_builds: int) -> None:
+        self.install_parent_dir = install_parent_dir
+        self.log_dir = os.path.expanduser('~/logs')
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent_builds)
+        self.checkout_index = SourceCheckoutIndex(install_parent_dir)
+        self.builds = {}
+        self.lock = threading.Lock()
+
+    def warm_up(self) -> None:
+        get_host_facts()
+        self.checkout_index.refresh()
+
+    def submit(self, args: List[str]) -> Tuple[ServiceBuild, bool]:
+        """
+        Queues a build with the given command line arguments. Returns the build and whether the
+        request was merged into an identical build that is already queued or running.
+        """
+        parsed_args, build_conf = parse_args(args, exit_on_error=False)
+        # Identical requests may spell the arguments differently, so compare the parsed values.
+        # The patch series is compared by contents, which may change under the same path.
+        dedup_key = json.dumps(dict(
+            vars(parsed_args),
+            patch_series=(build_conf.patch_series.get_hash()
+                          if build_conf.patch_series is not None else None)),
+            sort_keys=True, default=str)
+        with self.lock:
+            for build in self.builds.values():
+                if build.dedup_key == dedup_key and not build.is_finished():
+                    build.num_requests += 1
+                    logging.info("Merged a build request into build %s", build.build_id)
+                    return build, True
+            build_id = uuid.uuid4().hex[:12]
+            build = ServiceBuild(
+                build_id=build_id,
+                args=args,
+                dedup_key=dedup_key,
+                gcc_version=build_conf.version,
+                log_path=os.path.join(
+                    self.log_dir,
+                    'build_gcc_%s_%s.log' % (get_current_timestamp_str(), build_id)))
+            self.builds[build_id] = build
+        logging.info("Queued build %s with arguments %s", build_id, args)
+        self.executor.submit(self.run_build, build)
+        return build, False
+
+    def get_build(self, build_id: str) -> Optional[ServiceBuild]:
+        with self.lock:
+            return self.builds.get(build_id)
+
+    def list_builds(self) -> List[ServiceBuild]:
+        with self.lock:
+            return sorted(self.builds.values(), key=lambda build: build.submit_time)
+
+    def run_build(self, build: ServiceBuild) -> None:
+        cmd_line = [sys.executable, BUILD_GCC_MAIN_PATH] + build.args
+        build.clone_from = self.checkout_index.get_checkout('releases/gcc-%s' % build.gcc_version)
+        if build.clone_from:
+            cmd_line.append('--clone_from=%s' % build.clone_from)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = BUILD_GCC_SRC_DIR
+
+        mkdir_p(self.log_dir)
+        with build.condition:
+            build.status = BUILD_STATUS_RUNNING
+            build.start_time = time.time()
+        logging.info("Starting build %s, log: %s", build.build_id, build.log_path)
+        exit_code = -1
+        try:
+            with open(build.log_path, 'wb') as log_file:
+                process = subprocess.Popen(
+                    cmd_line, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+                assert process.stdout is not None
+                for line in process.stdout:
+                    log_file.write(line)
+                    log_file.flush()
+                    with build.condition:
+                        build.condition.notify_all()
+                exit_code = process.wait()
+        except Exception:
+            logging.exception("Failed to run build %s", build.build_id)
+        finally:
+            with build.condition:
+                build.exit_code = exit_code
+                build.end_time = time.time()
+                build.status = BUILD_STATUS_SUCCEEDED if exit_code == 0 else BUILD_STATUS_FAILED
+                build.condition.notify_all()
+        logging.info("Build %s %s with exit code %d", build.build_id, build.status, exit_code)
+        self.checkout_index.refresh()
+
+
+class BuildServiceRequestHandler(http.server.BaseHTTPRequestHandler):
+    server: 'BuildServiceHTTPServer'
+
+    def send_json(self, code: int, data: Any) -> None:
+        body = (json.dumps(data, indent=2, sort_keys=True) + '\n').encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, code: int, message: str) -> None:
+        self.send_json(code, {'error': message})
+
+    def do_POST(self) -> None:
+        if self.path != '/builds':
+            self.send_error_json(404, 'Not found: %s' % self.path)
+            return
+        try:
+            content_length = int(self.headers.get('Content-Length', '0'))
+            request = json.loads(self.rfile.read(content_length).decode('utf-8'))
+            args = request['args']
+            if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+                raise ValueError("args must be a list of strings")
+            build, deduplicated = self.server.build_service.submit(args)
+        except SystemExit:
+            # E.g. --help, which argparse handles by printing the help and exiting.
+            self.send_error_json(400, 'Invalid build arguments')
+            return
+        except Exception as ex:
+            # Checking the arguments may fail in many ways, e.g. a patch series that does not
+            # exist or an unsupported GCC version.
+            logging.info("Rejected a build request: %s", ex)
+            self.send_error_json(400, str(ex) or type(ex).__name__)
+            return
+        self.send_json(200, dict(build.to_dict(), deduplicated=deduplicated))
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlparse(self.path)
+        path_items = [item for item in url.path.split('/') if item]
+        if path_items == ['builds']:
+            self.send_json(
+                200, [build.to_dict() for build in self.server.build_service.list_builds()])
+            return
+        if len(path_items) not in (2, 3) or path_items[0] != 'builds':
+            self.send_error_json(404, 'Not found: %s' % self.path)
+            return
+        build = self.server.build_service.get_build(path_items[1])
+        if build is None:
+            self.send_error_json(404, 'Unknown build: %s' % path_items[1])
+            return
+        if len(path_items) == 2:
+            self.send_json(200, build.to_dict())
+        elif path_items[2] == 'log':
+            query = urllib.parse.parse_qs(url.query)
+            self.stream_log(build, int(query.get('offset', ['0'])[0]))
+        else:
+            self.send_error_json(404, 'Not found: %s' % self.path)
+
+    def stream_log(self, build: ServiceBuild, offset: int) -> None:
+        """
+        Sends the build log from the given offset as it is being written, and closes the
+        connection when the build finishes.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.end_headers()
+        while True:
+            with build.condition:
+                if not os.path.exists(build.log_path) and not build.is_finished():
+                    build.condition.wait(LOG_POLL_INTERVAL_SEC)
+                    continue
+                finished = build.is_finished()
+            if os.path.exists(build.log_path):
+                with open(build.log_path, 'rb') as log_file:
+                    log_file.seek(offset)
+                    while True:
+                        chunk = log_file.read(LOG_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        self.wfile.write(chunk)
+                        offset += len(chunk)
+                self.wfile.flush()
+            if finished:
+                return
+            with build.condition:
+                if not build.is_finished():
+                    build.condition.wait(LOG_POLL_INTERVAL_SEC)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.info("%s - %s", self.address_string(), format % args)
+
+
+class BuildServiceHTTPServer(http.server.ThreadingHTTPServer):
+    build_service: BuildService
+
+    def __init__(self, port: int, build_service: BuildService) -> None:
+        # Only accept connections from this host.
+        super().__init__(('127.0.0.1', port), BuildServiceRequestHandler)
+        self.build_service = build_service
+
+
+def serve_main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog='build_gcc.sh serve',
+        description='Run a local GCC build service')
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=DEFAULT_BUILD_SERVICE_PORT,
+        help='Local port to listen on. Default: %d.' % DEFAULT_BUILD_SERVICE_PORT)
+    parser.add_argument(
+        '--install_parent_dir',
+        default=DEFAULT_INSTALL_PARENT_DIR,
+        help='Install parent directory to index source checkouts in. Default: %s' %
+             DEFAULT_INSTALL_PARENT_DIR)
+    parser.add_argument(
+        '--max_concurrent_builds',
+        type=int,
+        default=1,
+        help='Maximum number of builds to run at the same time. Default: 1.')
+    args = parser.parse_args(argv)
+
+    build_service = BuildService(args.install_parent_dir, args.max_concurrent_builds)
+    build_service.warm_up()
+    server = BuildServiceHTTPServer(args.port, build_service)
+    logging.info("Build service listening on http://127.0.0.1:%d", args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down the build service")
+    finally:
+        server.server_close()
+    return 0
+
+
+def submit_main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog='build_gcc.sh submit',
+        description='Submit a build to the local GCC build service and stream its log. All '
+                    'other arguments are passed to the build.')
+    parser.add_argument(
+        '--service_url',
+        default=get_default_build_service_url(),
+        help='URL of the build service. Default: $%s or http://127.0.0.1:%d' % (
+            BUILD_SERVICE_URL_ENV_VAR_NAME, DEFAULT_BUILD_SERVICE_PORT))
+    parser.add_argument(
+        '--no_wait',
+        action='store_true',
+        help='Exit after submitting the build instead of streaming its log.')
+    args, build_args = parser.parse_known_args(argv)
+
+    request = urllib.request.Request(
+        args.service_url + '/builds',
+        data=json.dumps({'args': build_args}).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST')
+    try:
+        with urllib.request.urlopen(request) as response:
+            build = json.load(response)
+    except urllib.error.HTTPError as ex:
+        logging.error("Build request failed: %s", ex.read().decode('utf-8').strip())
+        return 1
+    logging.info("%s build %s (status: %s)",
+                 'Joined identical' if build['deduplicated'] else 'Submitted',
+                 build['id'], build['status'])
+    if args.no_wait:
+        return 0
+
+    build_url = '%s/builds/%s' % (args.service_url, build['id'])
+    with urllib.request.urlopen(build_url + '/log?offset=0') as response:
+        for line in response:
+            sys.stdout.buffer.write(line)
+            sys.stdout.flush()
+    with urllib.request.urlopen(build_url) as response:
+        build = json.load(response)
+    logging.info("Build %s %s with exit code %s", build['id'], build['status'], build['exit_code'])
+    return 0 if build['status'] == BUILD_STATUS_SUCCEEDED else 1
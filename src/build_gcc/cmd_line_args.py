@@ -3,17 +3,26 @@ import os
 import logging
 import platform
 
-from typing import Tuple, Union
-
-from sys_detection import is_linux
+from typing import List, NoReturn, Optional, Tuple, Union
 
 from build_gcc.constants import (
     DEFAULT_INSTALL_PARENT_DIR,
     DEFAULT_GITHUB_ORG,
     GCC_VERSION_MAP,
 )
+from build_gcc.distributed_compile import (
+    DEFAULT_JOBS_PER_HOST,
+    parse_compile_hosts,
+    TRANSPORT_SSH,
+    TRANSPORTS,
+)
 from build_gcc.helpers import get_major_version
 from build_gcc.gcc_build_conf import GCCBuildConf
+from build_gcc.linkers import SUPPORTED_LINKERS, validate_lto_parallelism
+from build_gcc.patch_series import PatchSeries
+from build_gcc.publish import DEFAULT_PART_SIZE_MB
+from build_gcc.stage1_cache import DEFAULT_STAGE1_CACHE_MAX_SIZE_GB
+from build_gcc.testsuite import LOCAL_HOST, SUPPORTED_TESTSUITE_TOOLS
 
 
 def convert_bool_arg(value: Union[str, bool]) -> bool:
@@ -27,8 +36,31 @@ def convert_bool_arg(value: Union[str, bool]) -> bool:
     raise argparse.ArgumentTypeError(f"Boolean value expected. Got {value}.")
 
 
-def create_arg_parser() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser(description='Build GCC')
+def parse_testsuite_tools(value: str) -> List[str]:
+    tools = [item.strip() for item in value.split(',') if item.strip()]
+    for tool in tools:
+        if tool not in SUPPORTED_TESTSUITE_TOOLS:
+            raise argparse.ArgumentTypeError(
+                f"Unsupported testsuite {tool}, expected one of {SUPPORTED_TESTSUITE_TOOLS}")
+    return tools
+
+
+class ArgumentParsingError(ValueError):
+    pass
+
+
+class NonExitingArgumentParser(argparse.ArgumentParser):
+    """
+    Raises ArgumentParsingError on invalid arguments instead of printing the usage and exiting,
+    for parsing arguments that do not come from the command line of this process.
+    """
+    def error(self, message: str) -> NoReturn:
+        raise ArgumentParsingError(message)
+
+
+def create_arg_parser(exit_on_error: bool = True) -> argparse.ArgumentParser:
+    parser_class = argparse.ArgumentParser if exit_on_error else NonExitingArgumentParser
+    parser = parser_class(description='Build GCC')
     parser.add_argument(
         '--install_parent_dir',
         help='Parent directory of the final installation directory. Default: %s' %
@@ -75,6 +107,18 @@ def create_arg_parser() -> argparse.ArgumentParser:
         help='Continue build in an existing directory, e.g. '
              '/opt/yb-build/gcc/yb-gcc-v12.5.0-1618898532-d28af7c6-build. '
              'This helps when developing these scripts to avoid rebuilding from scratch.')
+    parser.add_argument(
+        '--clone_from',
+        help='Existing GCC source checkout to clone the code from, instead of searching the '
+             'install parent directory for one. Falls back to cloning from GitHub if the '
+             'checkout is not at the right tag.')
+    parser.add_argument(
+        '--patch_series',
+        help='Local patches to apply to the GCC source code after cloning: a directory of '
+             '.patch files applied in the order of their names, a directory with a quilt-style '
+             'series file, or a series file. The hash of the patches is added to the tag. With '
+             '--existing_build_dir, the source code is switched to the given patch series and '
+             'only the code affected by the change is rebuilt.')
     parser.add_argument(
         '--parallelism', '-j',
         type=int,
@@ -94,23 +138,178 @@ def create_arg_parser() -> argparse.ArgumentParser:
         '--skip_upload',
         help='Skip package upload',
         action='store_true')
+    parser.add_argument(
+        '--publish_url',
+        help='Publish the archive to this multipart upload target instead of a GitHub release: '
+             'a local directory or file:// URL, or an http(s):// URL of a server implementing the '
+             'protocol described in publish.py. The archive is uploaded while it is created, and '
+             'published after its checksum is verified by the target. An interrupted upload is '
+             'resumed by the next run.')
+    parser.add_argument(
+        '--publish_part_size_mb',
+        help='Size of the parts uploaded to --publish_url. Default: %d' % DEFAULT_PART_SIZE_MB,
+        type=float,
+        default=DEFAULT_PART_SIZE_MB)
 
     parser.add_argument(
         '--target_arch',
         help='Target architecture to build for.',
         choices=['x86_64', 'aarch64', 'arm64'])
 
+    parser.add_argument(
+        '--lto_parallelism',
+        help='Parallelism of the LTO links in the bootstrap stages: "jobserver" to share the '
+             'make job slots, "auto", or a number of LTRANS jobs. Default: jobserver.',
+        type=validate_lto_parallelism)
+    parser.add_argument(
+        '--lto_partitions',
+        help='Number of LTO partitions for the bootstrap links. Default: the GCC default.',
+        type=int)
+    parser.add_argument(
+        '--host_linker',
+        help='Linker to use for links done with the host compiler, e.g. in stage1.',
+        choices=SUPPORTED_LINKERS)
+    parser.add_argument(
+        '--bootstrap_linker',
+        help='Linker to use for links in the bootstrap stages (stage2 and later).',
+        choices=SUPPORTED_LINKERS)
+
+    parser.add_argument(
+        '--use_prebuilt_prerequisites',
+        help='Build GCC against a host-wide prefix of prebuilt gmp, mpfr, mpc and isl libraries '
+             '(built and cached on first use) instead of building them in-tree in every '
+             'bootstrap stage. Default: true.',
+        type=convert_bool_arg,
+        default=True)
+    parser.add_argument(
+        '--use_stage1_cache',
+        help='Seed the build directory from a cached stage1 build with the same source code, host '
+             'compiler and configure options other than the prefix, and store a stage1 snapshot '
+             'in the cache on a cache miss. Only used when the build directory does not exist '
+             'yet, or is deleted with --clean.',
+        action='store_true')
+    parser.add_argument(
+        '--stage1_cache_max_size_gb',
+        help='Disk budget of the stage1 cache. Least recently used entries are evicted when the '
+             'cache grows beyond it. Default: %d' % DEFAULT_STAGE1_CACHE_MAX_SIZE_GB,
+        type=float,
+        default=DEFAULT_STAGE1_CACHE_MAX_SIZE_GB)
+    parser.add_argument(
+        '--use_autoconf_cache',
+        help='Share the results of the autoconf checks of configure runs that use the host '
+             'compiler with other builds on this host with the same host compiler, GCC version '
+             'and configure options.',
+        action='store_true')
+
+    parser.add_argument(
+        '--distributed_compile_hosts',
+        help='Comma-separated list of hosts to distribute the stage1 compile jobs to, each '
+             'optionally followed by a colon and its maximum number of jobs (default: %d), e.g. '
+             'build1:16,build2. The hosts are accessed over ssh and must have the same host '
+             'compilers at the same paths. The later stages are built locally.' %
+             DEFAULT_JOBS_PER_HOST,
+        type=parse_compile_hosts)
+    parser.add_argument(
+        '--distributed_compile_transport',
+        help='How to run compile jobs on the distributed compile hosts. The local transport runs '
+             'them in local processes, for testing.',
+        choices=TRANSPORTS,
+        default=TRANSPORT_SSH)
+
+    parser.add_argument(
+        '--strip_installed_binaries',
+        help='Strip the executables installed into bin and libexec.',
+        action='store_true')
+    parser.add_argument(
+        '--dedup_installed_files',
+        help='Replace identical installed files with hard links to one of them.',
+        action='store_true')
+    parser.add_argument(
+        '--disk_budget_gb',
+        help='Disk budget of the install parent directory. Before the build, old build '
+             'directories, archives and installations are removed until the directory fits into '
+             'the budget minus the space this build is expected to need, as with the gc '
+             'subcommand.',
+        type=float)
+
+    parser.add_argument(
+        '--run_testsuite',
+        help='Run the GCC testsuites in parallel shards after the build. The upload waits for '
+             'the testsuite to finish.',
+        action='store_true')
+    parser.add_argument(
+        '--testsuite_tools',
+        help='Comma-separated list of testsuites to run. Default: %s' %
+             ','.join(SUPPORTED_TESTSUITE_TOOLS),
+        type=parse_testsuite_tools,
+        default=SUPPORTED_TESTSUITE_TOOLS)
+    parser.add_argument(
+        '--testsuite_hosts',
+        help='Comma-separated list of hosts to run testsuite shards on, one shard per entry. '
+             'Repeat a host to run several shards on it. Use %s for this host. Remote hosts are '
+             'accessed with ssh and must see the build directory at the same path. Default: one '
+             '%s entry per CPU used for the build.' % (LOCAL_HOST, LOCAL_HOST),
+        type=lambda value: [item.strip() for item in value.split(',') if item.strip()])
+    parser.add_argument(
+        '--testsuite_baseline_dir',
+        help='Directory with .sum files of an earlier testsuite run, e.g. the testsuite_results '
+             'directory of an earlier build. The build fails if there are new failures compared '
+             'to these results.')
+
+    parser.add_argument(
+        '--skip_preflight_check',
+        help='Do not check available disk space and memory against earlier builds of the same '
+             'configuration before building.',
+        action='store_true')
+
+    parser.add_argument(
+        '--only',
+        help='Comma-separated list of pipeline tasks to run, assuming the inputs of these tasks '
+             'have been produced by an earlier run. Requires --existing_build_dir or '
+             '--upload_earlier_build. The resolve_tag and prepare_release tasks, which resolve '
+             'and lock the directories and read the release credentials, are always run. Task '
+             'names: preflight_check, clone, '
+             'resolve_tag, save_git_log, compute_prerequisites, build, validate_arch, '
+             'run_testsuite, write_build_info, write_manifest, archive, compute_checksum, '
+             'register, prepare_release, upload, and with --publish_url, archive_and_upload '
+             'and publish instead of archive, compute_checksum, prepare_release and upload.',
+        type=lambda value: [item.strip() for item in value.split(',') if item.strip()])
+    parser.add_argument(
+        '--from',
+        dest='from_task',
+        help='Run the given pipeline task and all tasks that depend on it, and the tasks that '
+             'are always run (see --only). Requires --existing_build_dir or '
+             '--upload_earlier_build.')
+
+    parser.add_argument(
+        '--plan',
+        help='Print the fully resolved build plan (tag, directories, configure and make command '
+             'lines) as JSON and exit without cloning or building anything.',
+        action='store_true')
+
     return parser
 
 
-def parse_args() -> Tuple[argparse.Namespace, GCCBuildConf]:
-    parser = create_arg_parser()
-    args = parser.parse_args()
+def parse_args(
+        argv: Optional[List[str]] = None,
+        exit_on_error: bool = True) -> Tuple[argparse.Namespace, GCCBuildConf]:
+    """
+    Parses the given arguments, or the command line if argv is None. Unless exit_on_error is set,
+    invalid arguments raise ArgumentParsingError.
+    """
+    parser = create_arg_parser(exit_on_error)
+    args = parser.parse_args(argv)
 
     if args.existing_build_dir:
         logging.info("Assuming --skip_auto_suffix because --existing_build_dir is set")
         args.skip_auto_suffix = True
 
+    if ((args.only or args.from_task) and
+            not args.existing_build_dir and not args.upload_earlier_build):
+        # Otherwise the tag and the directories of the earlier run are not known.
+        raise ValueError(
+            "--only and --from require --existing_build_dir or --upload_earlier_build")
+
     adjusted_gcc_version = GCC_VERSION_MAP.get(
         args.gcc_version, args.gcc_version)
     if args.gcc_version != adjusted_gcc_version:
@@ -149,6 +348,12 @@ def parse_args() -> Tuple[argparse.Namespace, GCCBuildConf]:
         existing_build_dir=args.existing_build_dir,
         parallelism=args.parallelism,
         target_arch=current_arch,
+        lto_parallelism=args.lto_parallelism,
+        lto_partitions=args.lto_partitions,
+        host_linker=args.host_linker,
+        bootstrap_linker=args.bootstrap_linker,
+        patch_series=(
+            PatchSeries.from_path(args.patch_series) if args.patch_series is not None else None),
     )
 
     return args, build_conf
@@ -24,6 +24,24 @@ BUILD_DIR_SUFFIX_WITH_SEPARATOR = NAME_COMPONENT_SEPARATOR + BUILD_DIR_SUFFIX
 
 DEFAULT_INSTALL_PARENT_DIR = '/opt/yb-build/gcc'
 
+# Name of the directory inside the install parent directory where caches shared by all builds on
+# this host are kept.
+SHARED_CACHE_DIR_NAME = '.cache'
+
+# Name of the directory inside the install parent directory where lock files coordinating
+# concurrent builds on this host are kept.
+LOCKS_DIR_NAME = '.locks'
+
+# Name of the SQLite index of the toolchains installed in the install parent directory.
+REGISTRY_FILE_NAME = 'registry.sqlite'
+
+# Relative path to the build information directory (build_info.json, git log, file manifest)
+# inside the installation directory.
+GCC_BUILD_INFO_DIR_NAME = os.path.join('etc', 'yb-gcc-build-info')
+
+# Name of the directory inside the build directory where the merged testsuite results are saved.
+TESTSUITE_RESULTS_DIR_NAME = 'testsuite_results'
+
 # Relative path to the directory where we clone the GCC source code.
 GCC_CLONE_REL_PATH = os.path.join('src', 'gcc')
 
@@ -2,14 +2,11 @@ import subprocess
 import logging
 import os
 
-import sys_detection
-
 from typing import Tuple, Optional
 
-from sys_detection import is_linux
-
 from build_gcc.constants import DEVTOOLSET_ENV_VARS
 from build_gcc.helpers import which
+from build_gcc.host_facts import get_host_facts, is_linux
 
 
 GCC_VERSIONS = [14, 13, 12, 11, 10, 9]
@@ -17,7 +14,7 @@ GCC_VERSIONS = [14, 13, 12, 11, 10, 9]
 
 def activate_devtoolset() -> None:
     if (not is_linux() or
-            sys_detection.local_sys_conf().short_os_name_and_version() != 'centos7'):
+            get_host_facts().short_os_name_and_version != 'centos7'):
         return
 
     found = False
@@ -51,7 +48,7 @@ def find_latest_gcc() -> Tuple[Optional[str], Optional[str]]:
     """
 
     if (not is_linux() or
-            sys_detection.local_sys_conf().short_os_name_and_version() != 'amzn2'):
+            get_host_facts().short_os_name_and_version != 'amzn2'):
         return find_default_gcc()
 
     bin_dir = '/usr/bin'
@@ -0,0 +1,587 @@
+"""
+Distributes the compile jobs of the build phases that use the host compiler (the stage1 compiler
+and the build machine tools) to other hosts over ssh, in the style of distcc. The stage1 make is
+run with CC and CXX pointing to wrapper scripts that run this module. For each compile job, the
+wrapper preprocesses the source file locally, sends the preprocessed file to a host with a free
+job slot, compiles it there with the same host compiler and writes the object file returned by the
+host. Everything else (linking, preprocessing only, configure checks that are not plain compiles)
+runs the host compiler locally.
+
+Each host has a fixed number of job slots, shared by all builds on this host through lock files,
+and so does the local host. A job runs locally when a local slot is free, and otherwise on the
+first host with a free slot. If a host cannot be reached, it is skipped by all jobs for a while,
+and a job that fails on a host is compiled again locally, so that a broken host never breaks the
+build. The later bootstrap stages and the target libraries are compiled with the compiler being
+built, which the other hosts do not have, so they are always built locally.
+
+The local transport runs the "remote" compile jobs in local worker processes instead of over ssh,
+for testing.
+"""
+
+import json
+import logging
+import os
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from build_gcc.constants import LOCKS_DIR_NAME
+from build_gcc.helpers import BUILD_GCC_SCRIPTS_ROOT_PATH, make_file_executable, mkdir_p
+from build_gcc.host_facts import get_compiler_version
+from build_gcc.locking import FileLock
+
+
+TRANSPORT_SSH = 'ssh'
+TRANSPORT_LOCAL = 'local'
+TRANSPORTS = [TRANSPORT_SSH, TRANSPORT_LOCAL]
+
+DEFAULT_JOBS_PER_HOST = 4
+
+# Returned by ssh when it cannot connect, and by the remote script when it cannot set up the job.
+TRANSPORT_FAILURE_EXIT_CODE = 255
+
+# How long jobs skip a host after failing to reach it.
+HOST_RETRY_INTERVAL_SEC = 60
+
+SLOT_POLL_INTERVAL_SEC = 0.05
+HOST_CHECK_TIMEOUT_SEC = 30
+
+LOCAL_HOST_NAME = 'localhost'
+CONFIG_FILE_NAME = 'config.json'
+STATS_FILE_NAME = 'stats.jsonl'
+C_WRAPPER_NAME = 'cc'
+CXX_WRAPPER_NAME = 'c++'
+
+C_SOURCE_SUFFIXES = ['.c']
+CXX_SOURCE_SUFFIXES = ['.cc', '.cp', '.cxx', '.cpp', '.c++', '.C', '.CPP']
+
+# Options that take the next argument as their value.
+OPTIONS_WITH_ARG = {
+    '-o', '-x', '-I', '-D', '-U', '-include', '-imacros', '-isystem', '-iquote', '-idirafter',
+    '-iprefix', '-iwithprefix', '-iwithprefixbefore', '-imultilib', '-isysroot', '-MF', '-MT',
+    '-MQ', '-Xpreprocessor', '-Xassembler', '-Xlinker', '-L', '-B', '--param', '-aux-info',
+}
+
+# Preprocessor options, which are not passed to the remote compiler.
+PREPROCESSOR_OPTIONS_WITH_ARG = {
+    '-I', '-D', '-U', '-include', '-imacros', '-isystem', '-iquote', '-idirafter', '-iprefix',
+    '-iwithprefix', '-iwithprefixbefore', '-imultilib', '-isysroot', '-MF', '-MT', '-MQ',
+    '-Xpreprocessor',
+}
+PREPROCESSOR_FLAGS = {'-MD', '-MMD', '-MP', '-MG', '-nostdinc', '-nostdinc++', '-undef'}
+PREPROCESSOR_OPTION_PREFIXES = (
+    '-I', '-D', '-U', '-MF', '-MT', '-MQ', '-Wp,', '-include', '-imacros', '-isystem',
+    '-iquote', '-idirafter',
+)
+
+# Options with which a compile job is not distributed, because it does not produce just an object
+# file, or depends on files other than the source file that are not handled by preprocessing.
+LOCAL_ONLY_OPTIONS = {
+    '-E', '-S', '-M', '-MM', '-x', '-save-temps', '--coverage', '-ftest-coverage',
+    '-fprofile-arcs',
+}
+LOCAL_ONLY_OPTION_PREFIXES = (
+    '-save-temps=', '-fprofile-', '-fauto-profile', '-fplugin', '-specs=', '-fdump-', '-Wa,',
+)
+
+
+class CompileHost:
+    name: str
+    max_jobs: int
+
+    def __init__(self, name: str, max_jobs: int) -> None:
+        self.name = name
+        self.max_jobs = max_jobs
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'max_jobs': self.max_jobs}
+
+
+def parse_compile_hosts(hosts_str: str) -> List[CompileHost]:
+    """
+    Parses a comma-separated list of hosts with optional job limits.
+
+    >>> [host.to_dict() for host in parse_compile_hosts('build1:16, build2')]
+    [{'name': 'build1', 'max_jobs': 16}, {'name': 'build2', 'max_jobs': 4}]
+    """
+    hosts = []
+    for host_str in hosts_str.split(','):
+        host_str = host_str.strip()
+        if not host_str:
+            continue
+        name, _, max_jobs_str = host_str.partition(':')
+        max_jobs = int(max_jobs_str) if max_jobs_str else DEFAULT_JOBS_PER_HOST
+        if max_jobs <= 0:
+            raise ValueError("Invalid number of jobs for host %s: %d" % (name, max_jobs))
+        hosts.append(CompileHost(name, max_jobs))
+    return hosts
+
+
+class DistributedCompileConfig:
+    hosts: List[CompileHost]
+    transport: str
+    local_jobs: int
+
+    # Directory with the lock files of the job slots, shared by all builds on this host.
+    slots_dir: str
+
+    # Directory with the wrapper scripts, the configuration and the statistics of one build.
+    work_dir: str
+
+    def __init__(
+            self,
+            hosts: List[CompileHost],
+            transport: str,
+            local_jobs: int,
+            slots_dir: str,
+            work_dir: str) -> None:
+        if transport not in TRANSPORTS:
+            raise ValueError("Unknown distributed compile transport: %s" % transport)
+        self.hosts = hosts
+        self.transport = transport
+        self.local_jobs = local_jobs
+        self.slots_dir = slots_dir
+        self.work_dir = work_dir
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'hosts': [host.to_dict() for host in self.hosts],
+            'transport': self.transport,
+            'local_jobs': self.local_jobs,
+            'slots_dir': self.slots_dir,
+            'work_dir': self.work_dir,
+        }
+
+    @staticmethod
+    def load(config_path: str) -> 'DistributedCompileConfig':
+        with open(config_path) as config_file:
+            config = json.load(config_file)
+        return DistributedCompileConfig(
+            hosts=[CompileHost(host['name'], host['max_jobs']) for host in config['hosts']],
+            transport=config['transport'],
+            local_jobs=config['local_jobs'],
+            slots_dir=config['slots_dir'],
+            work_dir=config['work_dir'])
+
+    def get_config_path(self) -> str:
+        return os.path.join(self.work_dir, CONFIG_FILE_NAME)
+
+    def get_stats_path(self) -> str:
+        return os.path.join(self.work_dir, STATS_FILE_NAME)
+
+    def get_c_wrapper_path(self) -> str:
+        return os.path.join(self.work_dir, C_WRAPPER_NAME)
+
+    def get_cxx_wrapper_path(self) -> str:
+        return os.path.join(self.work_dir, CXX_WRAPPER_NAME)
+
+    def get_num_jobs(self) -> int:
+        """
+        The make parallelism that keeps all job slots busy.
+        """
+        return self.local_jobs + sum(host.max_jobs for host in self.hosts)
+
+    def get_make_vars(self) -> List[str]:
+        return ['CC=' + self.get_c_wrapper_path(), 'CXX=' + self.get_cxx_wrapper_path()]
+
+    def get_host_down_marker_path(self, host_name: str) -> str:
+        return os.path.join(self.slots_dir, '%s.down' % host_name)
+
+    def is_host_down(self, host_name: str) -> bool:
+        try:
+            marker_mtime = os.stat(self.get_host_down_marker_path(host_name)).st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - marker_mtime < HOST_RETRY_INTERVAL_SEC
+
+    def mark_host_down(self, host_name: str) -> None:
+        with open(self.get_host_down_marker_path(host_name), 'w'):
+            pass
+
+    def acquire_slot(self) -> Tuple[str, FileLock]:
+        """
+        Waits for a free job slot, preferring local slots. Returns the host name and the lock of
+        the slot.
+        """
+        hosts = [
+            CompileHost(LOCAL_HOST_NAME, self.local_jobs)
+        ] + random.sample(self.hosts, len(self.hosts))
+        while True:
+            for host in hosts:
+                if host.name != LOCAL_HOST_NAME and self.is_host_down(host.name):
+                    continue
+                for slot_index in range(host.max_jobs):
+                    lock = FileLock(
+                        os.path.join(self.slots_dir, '%s.%d.lock' % (host.name, slot_index)),
+                        description='compile job slot %d on %s' % (slot_index, host.name))
+                    if lock.acquire(blocking=False):
+                        return host.name, lock
+            time.sleep(SLOT_POLL_INTERVAL_SEC)
+
+    def record_job(
+            self,
+            host_name: str,
+            source_path: str,
+            elapsed_time_sec: float,
+            fallback_reason: Optional[str] = None) -> None:
+        # Lines shorter than PIPE_BUF are appended atomically by concurrent jobs.
+        with open(self.get_stats_path(), 'a') as stats_file:
+            stats_file.write(json.dumps({
+                'host': host_name,
+                'source': source_path,
+                'elapsed_time_sec': round(elapsed_time_sec, 3),
+                'fallback_reason': fallback_reason,
+            }) + '\n')
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Summarizes the compile jobs run so far: the number of jobs and their total time per host,
+        and the number of jobs that had to be compiled again locally.
+        """
+        jobs_per_host: Dict[str, int] = {}
+        time_per_host_sec: Dict[str, float] = {}
+        num_fallbacks = 0
+        if os.path.exists(self.get_stats_path()):
+            with open(self.get_stats_path()) as stats_file:
+                for line in stats_file:
+                    job = json.loads(line)
+                    jobs_per_host[job['host']] = jobs_per_host.get(job['host'], 0) + 1
+                    time_per_host_sec[job['host']] = (
+                        time_per_host_sec.get(job['host'], 0.0) + job['elapsed_time_sec'])
+                    if job['fallback_reason'] is not None:
+                        num_fallbacks += 1
+        return {
+            'hosts': [host.to_dict() for host in self.hosts],
+            'transport': self.transport,
+            'jobs_per_host': jobs_per_host,
+            'time_per_host_sec': {
+                host_name: round(time_sec, 1) for host_name, time_sec in time_per_host_sec.items()
+            },
+            'num_local_fallbacks': num_fallbacks,
+        }
+
+
+class CompileCommand:
+    """
+    A compiler invocation that compiles one C or C++ source file into an object file.
+    """
+    compiler: str
+    args: List[str]
+    source_path: str
+    output_path: str
+    is_cxx: bool
+
+    def __init__(
+            self,
+            compiler: str,
+            args: List[str],
+            source_path: str,
+            output_path: str,
+            is_cxx: bool) -> None:
+        self.compiler = compiler
+        self.args = args
+        self.source_path = source_path
+        self.output_path = output_path
+        self.is_cxx = is_cxx
+
+    @staticmethod
+    def parse(compiler: str, args: List[str]) -> Optional['CompileCommand']:
+        """
+        Returns None if the invocation can not be distributed.
+
+        >>> command = CompileCommand.parse('g++', ['-O2', '-I.', '-c', 'a.c', '-o', 'a.o'])
+        >>> command.source_path, command.output_path, command.is_cxx
+        ('a.c', 'a.o', True)
+        >>> CompileCommand.parse('gcc', ['a.o', '-o', 'a']) is None
+        True
+        >>> CompileCommand.parse('gcc', ['-E', 'a.c']) is None
+        True
+        """
+        if '-c' not in args:
+            return None
+        sources = []
+        output_path: Optional[str] = None
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if (arg in LOCAL_ONLY_OPTIONS or arg.startswith(LOCAL_ONLY_OPTION_PREFIXES) or
+                    arg.startswith('@')):
+                return None
+            if arg in OPTIONS_WITH_ARG:
+                if i + 1 == len(args):
+                    return None
+                if arg == '-o':
+                    output_path = args[i + 1]
+                i += 2
+                continue
+            if arg == '-' or not arg.startswith('-'):
+                sources.append(arg)
+            i += 1
+        if len(sources) != 1:
+            return None
+        source_path = sources[0]
+        suffix = os.path.splitext(source_path)[1]
+        if suffix not in C_SOURCE_SUFFIXES + CXX_SOURCE_SUFFIXES:
+            return None
+        if output_path is None:
+            output_path = os.path.splitext(os.path.basename(source_path))[0] + '.o'
+        return CompileCommand(
+            compiler, args, source_path, output_path,
+            # The C++ compiler driver compiles .c files as C++ too.
+            is_cxx=suffix in CXX_SOURCE_SUFFIXES or '++' in os.path.basename(compiler))
+
+    def get_preprocessed_suffix(self) -> str:
+        return '.ii' if self.is_cxx else '.i'
+
+    def get_preprocess_args(self, preprocessed_path: str) -> List[str]:
+        """
+        The command line that preprocesses the source file locally. Dependency files are written
+        as if the source file was compiled, because with -E, the -o option would specify the
+        dependency file.
+
+        >>> CompileCommand.parse('gcc', ['-MMD', '-c', 'a.c', '-o', 'x/a.o']).get_preprocess_args(
+        ...     '/tmp/a.i')
+        ['gcc', '-MMD', 'a.c', '-MF', 'x/a.d', '-MT', 'x/a.o', '-E', '-o', '/tmp/a.i']
+        """
+        preprocess_args = []
+        i = 0
+        while i < len(self.args):
+            if self.args[i] == '-o':
+                i += 2
+                continue
+            if self.args[i] != '-c':
+                preprocess_args.append(self.args[i])
+            i += 1
+        if '-MD' in self.args or '-MMD' in self.args:
+            if not any(arg.startswith('-MF') for arg in self.args):
+                preprocess_args += ['-MF', os.path.splitext(self.output_path)[0] + '.d']
+            if not any(arg.startswith(('-MT', '-MQ')) for arg in self.args):
+                preprocess_args += ['-MT', self.output_path]
+        return [self.compiler] + preprocess_args + ['-E', '-o', preprocessed_path]
+
+    def get_remote_compile_args(self, preprocessed_name: str, object_name: str) -> List[str]:
+        """
+        The command line that compiles the preprocessed file on another host.
+
+        >>> CompileCommand.parse('gcc', ['-O2', '-DX=1', '-I', 'inc', '-c', 'a.c', '-o', 'a.o']
+        ...                      ).get_remote_compile_args('in.i', 'out.o')
+        ['gcc', '-x', 'cpp-output', '-O2', '-c', 'in.i', '-o', 'out.o']
+        """
+        compile_args = []
+        i = 0
+        while i < len(self.args):
+            arg = self.args[i]
+            if arg in PREPROCESSOR_OPTIONS_WITH_ARG or arg == '-o':
+                i += 2
+                continue
+            if (arg not in PREPROCESSOR_FLAGS and arg != '-c' and arg != self.source_path and
+                    not arg.startswith(PREPROCESSOR_OPTION_PREFIXES)):
+                compile_args.append(arg)
+            i += 1
+        return [
+            self.compiler, '-x', 'c++-cpp-output' if self.is_cxx else 'cpp-output'
+        ] + compile_args + ['-c', preprocessed_name, '-o', object_name]
+
+
+def get_remote_compile_script(command: CompileCommand, local_cwd: str) -> str:
+    """
+    A shell script that reads the preprocessed file from stdin, compiles it in a temporary
+    directory and writes the object file to stdout.
+    """
+    preprocessed_name = 'in' + command.get_preprocessed_suffix()
+    object_name = 'out.o'
+    compile_cmd = ' '.join(
+        shlex.quote(arg)
+        for arg in command.get_remote_compile_args(preprocessed_name, object_name))
+    return '\n'.join([
+        'tmp_dir=$(mktemp -d) || exit %d' % TRANSPORT_FAILURE_EXIT_CODE,
+        'trap \'rm -rf "$tmp_dir"\' EXIT',
+        'cd "$tmp_dir" && cat >%s || exit %d' % (preprocessed_name, TRANSPORT_FAILURE_EXIT_CODE),
+        # Debug info refers to the directory the job was run in on this host.
+        '%s -fdebug-prefix-map="$tmp_dir"=%s || exit 1' % (
+            compile_cmd, shlex.quote(local_cwd)),
+        'cat %s' % object_name,
+    ])
+
+
+def get_transport_cmd(transport: str, host_name: str, script: str) -> List[str]:
+    if transport == TRANSPORT_LOCAL:
+        return ['sh', '-c', script]
+    return ['ssh', '-o', 'BatchMode=yes', host_name, 'sh -c %s' % shlex.quote(script)]
+
+
+def compile_remotely(
+        config: DistributedCompileConfig,
+        host_name: str,
+        command: CompileCommand) -> Optional[str]:
+    """
+    Compiles the source file on the given host. Returns None on success, or the reason of the
+    failure.
+    """
+    with tempfile.TemporaryDirectory(prefix='yb-distributed-compile-') as tmp_dir:
+        preprocessed_path = os.path.join(tmp_dir, 'in' + command.get_preprocessed_suffix())
+        preprocess_result = subprocess.run(
+            command.get_preprocess_args(preprocessed_path), stderr=subprocess.PIPE)
+        if preprocess_result.returncode != 0:
+            # The diagnostics are dropped, the local compile that follows reports them.
+            return 'preprocessing failed with exit code %d' % preprocess_result.returncode
+        # Preprocessor warnings, e.g. from #warning, are not repeated by the remote compile.
+        sys.stderr.buffer.write(preprocess_result.stderr)
+        with open(preprocessed_path, 'rb') as preprocessed_file:
+            result = subprocess.run(
+                get_transport_cmd(
+                    config.transport, host_name,
+                    get_remote_compile_script(command, os.getcwd())),
+                stdin=preprocessed_file,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+    if result.returncode == TRANSPORT_FAILURE_EXIT_CODE:
+        config.mark_host_down(host_name)
+        return 'could not reach %s: %s' % (
+            host_name, result.stderr.decode('utf-8', errors='replace').strip())
+    if result.returncode != 0:
+        return 'compilation failed on %s with exit code %d' % (host_name, result.returncode)
+    # Warnings.
+    sys.stderr.buffer.write(result.stderr)
+    tmp_output_path = '%s.tmp.%d' % (command.output_path, os.getpid())
+    with open(tmp_output_path, 'wb') as output_file:
+        output_file.write(result.stdout)
+    os.rename(tmp_output_path, command.output_path)
+    return None
+
+
+def run_compiler(config: DistributedCompileConfig, compiler: str, args: List[str]) -> int:
+    """
+    Runs one compiler invocation, distributing it if it is a compile job. Returns the exit code.
+    """
+    command = CompileCommand.parse(compiler, args)
+    if command is None or not config.hosts:
+        return subprocess.call([compiler] + args)
+
+    start_time_sec = time.time()
+    host_name, slot_lock = config.acquire_slot()
+    try:
+        if host_name == LOCAL_HOST_NAME:
+            exit_code = subprocess.call([compiler] + args)
+            config.record_job(host_name, command.source_path, time.time() - start_time_sec)
+            return exit_code
+        fallback_reason = compile_remotely(config, host_name, command)
+    finally:
+        slot_lock.release()
+    if fallback_reason is None:
+        config.record_job(host_name, command.source_path, time.time() - start_time_sec)
+        return 0
+
+    # The local compiler reports the actual errors, if any.
+    exit_code = subprocess.call([compiler] + args)
+    config.record_job(
+        host_name, command.source_path, time.time() - start_time_sec, fallback_reason)
+    return exit_code
+
+
+def get_wrapper_script(config_path: str, compiler: str) -> str:
+    return '\n'.join([
+        '#!/bin/sh',
+        '# Generated by build-gcc. Distributes compile jobs, see distributed_compile.py.',
+        'PYTHONPATH=%s exec %s -m build_gcc.distributed_compile %s %s "$@"' % (
+            shlex.quote(os.path.join(BUILD_GCC_SCRIPTS_ROOT_PATH, 'src')),
+            shlex.quote(sys.executable), shlex.quote(config_path), shlex.quote(compiler)),
+        '',
+    ])
+
+
+def check_hosts(
+        hosts: List[CompileHost],
+        transport: str,
+        compiler_versions: Dict[str, str]) -> List[CompileHost]:
+    """
+    Returns the hosts that can be reached and have the same versions of the given compilers as
+    this host.
+    """
+    usable_hosts = []
+    for host in hosts:
+        script = '; '.join(
+            '%s --version | head -1' % shlex.quote(compiler) for compiler in compiler_versions)
+        try:
+            result = subprocess.run(
+                get_transport_cmd(transport, host.name, script),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=HOST_CHECK_TIMEOUT_SEC)
+        except subprocess.TimeoutExpired:
+            logging.warning("Not compiling on %s: timed out checking its compilers", host.name)
+            continue
+        remote_versions = result.stdout.decode('utf-8', errors='replace').strip().split('\n')
+        if result.returncode != 0 or remote_versions != list(compiler_versions.values()):
+            logging.warning(
+                "Not compiling on %s: expected compiler versions %s, found %s (exit code %d): %s",
+                host.name, list(compiler_versions.values()), remote_versions, result.returncode,
+                result.stderr.decode('utf-8', errors='replace').strip())
+            continue
+        logging.info("Compiling on %s with up to %d jobs", host.name, host.max_jobs)
+        usable_hosts.append(host)
+    return usable_hosts
+
+
+def setup_distributed_compile(
+        work_dir: str,
+        install_parent_dir: str,
+        hosts: List[CompileHost],
+        transport: str,
+        local_jobs: int,
+        c_compiler: str,
+        cxx_compiler: str) -> Optional[DistributedCompileConfig]:
+    """
+    Checks the hosts and writes the wrapper scripts and the configuration into work_dir. Returns
+    None if none of the hosts can be used.
+    """
+    compiler_versions = {}
+    for compiler in [c_compiler, cxx_compiler]:
+        compiler_version = get_compiler_version(compiler)
+        if compiler_version is None:
+            raise ValueError(
+                "Cannot distribute compile jobs: could not determine the version of the host "
+                "compiler %s" % compiler)
+        compiler_versions[compiler] = compiler_version
+    usable_hosts = check_hosts(hosts, transport, compiler_versions)
+    if not usable_hosts:
+        logging.warning("None of the hosts %s can be used, compiling locally",
+                        [host.name for host in hosts])
+        return None
+
+    config = DistributedCompileConfig(
+        hosts=usable_hosts,
+        transport=transport,
+        local_jobs=local_jobs,
+        slots_dir=os.path.join(install_parent_dir, LOCKS_DIR_NAME, 'distributed_compile'),
+        work_dir=work_dir)
+    mkdir_p(work_dir)
+    mkdir_p(config.slots_dir)
+    with open(config.get_config_path(), 'w') as config_file:
+        json.dump(config.to_dict(), config_file, indent=2)
+    if os.path.exists(config.get_stats_path()):
+        os.remove(config.get_stats_path())
+    for wrapper_path, compiler in [
+            (config.get_c_wrapper_path(), c_compiler),
+            (config.get_cxx_wrapper_path(), cxx_compiler)]:
+        with open(wrapper_path, 'w') as wrapper_file:
+            wrapper_file.write(get_wrapper_script(config.get_config_path(), compiler))
+        make_file_executable(wrapper_path)
+    return config
+
+
+def main() -> None:
+    if len(sys.argv) < 3:
+        sys.stderr.write("Usage: %s <config path> <compiler> [<compiler args>]\n" % sys.argv[0])
+        sys.exit(2)
+    config = DistributedCompileConfig.load(sys.argv[1])
+    sys.exit(run_compiler(config, sys.argv[2], sys.argv[3:]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""
+Downloads and installs a yb-gcc release archive. The archive is downloaded with parallel HTTP
+range requests, and the downloaded chunks are hashed and piped to tar in order as they arrive, so
+that downloading, checksum verification and extraction overlap. The archive is extracted into a
+temporary directory next to the destination, which is renamed into place only after the SHA-256
+checksum matches the .sha256 file published with the archive. Servers that do not support range
+requests are handled with a single streaming download.
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from typing import Dict, IO, List, Optional, Tuple
+
+from build_gcc.constants import DEFAULT_INSTALL_PARENT_DIR
+from build_gcc.helpers import mkdir_p, rm_rf
+from build_gcc.locking import get_path_lock
+from build_gcc.registry import register_install_dir
+
+
+ARCHIVE_SUFFIX = '.tar.gz'
+SHA256_SUFFIX = '.sha256'
+
+DEFAULT_NUM_CONNECTIONS = 8
+DEFAULT_CHUNK_SIZE_MB = 8
+
+# How many chunks per connection may be downloaded ahead of the chunk being extracted. This bounds
+# the memory used for chunks that arrived out of order.
+CHUNKS_AHEAD_PER_CONNECTION = 2
+
+NUM_CHUNK_ATTEMPTS = 3
+HTTP_TIMEOUT_SEC = 60
+
+STREAM_READ_SIZE = 1024 * 1024
+
+
+def get_install_dir_name(archive_url: str) -> str:
+    """
+    >>> get_install_dir_name('https://example.com/v1/yb-gcc-v12.2.0-1-abc-centos7-x86_64.tar.gz')
+    'yb-gcc-v12.2.0-1-abc-centos7-x86_64'
+    """
+    archive_name = archive_url.rstrip('/').split('/')[-1]
+    if not archive_name.endswith(ARCHIVE_SUFFIX):
+        raise ValueError("Expected a %s archive URL, got: %s" % (ARCHIVE_SUFFIX, archive_url))
+    return archive_name[:-len(ARCHIVE_SUFFIX)]
+
+
+def fetch_expected_sha256(archive_url: str) -> str:
+    """
+    Reads the checksum from the .sha256 file published next to the archive, in the format
+    produced by sha256sum.
+    """
+    sha256_url = archive_url + SHA256_SUFFIX
+    with urllib.request.urlopen(sha256_url, timeout=HTTP_TIMEOUT_SEC) as response:
+        items = response.read().decode('utf-8').split()
+    if not items or len(items[0]) != 64:
+        raise ValueError("Unexpected contents of %s: %s" % (sha256_url, items))
+    return items[0].lower()
+
+
+def get_range_support(archive_url: str) -> Optional[int]:
+    """
+    Returns the size of the archive if the server supports range requests, or None otherwise.
+    """
+    request = urllib.request.Request(archive_url, headers={'Range': 'bytes=0-0'})
+    try:
+        with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT_SEC) as response:
+            content_range = response.headers.get('Content-Range')
+            if getattr(response, 'status', None) != 206 or not content_range:
+                return None
+    except urllib.error.HTTPError as ex:
+        if ex.code == 416:
+            # Range not satisfiable, e.g. an empty file.
+            return None
+        raise
+    # The header looks like "bytes 0-0/123456".
+    total_size = content_range.split('/')[-1].strip()
+    return int(total_size) if total_size.isdigit() else None
+
+
+def download_chunk(archive_url: str, start: int, end: int) -> bytes:
+    """
+    Downloads the byte range [start, end] of the archive, retrying on errors.
+    """
+    for attempt in range(1, NUM_CHUNK_ATTEMPTS + 1):
+        request = urllib.request.Request(
+            archive_url, headers={'Range': 'bytes=%d-%d' % (start, end)})
+        try:
+            with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT_SEC) as response:
+                if getattr(response, 'status', None) != 206:
+                    raise IOError("Expected a partial response for range %d-%d of %s" % (
+                        start, end, archive_url))
+                data: bytes = response.read()
+            if len(data) != end - start + 1:
+                raise IOError("Got %d bytes for range %d-%d of %s" % (
+                    len(data), start, end, archive_url))
+            return data
+        except (IOError, urllib.error.URLError) as ex:
+            if attempt == NUM_CHUNK_ATTEMPTS:
+                raise
+            logging.warning("Attempt %d to download range %d-%d of %s failed: %s",
+                            attempt, start, end, archive_url, ex)
+    raise AssertionError("Unreachable")
+
+
+class ArchiveConsumer:
+    """
+    Hashes the archive data and pipes it to tar, which extracts it into a directory.
+    """
+    sha256_hash: 'hashlib._Hash'
+    tar_process: subprocess.Popen
+    tar_stdin: IO[bytes]
+    num_bytes: int
+
+    def __init__(self, extract_dir: str) -> None:
+        self.sha256_hash = hashlib.sha256()
+        self.tar_process = subprocess.Popen(
+            ['tar', 'xzf', '-', '-C', extract_dir], stdin=subprocess.PIPE)
+        assert self.tar_process.stdin is not None
+        self.tar_stdin = self.tar_process.stdin
+        self.num_bytes = 0
+
+    def consume(self, data: bytes) -> None:
+        self.sha256_hash.update(data)
+        self.tar_stdin.write(data)
+        self.num_bytes += len(data)
+
+    def finish(self) -> str:
+        """
+        Waits for tar to finish, and returns the SHA-256 of all data consumed.
+        """
+        self.tar_stdin.close()
+        exit_code = self.tar_process.wait()
+        if exit_code != 0:
+            raise IOError("tar exited with code %d" % exit_code)
+        return self.sha256_hash.hexdigest()
+
+    def abort(self) -> None:
+        if self.tar_process.poll() is None:
+            self.tar_process.kill()
+        self.tar_process.wait()
+
+
+def download_in_ranges(
+        archive_url: str,
+        total_size: int,
+        consumer: ArchiveConsumer,
+        num_connections: int,
+        chunk_size: int) -> None:
+    chunk_starts = list(range(0, total_size, chunk_size))
+    max_chunks_ahead = num_connections * CHUNKS_AHEAD_PER_CONNECTION
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_connections) as executor:
+        futures: Dict[int, concurrent.futures.Future] = {}
+        next_chunk_to_submit = 0
+        try:
+            for chunk_index in range(len(chunk_starts)):
+                while (next_chunk_to_submit < len(chunk_starts) and
+                       next_chunk_to_submit < chunk_index + max_chunks_ahead):
+                    start = chunk_starts[next_chunk_to_submit]
+                    end = min(start + chunk_size, total_size) - 1
+                    futures[next_chunk_to_submit] = executor.submit(
+                        download_chunk, archive_url, start, end)
+                    next_chunk_to_submit += 1
+                consumer.consume(futures.pop(chunk_index).result())
+        finally:
+            for future in futures.values():
+                future.cancel()
+
+
+def download_stream(archive_url: str, consumer: ArchiveConsumer) -> None:
+    with urllib.request.urlopen(archive_url, timeout=HTTP_TIMEOUT_SEC) as response:
+        while True:
+            data = response.read(STREAM_READ_SIZE)
+            if not data:
+                break
+            consumer.consume(data)
+
+
+def fetch_release(
+        archive_url: str,
+        dest_parent_dir: str,
+        num_connections: int = DEFAULT_NUM_CONNECTIONS,
+        chunk_size: int = DEFAULT_CHUNK_SIZE_MB * 1024 * 1024) -> Tuple[str, bool]:
+    """
+    Downloads, verifies and extracts the given release archive into dest_parent_dir. Returns the
+    installation directory, and whether it was fetched (as opposed to already existing).
+    """
+    install_dir_name = get_install_dir_name(archive_url)
+    install_dir = os.path.join(dest_parent_dir, install_dir_name)
+    mkdir_p(dest_parent_dir)
+    with get_path_lock(dest_parent_dir, install_dir):
+        if os.path.exists(install_dir):
+            logging.info("%s already exists, not fetching %s", install_dir, archive_url)
+            return install_dir, False
+
+        start_time_sec = time.time()
+        expected_sha256 = fetch_expected_sha256(archive_url)
+        total_size = get_range_support(archive_url)
+        extract_dir = tempfile.mkdtemp(dir=dest_parent_dir, prefix='.fetch-%s-' % install_dir_name)
+        try:
+            consumer = ArchiveConsumer(extract_dir)
+            try:
+                if total_size is None:
+                    logging.info("Server does not support range requests, downloading %s in a "
+                                 "single stream", archive_url)
+                    download_stream(archive_url, consumer)
+                else:
+                    logging.info("Downloading %s (%.1f MiB) using %d connections",
+                                 archive_url, total_size / 1024 ** 2, num_connections)
+                    download_in_ranges(
+                        archive_url, total_size, consumer, num_connections, chunk_size)
+                actual_sha256 = consumer.finish()
+            except BaseException:
+                consumer.abort()
+                raise
+
+            if actual_sha256 != expected_sha256:
+                raise IOError("SHA-256 mismatch for %s: expected %s, got %s" % (
+                    archive_url, expected_sha256, actual_sha256))
+            extracted_names = os.listdir(extract_dir)
+            if extracted_names != [install_dir_name]:
+                raise IOError("Expected the archive %s to contain only %s, found: %s" % (
+                    archive_url, install_dir_name, extracted_names))
+            os.rename(os.path.join(extract_dir, install_dir_name), install_dir)
+        finally:
+            rm_rf(extract_dir)
+        try:
+            register_install_dir(install_dir, archive_sha256=expected_sha256)
+        except (IOError, KeyError) as ex:
+            logging.warning("Could not register %s: %s", install_dir, ex)
+
+        elapsed_time_sec = time.time() - start_time_sec
+        logging.info("Fetched %s into %s (%.1f MiB) in %.1f seconds (%.1f MiB/s)",
+                     archive_url, install_dir, consumer.num_bytes / 1024 ** 2, elapsed_time_sec,
+                     consumer.num_bytes / 1024 ** 2 / max(elapsed_time_sec, 0.001))
+    return install_dir, True
+
+
+def fetch_main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog='build_gcc.sh fetch',
+        description='Download, verify and extract a yb-gcc release archive')
+    parser.add_argument(
+        'archive_url',
+        help='URL of the yb-gcc-*.tar.gz archive. The checksum is read from the same URL with '
+             'the %s suffix.' % SHA256_SUFFIX)
+    parser.add_argument(
+        '--dest_dir',
+        default=DEFAULT_INSTALL_PARENT_DIR,
+        help='Directory to extract the archive into. Default: %s' % DEFAULT_INSTALL_PARENT_DIR)
+    parser.add_argument(
+        '--connections',
+        type=int,
+        default=DEFAULT_NUM_CONNECTIONS,
+        help='Number of parallel range requests. Default: %d' % DEFAULT_NUM_CONNECTIONS)
+    parser.add_argument(
+        '--chunk_size_mb',
+        type=float,
+        default=DEFAULT_CHUNK_SIZE_MB,
+        help='Size of each range request. Default: %d' % DEFAULT_CHUNK_SIZE_MB)
+    args = parser.parse_args(argv)
+
+    install_dir, _ = fetch_release(
+        args.archive_url,
+        os.path.abspath(args.dest_dir),
+        num_connections=args.connections,
+        chunk_size=int(args.chunk_size_mb * 1024 * 1024))
+    print(install_dir)
+    return 0
@@ -0,0 +1,303 @@
+"""
+Keeps the disk usage of the install parent directory within a budget. Every build leaves behind a
+build directory with a source checkout and a multi-GB build tree, an installation directory and an
+archive. When the install parent directory is over budget, these are removed in least recently
+used order: build directories first, then archives, then installation directories.
+
+Directories and archives locked by a running build or fetch are never removed. For each GCC
+version, the source checkout of the most recently used build directory is kept when the rest of the
+build directory is removed, so that later builds can clone from it. Temporary directories left
+behind by builds and fetches that were interrupted are always removed. The shared caches in .cache
+have their own size budgets and are not touched.
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from typing import Dict, List, Optional
+
+from build_gcc.constants import (
+    BUILD_DIR_SUFFIX_WITH_SEPARATOR,
+    DEFAULT_INSTALL_PARENT_DIR,
+    GCC_CLONE_REL_PATH,
+    GIT_SHA1_PLACEHOLDER_STR,
+    NAME_COMPONENT_SEPARATOR,
+    YB_GCC_ARCHIVE_NAME_PREFIX,
+)
+from build_gcc.helpers import get_disk_usage_bytes, rm_rf
+from build_gcc.locking import FileLock, get_path_lock
+from build_gcc.patch_series import is_patched_checkout
+from build_gcc.publish import UPLOAD_STATE_FILE_SUFFIX
+from build_gcc.registry import ToolchainRegistry
+
+
+ITEM_KIND_TEMP_DIR = 'temp_dir'
+ITEM_KIND_BUILD_DIR = 'build_dir'
+ITEM_KIND_ARCHIVE = 'archive'
+ITEM_KIND_INSTALL_DIR = 'install_dir'
+
+# Items of earlier kinds are removed first. Temporary directories are removed regardless of the
+# budget.
+EVICTION_ORDER = [ITEM_KIND_BUILD_DIR, ITEM_KIND_ARCHIVE, ITEM_KIND_INSTALL_DIR]
+
+ARCHIVE_SUFFIX = '.tar.gz'
+CHECKSUM_FILE_SUFFIX = '.sha256'
+FETCH_TEMP_DIR_PREFIX = '.fetch-'
+
+
+class GCItem:
+    kind: str
+
+    # The paths removed together, e.g. an archive and its checksum file.
+    paths: List[str]
+
+    # Paths whose locks must be free to remove the item.
+    lock_paths: List[str]
+
+    # A path inside the item that is kept when the item is removed, e.g. a source checkout.
+    keep_rel_path: Optional[str]
+
+    size_bytes: int
+    last_used_time: float
+
+    def __init__(self, kind: str, paths: List[str], lock_paths: List[str]) -> None:
+        self.kind = kind
+        self.paths = [path for path in paths if os.path.lexists(path)]
+        self.lock_paths = lock_paths
+        self.keep_rel_path = None
+        self.size_bytes = get_disk_usage_bytes(self.paths)
+        self.last_used_time = max(get_last_used_time(path) for path in self.paths)
+
+    def get_size_to_free_bytes(self) -> int:
+        if self.keep_rel_path is None:
+            return self.size_bytes
+        return self.size_bytes - get_disk_usage_bytes(
+            [os.path.join(self.paths[0], self.keep_rel_path)])
+
+    def __str__(self) -> str:
+        return '%s %s (%.1f GiB, last used %s)' % (
+            self.kind, self.paths[0], self.size_bytes / 1024 ** 3,
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(self.last_used_time)))
+
+
+def get_last_used_time(path: str) -> float:
+    """
+    The latest modification time of the path and, for a directory, its immediate children. This
+    is cheap to compute and changes whenever a build writes to a build directory.
+    """
+    mtimes = [os.lstat(path).st_mtime]
+    if os.path.isdir(path) and not os.path.islink(path):
+        for name in os.listdir(path):
+            try:
+                mtimes.append(os.lstat(os.path.join(path, name)).st_mtime)
+            except FileNotFoundError:
+                # Removed by a running build.
+                pass
+    return max(mtimes)
+
+
+def get_gcc_version_from_dir_name(name: str) -> str:
+    """
+    >>> get_gcc_version_from_dir_name('yb-gcc-v12.2.0-1618898532-d28af7c6-almalinux8-x86_64-build')
+    '12.2.0'
+    """
+    return name[len(YB_GCC_ARCHIVE_NAME_PREFIX):].split(NAME_COMPONENT_SEPARATOR)[0][1:]
+
+
+def list_gc_items(install_parent_dir: str) -> List[GCItem]:
+    items = []
+    for name in sorted(os.listdir(install_parent_dir)):
+        path = os.path.join(install_parent_dir, name)
+        if name.startswith(FETCH_TEMP_DIR_PREFIX):
+            # Named .fetch-<install dir name>-<random suffix> by fetch.py, which holds the lock
+            # on the installation directory while extracting into it.
+            install_dir_name = name[len(FETCH_TEMP_DIR_PREFIX):].rsplit('-', 1)[0]
+            items.append(GCItem(
+                ITEM_KIND_TEMP_DIR, [path], [os.path.join(install_parent_dir, install_dir_name)]))
+            continue
+        if not name.startswith(YB_GCC_ARCHIVE_NAME_PREFIX):
+            continue
+
+        if name.endswith(ARCHIVE_SUFFIX):
+            install_dir = path[:-len(ARCHIVE_SUFFIX)]
+            items.append(GCItem(
+                ITEM_KIND_ARCHIVE,
+                [path, path + CHECKSUM_FILE_SUFFIX, path + UPLOAD_STATE_FILE_SUFFIX],
+                [install_dir]))
+            continue
+        if not os.path.isdir(path) or os.path.islink(path):
+            continue
+
+        if name.endswith(BUILD_DIR_SUFFIX_WITH_SEPARATOR):
+            build_parent_dir = path
+            install_dir = path[:-len(BUILD_DIR_SUFFIX_WITH_SEPARATOR)]
+        else:
+            build_parent_dir = path + BUILD_DIR_SUFFIX_WITH_SEPARATOR
+            install_dir = path
+        # A running build holds locks on its build and installation directories once its tag is
+        # resolved, and on its source checkout while cloning. Other builds hold a shared lock on
+        # a checkout while cloning from it.
+        checkout_path = os.path.join(build_parent_dir, GCC_CLONE_REL_PATH)
+        if GIT_SHA1_PLACEHOLDER_STR in name:
+            # Left behind by a build that failed before resolving its tag, unless the build is
+            # still cloning.
+            items.append(GCItem(ITEM_KIND_TEMP_DIR, [path], [checkout_path]))
+        elif path == build_parent_dir:
+            items.append(GCItem(
+                ITEM_KIND_BUILD_DIR, [path], [build_parent_dir, install_dir, checkout_path]))
+        else:
+            items.append(GCItem(ITEM_KIND_INSTALL_DIR, [path], [install_dir]))
+    return items
+
+
+def mark_checkouts_to_keep(items: List[GCItem]) -> None:
+    """
+    For each GCC version, keeps the unpatched source checkout of the most recently used build
+    directory, so that later builds of that version can clone from it.
+    """
+    latest_items: Dict[str, GCItem] = {}
+    for item in items:
+        if item.kind != ITEM_KIND_BUILD_DIR:
+            continue
+        checkout_path = os.path.join(item.paths[0], GCC_CLONE_REL_PATH)
+        if not os.path.isdir(checkout_path) or is_patched_checkout(checkout_path):
+            continue
+        gcc_version = get_gcc_version_from_dir_name(os.path.basename(item.paths[0]))
+        latest_item = latest_items.get(gcc_version)
+        if latest_item is None or item.last_used_time > latest_item.last_used_time:
+            latest_items[gcc_version] = item
+    for item in latest_items.values():
+        item.keep_rel_path = GCC_CLONE_REL_PATH
+
+
+def remove_except(dir_path: str, keep_rel_path: str) -> None:
+    """
+    Removes everything in dir_path except for the given relative path and its parent directories.
+    """
+    keep_name, _, keep_rest = keep_rel_path.partition(os.sep)
+    for name in os.listdir(dir_path):
+        path = os.path.join(dir_path, name)
+        if name != keep_name:
+            rm_rf(path)
+        elif keep_rest:
+            remove_except(path, keep_rest)
+
+
+def remove_item(item: GCItem, install_parent_dir: str, dry_run: bool) -> bool:
+    """
+    Removes the item if none of its locks are held by someone else. Returns whether it was (or, in
+    a dry run, would have been) removed.
+    """
+    locks: List[FileLock] = []
+    try:
+        for lock_path in item.lock_paths:
+            lock = get_path_lock(install_parent_dir, lock_path)
+            if not lock.acquire(blocking=False):
+                logging.info("Not removing %s, %s is in use", item.paths[0], lock_path)
+                return False
+            locks.append(lock)
+        if item.keep_rel_path is not None:
+            logging.info("%s %s, keeping %s",
+                         "Would remove" if dry_run else "Removing", item, item.keep_rel_path)
+            if not dry_run:
+                remove_except(item.paths[0], item.keep_rel_path)
+        else:
+            logging.info("%s %s", "Would remove" if dry_run else "Removing", item)
+            if not dry_run:
+                for path in item.paths:
+                    rm_rf(path)
+                if item.kind == ITEM_KIND_INSTALL_DIR:
+                    ToolchainRegistry(install_parent_dir).unregister(item.paths[0])
+        return True
+    finally:
+        for lock in locks:
+            lock.release()
+
+
+def is_excluded(item: GCItem, exclude_paths: List[str]) -> bool:
+    """
+    Whether any of the paths of the item contains, or is inside, one of the excluded paths.
+    """
+    for path in item.paths:
+        for exclude_path in exclude_paths:
+            if os.path.commonpath([path, exclude_path]) in (path, exclude_path):
+                return True
+    return False
+
+
+def collect_garbage(
+        install_parent_dir: str,
+        budget_bytes: int,
+        dry_run: bool = False,
+        exclude_paths: Optional[List[str]] = None) -> int:
+    """
+    Removes temporary directories, and then least recently used items in the eviction order until
+    the install parent directory fits into the budget. Items containing or inside any of
+    exclude_paths, e.g. those the current build is about to use, are not removed. Returns the
+    number of bytes freed.
+    """
+    if not os.path.isdir(install_parent_dir):
+        return 0
+    start_time_sec = time.time()
+    total_bytes = get_disk_usage_bytes([install_parent_dir])
+    logging.info("Disk usage of %s: %.1f GiB, budget: %.1f GiB",
+                 install_parent_dir, total_bytes / 1024 ** 3, budget_bytes / 1024 ** 3)
+    items = list_gc_items(install_parent_dir)
+    if exclude_paths:
+        items = [
+            item for item in items
+            if not is_excluded(item, [os.path.abspath(path) for path in exclude_paths])]
+    mark_checkouts_to_keep(items)
+
+    freed_bytes = 0
+    for item in items:
+        if item.kind == ITEM_KIND_TEMP_DIR and remove_item(item, install_parent_dir, dry_run):
+            freed_bytes += item.size_bytes
+
+    for kind in EVICTION_ORDER:
+        for item in sorted(
+                [item for item in items if item.kind == kind],
+                key=lambda item: item.last_used_time):
+            if total_bytes - freed_bytes <= budget_bytes:
+                break
+            size_to_free_bytes = item.get_size_to_free_bytes()
+            if size_to_free_bytes > 0 and remove_item(item, install_parent_dir, dry_run):
+                freed_bytes += size_to_free_bytes
+
+    logging.info("%s %.1f GiB in %s in %.1f seconds, disk usage is now %.1f GiB",
+                 "Would free" if dry_run else "Freed", freed_bytes / 1024 ** 3,
+                 install_parent_dir, time.time() - start_time_sec,
+                 (total_bytes - freed_bytes) / 1024 ** 3)
+    if total_bytes - freed_bytes > budget_bytes:
+        logging.warning("%s is still over its disk budget, the remaining items are in use or "
+                        "are kept for reuse", install_parent_dir)
+    return freed_bytes
+
+
+def gc_main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog='build_gcc.sh gc',
+        description='Remove old build directories, archives and installations to fit a disk '
+                    'budget')
+    parser.add_argument(
+        '--install_parent_dir',
+        default=DEFAULT_INSTALL_PARENT_DIR,
+        help='Directory to clean up. Default: %s' % DEFAULT_INSTALL_PARENT_DIR)
+    parser.add_argument(
+        '--budget_gb',
+        type=float,
+        required=True,
+        help='Disk budget of the directory, in GiB')
+    parser.add_argument(
+        '--dry_run',
+        action='store_true',
+        help='Only log what would be removed')
+    args = parser.parse_args(argv)
+
+    collect_garbage(
+        os.path.abspath(args.install_parent_dir),
+        int(args.budget_gb * 1024 ** 3),
+        dry_run=args.dry_run)
+    return 0
@@ -2,19 +2,22 @@ import os
 import time
 import logging
 
-import sys_detection
-
-from typing import Optional
+from typing import List, Optional
 
 from build_gcc.helpers import (
     get_current_timestamp_str,
     get_major_version,
 )
+from build_gcc.host_facts import get_host_facts
+from build_gcc.linkers import LTO_PARALLELISM_JOBSERVER
+from build_gcc.patch_series import is_patch_series_tag_component, PatchSeries
+from build_gcc.prerequisites import get_prerequisites_configure_args
 from build_gcc.constants import (
     BUILD_DIR_SUFFIX_WITH_SEPARATOR,
     YB_GCC_ARCHIVE_NAME_PREFIX,
     GIT_SHA1_PLACEHOLDER_STR,
     NAME_COMPONENT_SEPARATOR,
+    GCC_BUILD_INFO_DIR_NAME,
     GCC_CLONE_REL_PATH,
     GIT_SHA1_PREFIX_LENGTH,
 )
@@ -42,6 +45,19 @@ class GCCBuildConf:
 
     target_arch: str
 
+    # LTO parallelism for the bootstrap links: 'jobserver', 'auto', or a number. None means the
+    # default of bootstrap-lto, which is the make jobserver.
+    lto_parallelism: Optional[str]
+    lto_partitions: Optional[int]
+
+    # Linkers for the stage1 links with the host compiler and for the bootstrap stages. None means
+    # the compiler's default linker.
+    host_linker: Optional[str]
+    bootstrap_linker: Optional[str]
+
+    # Local patches applied to the source code after cloning.
+    patch_series: Optional[PatchSeries]
+
     def __init__(
             self,
             install_parent_dir: str,
@@ -51,11 +67,18 @@ class GCCBuildConf:
             clean_build: bool,
             existing_build_dir: Optional[str],
             parallelism: Optional[int],
-            target_arch: str) -> None:
+            target_arch: str,
+            lto_parallelism: Optional[str],
+            lto_partitions: Optional[int],
+            host_linker: Optional[str],
+            bootstrap_linker: Optional[str],
+            patch_series: Optional[PatchSeries] = None) -> None:
         self.install_parent_dir = install_parent_dir
         self.version = version
         self.gcc_major_version = get_major_version(version)
-        assert self.gcc_major_version >= 12
+        if self.gcc_major_version < 12:
+            raise ValueError(
+                "Unsupported GCC version %s, the oldest supported major version is 12" % version)
         self.user_specified_suffix = user_specified_suffix
         self.skip_auto_suffix = skip_auto_suffix
         self.git_sha1_prefix = None
@@ -86,26 +109,49 @@ class GCCBuildConf:
 
         self.parallelism = parallelism
         self.target_arch = target_arch
+        self.lto_parallelism = lto_parallelism
+        self.lto_partitions = lto_partitions
+        self.host_linker = host_linker
+        self.bootstrap_linker = bootstrap_linker
+        self.patch_series = patch_series
 
     def get_gcc_build_parent_dir(self) -> str:
+        # An existing build directory keeps its name when the patch series changes, so that it
+        # can be rebuilt incrementally.
         return os.path.join(
             self.install_parent_dir,
-            self.get_install_dir_basename() + BUILD_DIR_SUFFIX_WITH_SEPARATOR)
+            YB_GCC_ARCHIVE_NAME_PREFIX + (self.tag_override or self.get_tag()) +
+            BUILD_DIR_SUFFIX_WITH_SEPARATOR)
 
     def get_tag(self) -> str:
-        if self.tag_override:
+        """
+        The patch series component, if any, immediately follows the version, e.g.
+        v12.2.0-p0123abcd-1618898532-d28af7c6-almalinux8-x86_64. Without a patch series, the
+        tag of an existing build directory is used as is.
+        """
+        if self.tag_override and self.patch_series is None:
             return self.tag_override
+        components = self.get_tag_without_patch_series().split(NAME_COMPONENT_SEPARATOR)
+        if self.patch_series is not None and self.patch_series.patch_paths:
+            components.insert(1, self.patch_series.get_tag_component())
+        return NAME_COMPONENT_SEPARATOR.join(components)
+
+    def get_tag_without_patch_series(self) -> str:
+        if self.tag_override:
+            return NAME_COMPONENT_SEPARATOR.join(
+                component for component in self.tag_override.split(NAME_COMPONENT_SEPARATOR)
+                if not is_patch_series_tag_component(component))
 
         top_dir_suffix = ''
         if not self.skip_auto_suffix:
-            sys_conf = sys_detection.local_sys_conf()
+            host_facts = get_host_facts()
             components = [
                 component for component in [
                     self.unix_timestamp_for_suffix,
                     self.git_sha1_prefix or GIT_SHA1_PLACEHOLDER_STR,
                     self.user_specified_suffix,
-                    sys_conf.short_os_name_and_version(),
-                    sys_conf.architecture
+                    host_facts.short_os_name_and_version,
+                    host_facts.architecture
                 ] if component
             ]
             top_dir_suffix = NAME_COMPONENT_SEPARATOR + NAME_COMPONENT_SEPARATOR.join(
@@ -121,17 +167,131 @@ class GCCBuildConf:
             self.install_parent_dir,
             self.get_install_dir_basename())
 
+    def get_install_prefix(self) -> str:
+        """
+        The prefix GCC is configured with. An existing build directory keeps the prefix it was
+        first configured with when its tag changes with the patch series, because configure and
+        make would otherwise rebuild everything that depends on the prefix. The installed tree is
+        then relocated to the final installation directory (see install_staging.py).
+        """
+        if self.tag_override:
+            return os.path.join(
+                self.install_parent_dir, YB_GCC_ARCHIVE_NAME_PREFIX + self.tag_override)
+        return self.get_final_install_dir()
+
     def get_gcc_build_info_dir(self) -> str:
-        return os.path.join(self.get_final_install_dir(), 'etc', 'yb-gcc-build-info')
+        return os.path.join(self.get_final_install_dir(), GCC_BUILD_INFO_DIR_NAME)
 
     def get_gcc_clone_dir(self) -> str:
         return os.path.join(self.get_gcc_build_parent_dir(), GCC_CLONE_REL_PATH)
 
-    def set_git_sha1(self, git_sha1: str) -> None:
-        old_build_parent_dir = self.get_gcc_build_parent_dir()
+    def get_gcc_build_dir(self) -> str:
+        return os.path.join(self.get_gcc_build_parent_dir(), 'build')
+
+    def get_archive_path(self) -> str:
+        return self.get_final_install_dir() + '.tar.gz'
+
+    def get_parallelism(self) -> int:
+        return self.parallelism or os.cpu_count() or 1
 
+    def get_configure_args(
+            self,
+            c_compiler: Optional[str],
+            cxx_compiler: Optional[str],
+            prerequisites_prefix: Optional[str] = None) -> List[str]:
+        """
+        If prerequisites_prefix is specified, GCC is built against the gmp, mpfr, mpc and isl
+        libraries installed there, instead of building them in-tree.
+        """
+        prerequisites_args = []
+        if prerequisites_prefix:
+            prerequisites_args = get_prerequisites_configure_args(prerequisites_prefix)
+        return [
+            f'--prefix={self.get_install_prefix()}',
+            '--disable-multilib',
+            '--disable-nls',
+            '--enable-languages=c,c++,lto',
+            '--enable-lto',
+            '--with-build-config=bootstrap-O3 bootstrap-lto',
+            f'CC={c_compiler}',
+            f'CXX={cxx_compiler}',
+        ] + prerequisites_args + (
+            [f'LDFLAGS=-fuse-ld={self.host_linker}'] if self.host_linker else [])
+
+    def get_configure_cmd_line(
+            self,
+            c_compiler: Optional[str],
+            cxx_compiler: Optional[str],
+            prerequisites_prefix: Optional[str] = None) -> List[str]:
+        """
+        The configure script is specified relative to the build directory, so that the paths to the
+        source directory recorded in the build directory are relative too, and a snapshot of the
+        build directory does not depend on where the source is (see stage1_cache.py).
+        """
+        return [
+            os.path.relpath(
+                os.path.join(self.get_gcc_clone_dir(), 'configure'), self.get_gcc_build_dir())
+        ] + self.get_configure_args(c_compiler, cxx_compiler, prerequisites_prefix)
+
+    def get_boot_ldflags(self) -> List[str]:
+        """
+        Linker flags for the bootstrap stages. These are appended to the flags from bootstrap-lto,
+        so they take precedence.
+        """
+        flags = []
+        if self.lto_parallelism:
+            flags.append(f'-flto={self.lto_parallelism}')
+        if self.lto_partitions:
+            flags.append(f'--param=lto-partitions={self.lto_partitions}')
+        if self.bootstrap_linker:
+            flags.append(f'-fuse-ld={self.bootstrap_linker}')
+        return flags
+
+    def get_build_profile(self) -> str:
+        """
+        A string identifying the build settings that affect how long the build takes and how
+        much disk space it uses. Used for comparing with earlier builds.
+        """
+        return ' '.join([
+            'profiledbootstrap bootstrap-O3 bootstrap-lto',
+            f'lto={self.lto_parallelism or LTO_PARALLELISM_JOBSERVER}',
+            f'lto_partitions={self.lto_partitions or "default"}',
+            f'host_linker={self.host_linker or "default"}',
+            f'bootstrap_linker={self.bootstrap_linker or "default"}',
+        ])
+
+    def get_make_build_args(
+            self,
+            target: str = 'profiledbootstrap',
+            parallelism: Optional[int] = None,
+            make_vars: Optional[List[str]] = None) -> List[str]:
+        """
+        make_vars are additional variable assignments, e.g. to override the host compilers.
+        """
+        make_args = ['make', '-j', str(parallelism or self.get_parallelism())]
+        boot_ldflags = self.get_boot_ldflags()
+        if boot_ldflags:
+            make_args.append('BOOT_LDFLAGS=' + ' '.join(boot_ldflags))
+        return make_args + (make_vars or []) + [target]
+
+    def get_install_staging_dir(self) -> str:
+        """
+        The DESTDIR for make install. The installed tree is moved from there to the final
+        installation directory after the install succeeds.
+        """
+        return os.path.join(self.get_gcc_build_parent_dir(), 'install_staging')
+
+    def get_make_install_args(self) -> List[str]:
+        return [
+            'make', '-j', str(self.get_parallelism()), 'install',
+            'DESTDIR=' + self.get_install_staging_dir(),
+        ]
+
+    def set_git_sha1(self, git_sha1: str) -> None:
+        """
+        Replaces the placeholder in the tag with the git SHA1 prefix. This changes the build and
+        installation directories, and it is up to the caller to move the build directory.
+        """
         self.git_sha1_prefix = git_sha1[:GIT_SHA1_PREFIX_LENGTH]
         logging.info("Git SHA1: %s", git_sha1)
         logging.info("Using git SHA1 prefix: %s", self.git_sha1_prefix)
-        logging.info("Renaming %s -> %s", old_build_parent_dir, self.get_gcc_build_parent_dir())
-        os.rename(old_build_parent_dir, self.get_gcc_build_parent_dir())
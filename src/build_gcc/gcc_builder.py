@@ -1,18 +1,16 @@
 import os
 import logging
-import shlex
 import subprocess
-import git
 import atexit
 import time
 import platform
+import json
 
-from typing import Any, List, Optional
-
-from sys_detection import is_linux, is_macos
+from typing import Any, Callable, Dict, List, Optional
 
 from build_gcc.constants import (
-    GCC_CLONE_REL_PATH,
+    SHARED_CACHE_DIR_NAME,
+    TESTSUITE_RESULTS_DIR_NAME,
     GIT_SHA1_PLACEHOLDER_STR_WITH_SEPARATORS,
     YB_GCC_ARCHIVE_NAME_PREFIX,
     BUILD_GCC_SCRIPTS_ROOT_PATH,
@@ -21,16 +19,76 @@ from build_gcc.helpers import (
     mkdir_p,
     remove_version_suffix,
     rm_rf,
+    get_disk_usage_bytes,
     run_cmd,
-    ChangeDir,
+    run_cmd_with_output_handler,
+    validate_build_gcc_scripts_root_path,
+    write_file_atomically,
 )
 from build_gcc.gcc_build_conf import GCCBuildConf
-from build_gcc.git_helpers import git_clone_tag, get_current_git_sha1, save_git_log_to_file
+from build_gcc.git_helpers import (
+    find_gcc_source_checkouts,
+    get_tags_at_head,
+    git_clone_tag,
+    get_current_git_commit_timestamp,
+    get_current_git_sha1,
+    save_git_log_to_file,
+)
 from build_gcc import remote_build
 from build_gcc.devtoolset import activate_devtoolset
 from build_gcc.cmd_line_args import parse_args
+from build_gcc.autoconf_cache import (
+    AutoconfCache,
+    ConfigureCheckStats,
+    get_configure_args_without_prefix,
+)
 from build_gcc.architecture import validate_build_output_arch, get_arch_switch_cmd_prefix
-from build_gcc.devtoolset import find_latest_gcc
+from build_gcc.host_facts import get_compiler_facts, get_host_facts, is_macos
+from build_gcc.locking import FileLock, get_path_lock
+from build_gcc.distributed_compile import (
+    DistributedCompileConfig,
+    setup_distributed_compile,
+)
+from build_gcc.garbage_collector import collect_garbage
+from build_gcc.install_staging import (
+    get_staged_install_dir,
+    InstallPostProcessor,
+    move_staged_install_into_place,
+)
+from build_gcc.manifest import KnownChecksums, write_manifest
+from build_gcc.publish import ArchivePublisher, get_upload_target
+from build_gcc.registry import register_install_dir
+from build_gcc.patch_series import apply_patch_series
+from build_gcc.path_rewriting import get_path_replacements, PathRewriter
+from build_gcc.prerequisites import (
+    build_prerequisites_prefix,
+    get_prerequisite_versions,
+    get_prerequisites_prefix_dir,
+)
+from build_gcc.task_graph import TaskGraph
+from build_gcc.testsuite import (
+    compare_to_baseline,
+    LOCAL_HOST,
+    TestsuiteRunner,
+    write_testsuite_summary,
+)
+from build_gcc.build_history import (
+    check_build_requirements,
+    BuildHistory,
+    BuildRecord,
+)
+from build_gcc.build_progress import BuildProgressTracker
+from build_gcc.stage1_cache import (
+    compute_stage1_cache_key,
+    set_source_mtimes,
+    Stage1Cache,
+)
+from build_gcc.linkers import (
+    check_bootstrap_linker_available,
+    check_linker_works_with_compiler,
+    get_linker_version,
+    LTO_PARALLELISM_JOBSERVER,
+)
 
 
 class GCCBuilder:
@@ -38,52 +96,89 @@ class GCCBuilder:
     gcc_parent_dir: str
     build_conf: GCCBuildConf
 
+    # Information about the build saved as build_info.json in the build info directory.
+    build_info: Dict[str, Any]
+
+    build_history: Optional[BuildHistory]
+
+    # An exclusive lock on the source checkout this build is cloning into. It is held until the
+    # checkout is complete and has been moved to its final location.
+    source_checkout_lock: Optional[FileLock]
+
+    # Locks held until the end of the build, e.g. on the installation directory and on shared
+    # caches used by the build.
+    held_locks: List[FileLock]
+
+    # Checksums of the installed files computed while installing, reused for the manifest.
+    install_checksums: Optional[KnownChecksums]
+
+    # The archive uploaded while it was created, if --publish_url is specified.
+    archive_publisher: Optional[ArchivePublisher]
+
+    def __init__(self) -> None:
+        self.build_info = {}
+        self.build_history = None
+        self.source_checkout_lock = None
+        self.held_locks = []
+        self.install_checksums = None
+        self.archive_publisher = None
+
+    def get_build_history(self) -> BuildHistory:
+        if self.build_history is None:
+            self.build_history = BuildHistory()
+        return self.build_history
+
+    def get_recent_builds_of_same_config(self) -> List[BuildRecord]:
+        return self.get_build_history().get_recent_builds(
+            gcc_version=self.build_conf.version,
+            profile=self.build_conf.get_build_profile(),
+            target_arch=self.build_conf.target_arch)
+
     def parse_args(self) -> None:
         self.args, self.build_conf = parse_args()
 
     def clone_gcc_source_code(self) -> None:
         gcc_src_path = self.build_conf.get_gcc_clone_dir()
+        install_parent_dir = self.build_conf.install_parent_dir
         logging.info(f"Cloning GCC code to {gcc_src_path}")
 
-        mkdir_p('/opt/yb-build/gcc')
-        find_cmd = [
-            'find', '/opt/yb-build/gcc', '-mindepth', '3', '-maxdepth', '3',
-            '-wholename', os.path.join('*', GCC_CLONE_REL_PATH)
-        ]
-        logging.info("Searching for existing GCC source directories using command: %s",
-                     ' '.join([shlex.quote(item) for item in find_cmd]))
-        existing_src_dirs = subprocess.check_output(find_cmd).decode('utf-8').split('\n')
+        # Other builds skip checkouts that are locked exclusively, i.e. are still being written.
+        self.source_checkout_lock = get_path_lock(install_parent_dir, gcc_src_path)
+        self.source_checkout_lock.acquire()
+
+        if self.args.clone_from:
+            existing_src_dirs = [self.args.clone_from]
+        else:
+            mkdir_p(install_parent_dir)
+            existing_src_dirs = find_gcc_source_checkouts(install_parent_dir)
 
         tag_we_want = 'releases/gcc-%s' % self.build_conf.version
 
         existing_dir_to_use: Optional[str] = None
+        existing_dir_lock: Optional[FileLock] = None
         gcc_repo_url = f'https://github.com/{self.args.github_org}/gcc.git'
         for existing_src_dir in existing_src_dirs:
-            existing_src_dir = existing_src_dir.strip()
-            if not existing_src_dir:
+            if existing_src_dir == gcc_src_path:
                 continue
             if not os.path.exists(existing_src_dir):
                 logging.warning("Directory %s does not exist", existing_src_dir)
                 continue
 
-            repo = git.Repo(existing_src_dir)
-            # From https://stackoverflow.com/questions/34932306/get-tags-of-a-commit
-            # Also relevant:
-            # https://stackoverflow.com/questions/32523121/gitpython-get-current-tag-detached-head
-            for tag in repo.tags:
-                tag_commit = repo.commit(tag)
-                if tag_commit.hexsha == repo.head.commit.hexsha:
-                    logging.info(
-                        f"Found tag {tag.name} in {existing_src_dir} "
-                        f"matching the head SHA1 {repo.head.commit.hexsha}")
-                    if tag.name == tag_we_want:
-                        existing_dir_to_use = existing_src_dir
-                        logging.info(
-                            "This tag matches the name we want: %s, will clone from directory %s",
-                            tag_we_want, existing_dir_to_use)
-                        break
-            if existing_dir_to_use:
+            existing_dir_lock = get_path_lock(install_parent_dir, existing_src_dir)
+            if not existing_dir_lock.acquire(shared=True, blocking=False):
+                logging.info("Skipping checkout %s, it is being written by another build",
+                             existing_src_dir)
+                existing_dir_lock = None
+                continue
+
+            if tag_we_want in get_tags_at_head(existing_src_dir):
+                existing_dir_to_use = existing_src_dir
+                logging.info(
+                    "This tag matches the name we want: %s, will clone from directory %s",
+                    tag_we_want, existing_dir_to_use)
                 break
+            existing_dir_lock.release()
+            existing_dir_lock = None
         if not existing_dir_to_use:
             logging.info("Did not find an existing checkout of tag %s, will clone %s",
                          tag_we_want, gcc_repo_url)
@@ -91,18 +186,51 @@ class GCCBuilder:
         if GIT_SHA1_PLACEHOLDER_STR_WITH_SEPARATORS in os.path.basename(
                 os.path.dirname(os.path.dirname(gcc_src_path))):
             def remove_dir_with_placeholder_in_name() -> None:
-                if os.path.exists(gcc_src_path):
-                    logging.info("Removing directory %s", gcc_src_path)
-                    subprocess.call(['rm', '-rf', gcc_src_path])
-                else:
-                    logging.warning("Directory %s does not exist, nothing to remove",
-                                    gcc_src_path)
+                # After this build has renamed the directory, another build may have started
+                # cloning into the same placeholder path. Only remove the directory if no other
+                # build holds the lock on it.
+                checkout_lock = self.source_checkout_lock
+                if checkout_lock is None or not checkout_lock.is_held():
+                    checkout_lock = get_path_lock(install_parent_dir, gcc_src_path)
+                    if not checkout_lock.acquire(blocking=False):
+                        logging.info("Not removing directory %s, it is used by another build",
+                                     gcc_src_path)
+                        return
+                try:
+                    if os.path.exists(gcc_src_path):
+                        logging.info("Removing directory %s", gcc_src_path)
+                        subprocess.call(['rm', '-rf', gcc_src_path])
+                    else:
+                        logging.info("Directory %s does not exist, nothing to remove",
+                                     gcc_src_path)
+                finally:
+                    checkout_lock.release()
             atexit.register(remove_dir_with_placeholder_in_name)
 
-        git_clone_tag(
-            gcc_repo_url if existing_dir_to_use is None else existing_dir_to_use,
-            tag_we_want,
-            gcc_src_path)
+            if os.path.exists(gcc_src_path):
+                # We hold the lock, so this was left behind by a build that failed.
+                logging.info("Removing incomplete checkout %s", gcc_src_path)
+                rm_rf(gcc_src_path)
+
+        try:
+            copy_result = git_clone_tag(
+                gcc_repo_url if existing_dir_to_use is None else existing_dir_to_use,
+                tag_we_want,
+                gcc_src_path)
+        finally:
+            if existing_dir_lock is not None:
+                existing_dir_lock.release()
+        if copy_result is not None:
+            self.build_info['source_copy'] = copy_result.to_dict()
+
+    def get_install_dir_to_package(self) -> str:
+        return self.args.upload_earlier_build or self.build_conf.get_final_install_dir()
+
+    def get_archive_path(self) -> str:
+        return self.get_install_dir_to_package() + '.tar.gz'
+
+    def get_sha256sum_file_path(self) -> str:
+        return self.get_archive_path() + '.sha256'
 
     def run(self) -> None:
         if os.getenv('BUILD_GCC_REMOTELY') == '1' and not self.args.local_build:
@@ -114,6 +242,7 @@ class GCCBuilder:
             )
             return
 
+        validate_build_gcc_scripts_root_path()
         activate_devtoolset()
 
         if (self.args.existing_build_dir is not None and
@@ -124,45 +253,252 @@ class GCCBuilder:
                 f"Computed build directory       : {self.build_conf.get_gcc_build_parent_dir()}")
             raise ValueError("Build directory mismatch, see the details above.")
 
+        task_graph = self.create_task_graph()
+        selected_task_names = task_graph.select_tasks(
+            only=self.args.only, from_task=self.args.from_task)
+        logging.info("Tasks to run: %s", ', '.join(selected_task_names))
+        try:
+            task_graph.run(selected_task_names, max_workers=len(task_graph.tasks))
+        finally:
+            task_graph.log_critical_path()
+            for held_lock in self.held_locks:
+                held_lock.release()
+            self.held_locks = []
+
+    def create_task_graph(self) -> TaskGraph:
+        task_graph = TaskGraph()
         if not self.args.upload_earlier_build:
-            if self.args.existing_build_dir:
-                logging.info("Not cloning the code, assuming it has already been done.")
-            else:
-                self.clone_gcc_source_code()
-                mkdir_p(self.build_conf.get_gcc_build_info_dir())
-
-            if not self.args.skip_auto_suffix:
-                git_sha1 = get_current_git_sha1(self.build_conf.get_gcc_clone_dir())
-                self.build_conf.set_git_sha1(git_sha1)
-                logging.info(
-                    "Final GCC code directory: %s",
-                    self.build_conf.get_gcc_clone_dir())
-
-            logging.info(
-                "GCC will be built and installed to: %s",
-                self.build_conf.get_final_install_dir())
-
-            save_git_log_to_file(
-                self.build_conf.get_gcc_clone_dir(),
-                os.path.join(
-                    self.build_conf.get_gcc_build_info_dir(), 'gcc_git_log.txt'))
-
+            if not self.args.skip_build and not self.args.skip_preflight_check:
+                task_graph.add_task(
+                    'preflight_check', self.preflight_check_task, outputs=['preflight_check'])
+            task_graph.add_task(
+                'clone', self.clone_task, inputs=['preflight_check'], outputs=['cloned_source'])
+            # Resolves the directories and locks them, which partial runs need too.
+            task_graph.add_task(
+                'resolve_tag', self.resolve_tag_task,
+                inputs=['cloned_source'], outputs=['source'], always_run=True)
+            task_graph.add_task(
+                'save_git_log', self.save_git_log_task,
+                inputs=['source'], outputs=['git_log'])
+            task_graph.add_task(
+                'compute_prerequisites', self.compute_prerequisites_task,
+                inputs=['source'], outputs=['prerequisites'])
             if self.args.skip_build:
                 logging.info("Skipping build, --skip_build specified")
             else:
-                build_start_time_sec = time.time()
-                logging.info("Building GCC")
-                self.do_build()
-                build_elapsed_time_sec = time.time() - build_start_time_sec
-                logging.info("Built GCC %.1f seconds", build_elapsed_time_sec)
-
-        final_install_dir = (
-            self.args.upload_earlier_build or self.build_conf.get_final_install_dir())
+                task_graph.add_task(
+                    'build', self.build_task,
+                    inputs=['source'], outputs=['install_dir'])
+            task_graph.add_task(
+                'validate_arch', self.validate_arch_task,
+                inputs=['install_dir'], outputs=['validated_install_dir'])
+            if self.args.run_testsuite:
+                # Runs concurrently with packaging, only the upload waits for it.
+                task_graph.add_task(
+                    'run_testsuite', self.run_testsuite_task,
+                    inputs=['validated_install_dir'], outputs=['testsuite_results'])
+            task_graph.add_task(
+                'write_build_info', self.write_build_info_task,
+                inputs=['install_dir', 'git_log', 'prerequisites'], outputs=['build_info'])
+            task_graph.add_task(
+                'write_manifest', self.write_manifest_task,
+                inputs=['install_dir', 'build_info'], outputs=['manifest'])
+        if self.args.publish_url and not self.args.skip_upload:
+            # The archive is uploaded while it is created, and published only after the checksum
+            # is verified and the install directory has been validated and tested.
+            task_graph.add_task(
+                'archive_and_upload', self.archive_and_upload_task,
+                inputs=['install_dir', 'build_info', 'manifest'],
+                outputs=['archive', 'checksum', 'uploaded_archive'])
+        else:
+            task_graph.add_task(
+                'archive', self.archive_task,
+                inputs=['install_dir', 'build_info', 'manifest'], outputs=['archive'])
+            task_graph.add_task(
+                'compute_checksum', self.compute_checksum_task,
+                inputs=['archive'], outputs=['checksum'])
+        task_graph.add_task(
+            'register', self.register_task,
+            inputs=['validated_install_dir', 'checksum'], outputs=['registry_entry'])
+        if self.args.skip_upload:
+            logging.info("Skipping upload")
+        elif self.args.publish_url:
+            task_graph.add_task(
+                'publish', self.publish_task,
+                inputs=['uploaded_archive', 'checksum', 'validated_install_dir',
+                        'testsuite_results'])
+        else:
+            task_graph.add_task(
+                'prepare_release', self.prepare_release_task, outputs=['release_credentials'],
+                always_run=True)
+            task_graph.add_task(
+                'upload', self.upload_task,
+                inputs=['archive', 'checksum', 'validated_install_dir', 'testsuite_results',
+                        'release_credentials'])
+        return task_graph
+
+    def preflight_check_task(self) -> None:
+        recent_builds = self.get_recent_builds_of_same_config()
+        if self.args.disk_budget_gb is not None:
+            # Leave room for this build in the budget.
+            expected_disk_usage_bytes = max(
+                [b.disk_usage_bytes for b in recent_builds if b.disk_usage_bytes], default=0)
+            collect_garbage(
+                self.build_conf.install_parent_dir,
+                max(int(self.args.disk_budget_gb * 1024 ** 3) - expected_disk_usage_bytes, 0),
+                exclude_paths=[
+                    path for path in [self.args.existing_build_dir, self.args.clone_from]
+                    if path])
+        check_build_requirements(
+            recent_builds, self.build_conf.install_parent_dir, self.build_conf.get_parallelism())
+
+    def clone_task(self) -> None:
+        if self.args.existing_build_dir:
+            logging.info("Not cloning the code, assuming it has already been done.")
+        else:
+            self.clone_gcc_source_code()
+            mkdir_p(self.build_conf.get_gcc_build_info_dir())
+        patch_series = self.build_conf.patch_series
+        if patch_series is not None:
+            changed_files = apply_patch_series(self.build_conf.get_gcc_clone_dir(), patch_series)
+            self.build_info['patch_series'] = dict(
+                patch_series.to_dict(), num_changed_files=len(changed_files))
+
+    def lock_install_dir(self) -> None:
+        """
+        Locks the final installation directory and the build directory until the end of the
+        build, so that concurrent builds of the same tag do not write to the same build and
+        installation directories, and the garbage collector leaves them alone.
+        """
+        for dir_path in [
+                self.build_conf.get_final_install_dir(),
+                self.build_conf.get_gcc_build_parent_dir()]:
+            dir_lock = get_path_lock(self.build_conf.install_parent_dir, dir_path)
+            dir_lock.acquire()
+            self.held_locks.append(dir_lock)
+
+    def resolve_tag_task(self) -> None:
+        if self.args.skip_auto_suffix:
+            self.lock_install_dir()
+        else:
+            git_sha1 = get_current_git_sha1(self.build_conf.get_gcc_clone_dir())
+            placeholder_build_parent_dir = self.build_conf.get_gcc_build_parent_dir()
+            self.build_conf.set_git_sha1(git_sha1)
+            self.lock_install_dir()
+            build_parent_dir = self.build_conf.get_gcc_build_parent_dir()
+            if os.path.exists(build_parent_dir):
+                # Left by an earlier build of the same tag, which has finished since we hold the
+                # lock on the installation directory. The source code is the same.
+                logging.info("Reusing existing build directory %s", build_parent_dir)
+                rm_rf(placeholder_build_parent_dir)
+            else:
+                logging.info("Renaming %s -> %s", placeholder_build_parent_dir, build_parent_dir)
+                os.rename(placeholder_build_parent_dir, build_parent_dir)
+            logging.info(
+                "Final GCC code directory: %s",
+                self.build_conf.get_gcc_clone_dir())
+        if self.source_checkout_lock is not None:
+            self.source_checkout_lock.release()
+
+        logging.info(
+            "GCC will be built and installed to: %s",
+            self.build_conf.get_final_install_dir())
+
+    def save_git_log_task(self) -> None:
+        save_git_log_to_file(
+            self.build_conf.get_gcc_clone_dir(),
+            os.path.join(
+                self.build_conf.get_gcc_build_info_dir(), 'gcc_git_log.txt'))
+
+    def compute_prerequisites_task(self) -> None:
+        prerequisite_versions = get_prerequisite_versions(self.build_conf.get_gcc_clone_dir())
+        logging.info("GCC prerequisites: %s", prerequisite_versions)
+        self.build_info['prerequisites'] = prerequisite_versions
+
+    def build_task(self) -> None:
+        build_start_time_sec = time.time()
+        logging.info("Building GCC")
+        self.do_build()
+        build_elapsed_time_sec = time.time() - build_start_time_sec
+        self.build_info['build_elapsed_time_sec'] = build_elapsed_time_sec
+        logging.info("Built GCC %.1f seconds", build_elapsed_time_sec)
+
+    def validate_arch_task(self) -> None:
+        if self.install_checksums is not None:
+            logging.info("The architecture of the installed files was validated while installing")
+            return
+        validate_build_output_arch(
+            self.build_conf.target_arch, self.build_conf.get_final_install_dir())
+
+    def run_testsuite_task(self) -> None:
+        results_dir = os.path.join(
+            self.build_conf.get_gcc_build_parent_dir(), TESTSUITE_RESULTS_DIR_NAME)
+        runner = TestsuiteRunner(
+            gcc_src_dir=self.build_conf.get_gcc_clone_dir(),
+            gcc_build_dir=self.build_conf.get_gcc_build_dir(),
+            results_dir=results_dir,
+            tools=self.args.testsuite_tools,
+            hosts=self.args.testsuite_hosts or (
+                [LOCAL_HOST] * self.build_conf.get_parallelism()),
+            cmd_prefix=get_arch_switch_cmd_prefix(self.build_conf.target_arch))
+        build_history = self.get_build_history()
+        try:
+            counts_by_tool = runner.run(build_history.get_testsuite_unit_times(
+                self.build_conf.version, self.build_conf.target_arch))
+        finally:
+            build_history.add_testsuite_unit_times(
+                self.build_conf.version, self.build_conf.target_arch, runner.unit_times)
+
+        baseline_comparison = None
+        if self.args.testsuite_baseline_dir:
+            baseline_comparison = compare_to_baseline(
+                results_dir, self.args.testsuite_baseline_dir, self.args.testsuite_tools)
+        write_testsuite_summary(
+            results_dir, counts_by_tool, baseline_comparison, runner.incomplete_units)
+        logging.info("Testsuite results saved to %s", results_dir)
+        if runner.incomplete_units:
+            raise ValueError("%d testsuite units did not complete, see %s" % (
+                len(runner.incomplete_units), results_dir))
+        if baseline_comparison and any(
+                comparison['new_failures'] for comparison in baseline_comparison.values()):
+            raise ValueError("New testsuite failures compared to the baseline in %s, see %s" % (
+                self.args.testsuite_baseline_dir, results_dir))
+
+    def write_build_info_task(self) -> None:
+        build_info_path = os.path.join(self.build_conf.get_gcc_build_info_dir(), 'build_info.json')
+        build_info: Dict[str, Any] = {}
+        if os.path.exists(build_info_path):
+            # Keep the information from earlier runs, e.g. with --only or --from.
+            with open(build_info_path) as build_info_file:
+                build_info = json.load(build_info_file)
+        build_info.update(self.build_info)
+        build_info.update(
+            gcc_version=self.build_conf.version,
+            tag=self.build_conf.get_tag(),
+            git_sha1=get_current_git_sha1(self.build_conf.get_gcc_clone_dir()),
+            profile=self.build_conf.get_build_profile(),
+            build_time=time.time(),
+            target_arch=self.build_conf.target_arch,
+            host=get_host_facts().to_dict(),
+            compilers=get_compiler_facts().to_dict(),
+        )
+        mkdir_p(os.path.dirname(build_info_path))
+        write_file_atomically(
+            build_info_path, json.dumps(build_info, indent=2, sort_keys=True) + '\n')
+
+    def write_manifest_task(self) -> None:
+        write_manifest(
+            self.build_conf.get_final_install_dir(),
+            num_threads=self.build_conf.get_parallelism(),
+            known_checksums=self.install_checksums)
+
+    def archive_task(self) -> None:
+        final_install_dir = self.get_install_dir_to_package()
 
         final_install_dir_basename = os.path.basename(final_install_dir)
         final_install_parent_dir = os.path.dirname(final_install_dir)
-        archive_name = final_install_dir_basename + '.tar.gz'
-        archive_path = os.path.join(final_install_parent_dir, archive_name)
+        archive_path = self.get_archive_path()
+        archive_name = os.path.basename(archive_path)
 
         if not self.args.reuse_tarball or not os.path.exists(archive_path):
             if os.path.exists(archive_path):
@@ -177,84 +513,373 @@ class GCCBuilder:
                 cwd=final_install_parent_dir,
             )
 
+    def compute_checksum_task(self) -> None:
         if is_macos():
             sha_sum_cmd_line = ['shasum', '-a', '256']
         else:
             sha_sum_cmd_line = ['sha256sum']
-        sha_sum_cmd_line.append(archive_path)
+        sha_sum_cmd_line.append(self.get_archive_path())
         sha256sum_output = subprocess.check_output(sha_sum_cmd_line).decode('utf-8')
-        sha256sum_file_path = archive_path + '.sha256'
-        with open(sha256sum_file_path, 'w') as sha256sum_file:
+        with open(self.get_sha256sum_file_path(), 'w') as sha256sum_file:
             sha256sum_file.write(sha256sum_output)
 
-        assert final_install_dir_basename.startswith(YB_GCC_ARCHIVE_NAME_PREFIX)
-        tag = final_install_dir_basename[len(YB_GCC_ARCHIVE_NAME_PREFIX):]
-
-        if self.args.skip_upload:
-            logging.info("Skipping upload")
-            return
-
+    def archive_and_upload_task(self) -> None:
+        final_install_dir = self.get_install_dir_to_package()
+        archive_path = self.get_archive_path()
+        publisher = ArchivePublisher(
+            get_upload_target(self.args.publish_url),
+            archive_path,
+            part_size=int(self.args.publish_part_size_mb * 1024 * 1024))
+
+        if self.args.reuse_tarball and os.path.exists(archive_path):
+            with open(archive_path, 'rb') as archive_file:
+                sha256 = publisher.upload(archive_file, write_archive=False)
+        else:
+            tar_cmd = ['tar', 'czf', '-', os.path.basename(final_install_dir)]
+            logging.info("Running command: %s (in directory: %s)",
+                         ' '.join(tar_cmd), os.path.dirname(final_install_dir))
+            tar_process = subprocess.Popen(
+                tar_cmd, cwd=os.path.dirname(final_install_dir), stdout=subprocess.PIPE)
+            assert tar_process.stdout is not None
+            try:
+                sha256 = publisher.upload(tar_process.stdout, write_archive=True)
+            finally:
+                if tar_process.poll() is None:
+                    tar_process.kill()
+                tar_process.stdout.close()
+                exit_code = tar_process.wait()
+            if exit_code != 0:
+                raise IOError("tar exited with code %d" % exit_code)
+
+        # The same format as the output of sha256sum in compute_checksum_task.
+        with open(self.get_sha256sum_file_path(), 'w') as sha256sum_file:
+            sha256sum_file.write('%s  %s\n' % (sha256, archive_path))
+        self.archive_publisher = publisher
+
+    def publish_task(self) -> None:
+        if self.archive_publisher is None:
+            raise ValueError(
+                "The archive has not been uploaded in this run, run the archive_and_upload task "
+                "too")
+        self.archive_publisher.commit(self.get_sha256sum_file_path())
+
+    def register_task(self) -> None:
+        with open(self.get_sha256sum_file_path()) as sha256sum_file:
+            archive_sha256 = sha256sum_file.read().split()[0]
+        register_install_dir(self.get_install_dir_to_package(), archive_sha256=archive_sha256)
+
+    def prepare_release_task(self) -> None:
         github_token_path = os.path.expanduser('~/.github-token')
         if os.path.exists(github_token_path) and not os.getenv('GITHUB_TOKEN'):
             logging.info("Reading GitHub token from %s", github_token_path)
             with open(github_token_path) as github_token_file:
                 os.environ['GITHUB_TOKEN'] = github_token_file.read().strip()
+        if not os.getenv('GITHUB_TOKEN'):
+            logging.warning("GITHUB_TOKEN is not set, the upload may fail")
+
+    def upload_task(self) -> None:
+        final_install_dir_basename = os.path.basename(self.get_install_dir_to_package())
+        assert final_install_dir_basename.startswith(YB_GCC_ARCHIVE_NAME_PREFIX)
+        tag = final_install_dir_basename[len(YB_GCC_ARCHIVE_NAME_PREFIX):]
 
         run_cmd([
             'hub',
             'release',
             'create', tag,
             '-m', 'Release %s' % tag,
-            '-a', archive_path,
-            '-a', sha256sum_file_path,
+            '-a', self.get_archive_path(),
+            '-a', self.get_sha256sum_file_path(),
         ], cwd=BUILD_GCC_SCRIPTS_ROOT_PATH)
 
+    def install(self, cmd_prefix: List[str], handle_output_line: Callable[[str], None]) -> None:
+        """
+        Runs a parallel make install into a staging directory while post-processing the installed
+        files, and moves the staged tree into the final installation directory if everything
+        succeeds.
+        """
+        install_start_time_sec = time.time()
+        staging_dir = self.build_conf.get_install_staging_dir()
+        install_prefix = self.build_conf.get_install_prefix()
+        final_install_dir = self.build_conf.get_final_install_dir()
+        staged_install_dir = get_staged_install_dir(staging_dir, install_prefix)
+        rm_rf(staging_dir)
+        mkdir_p(staged_install_dir)
+        path_rewriter: Optional[PathRewriter] = None
+        if install_prefix != final_install_dir:
+            logging.info("Relocating the installation from the configured prefix %s to %s",
+                         install_prefix, final_install_dir)
+            path_rewriter = PathRewriter(
+                get_path_replacements([install_prefix], [final_install_dir]))
+        post_processor = InstallPostProcessor(
+            staged_install_dir,
+            target_arch=self.build_conf.target_arch,
+            strip=self.args.strip_installed_binaries,
+            dedup=self.args.dedup_installed_files,
+            num_threads=self.build_conf.get_parallelism(),
+            path_rewriter=path_rewriter)
+        post_processor.start()
+        try:
+            run_cmd_with_output_handler(
+                cmd_prefix + self.build_conf.get_make_install_args(),
+                handle_output_line,
+                cwd=self.build_conf.get_gcc_build_dir())
+            make_install_elapsed_time_sec = time.time() - install_start_time_sec
+            checksums = post_processor.finish()
+            move_staged_install_into_place(staged_install_dir, final_install_dir)
+        except BaseException:
+            post_processor.abort()
+            raise
+        finally:
+            rm_rf(staging_dir)
+        self.install_checksums = checksums
+        self.build_info['install'] = dict(
+            post_processor.get_stats(),
+            make_install_elapsed_time_sec=make_install_elapsed_time_sec,
+            elapsed_time_sec=time.time() - install_start_time_sec)
+        logging.info("Installed %d files in %.1f seconds, %d of them processed while make install "
+                     "was running", len(checksums), time.time() - install_start_time_sec,
+                     post_processor.num_files_processed_during_install)
+
+    def check_linkers(self, c_compiler: Optional[str]) -> None:
+        host_linker = self.build_conf.host_linker
+        bootstrap_linker = self.build_conf.bootstrap_linker
+        if host_linker:
+            check_linker_works_with_compiler(host_linker, c_compiler)
+        if bootstrap_linker:
+            check_bootstrap_linker_available(bootstrap_linker)
+        self.build_info['lto'] = {
+            'parallelism': self.build_conf.lto_parallelism or LTO_PARALLELISM_JOBSERVER,
+            'partitions': self.build_conf.lto_partitions,
+        }
+        self.build_info['linkers'] = {
+            'host': host_linker or 'default',
+            'host_version': get_linker_version(host_linker) if host_linker else None,
+            'bootstrap': bootstrap_linker or 'default',
+            'bootstrap_version': get_linker_version(bootstrap_linker) if bootstrap_linker else None,
+            'boot_ldflags': self.build_conf.get_boot_ldflags(),
+        }
+
+    def get_prebuilt_prerequisites_prefix(self) -> str:
+        """
+        Returns the host-wide prefix of prebuilt prerequisite libraries matching the versions
+        required by the GCC source code, building it first if necessary.
+        """
+        gcc_clone_dir = self.build_conf.get_gcc_clone_dir()
+        versions = get_prerequisite_versions(gcc_clone_dir)
+        host_facts = get_host_facts()
+        prefix_dir = get_prerequisites_prefix_dir(
+            self.build_conf.install_parent_dir, versions, host_facts.short_os_name_and_version,
+            self.build_conf.target_arch)
+        # Hold a shared lock on the prefix while it is in use, and an exclusive lock while building
+        # it, so that concurrent builds needing the same prefix only build it once.
+        prefix_lock = get_path_lock(self.build_conf.install_parent_dir, prefix_dir)
+        prefix_lock.acquire(shared=True)
+        self.held_locks.append(prefix_lock)
+        if os.path.isdir(prefix_dir):
+            logging.info("Using prebuilt GCC prerequisites from %s", prefix_dir)
+        else:
+            prefix_lock.acquire(shared=False)
+            if not os.path.isdir(prefix_dir):
+                compiler_facts = get_compiler_facts()
+                build_prerequisites_prefix(
+                    gcc_src_dir=gcc_clone_dir,
+                    prefix_dir=prefix_dir,
+                    parallelism=self.build_conf.get_parallelism(),
+                    cmd_prefix=get_arch_switch_cmd_prefix(self.build_conf.target_arch),
+                    c_compiler=compiler_facts.c_compiler,
+                    cxx_compiler=compiler_facts.cxx_compiler)
+            prefix_lock.acquire(shared=True)
+        self.build_info['prerequisites_prefix'] = prefix_dir
+        return prefix_dir
+
     def do_build(self) -> None:
-        parent_dir_for_gcc_version = self.build_conf.get_gcc_build_parent_dir()
-        build_dir = os.path.join(parent_dir_for_gcc_version, 'build')
-        install_prefix = self.build_conf.get_final_install_dir()
+        build_dir = self.build_conf.get_gcc_build_dir()
 
         if os.path.exists(build_dir) and self.build_conf.clean_build:
             logging.info("Deleting directory: %s", build_dir)
             rm_rf(build_dir)
 
-        c_compiler, cxx_compiler = find_latest_gcc()
-        parallelism = self.build_conf.parallelism
-        if parallelism is None:
-            parallelism = os.cpu_count()
+        compiler_facts = get_compiler_facts()
+        self.check_linkers(compiler_facts.c_compiler)
 
-        with ChangeDir(self.build_conf.get_gcc_clone_dir()):
+        # Commands are run with an explicit working directory rather than changing the current
+        # directory, because other pipeline tasks are running concurrently in this process.
+        prerequisites_prefix: Optional[str] = None
+        if self.args.use_prebuilt_prerequisites:
+            prerequisites_prefix = self.get_prebuilt_prerequisites_prefix()
+        else:
             logging.info("Running download_prerequisites")
             run_cmd(get_arch_switch_cmd_prefix(self.build_conf.target_arch) + [
                 os.path.join('contrib', 'download_prerequisites')
-            ])
+            ], cwd=self.build_conf.get_gcc_clone_dir())
+
+        configure_args = self.build_conf.get_configure_args(
+            compiler_facts.c_compiler, compiler_facts.cxx_compiler, prerequisites_prefix)
+
+        stage1_cache: Optional[Stage1Cache] = None
+        stage1_cache_key_inputs: Dict[str, Any] = {}
+        stage1_cache_key = ''
+        seeded_from_stage1_cache = False
+        # The directories of this build that the stage1 snapshot may refer to by absolute path.
+        stage1_cache_location_paths = [
+            self.build_conf.get_gcc_build_parent_dir(),
+            self.build_conf.get_install_prefix(),
+        ]
+        if self.args.use_stage1_cache:
+            if os.path.exists(build_dir):
+                logging.info("Not using the stage1 cache because %s already exists", build_dir)
+            else:
+                stage1_cache = Stage1Cache(
+                    os.path.join(
+                        self.build_conf.install_parent_dir, SHARED_CACHE_DIR_NAME, 'stage1'),
+                    int(self.args.stage1_cache_max_size_gb * 1024 ** 3),
+                    self.build_conf.install_parent_dir)
+                gcc_clone_dir = self.build_conf.get_gcc_clone_dir()
+                set_source_mtimes(gcc_clone_dir, get_current_git_commit_timestamp(gcc_clone_dir))
+                stage1_cache_key_inputs = {
+                    'git_sha1': get_current_git_sha1(gcc_clone_dir),
+                    'patch_series': (
+                        self.build_conf.patch_series.get_hash()
+                        if self.build_conf.patch_series is not None else None),
+                    'compilers': compiler_facts.to_dict(),
+                    'configure_args': get_configure_args_without_prefix(configure_args),
+                    'target_arch': self.build_conf.target_arch,
+                    'host': get_host_facts().to_dict(),
+                }
+                stage1_cache_key = compute_stage1_cache_key(stage1_cache_key_inputs)
+                seeded_from_stage1_cache = stage1_cache.seed_build_dir(
+                    stage1_cache_key, build_dir, stage1_cache_location_paths)
+                self.build_info['stage1_cache'] = {
+                    'key': stage1_cache_key,
+                    'hit': seeded_from_stage1_cache,
+                }
+
+        distributed_compile: Optional[DistributedCompileConfig] = None
+        if self.args.distributed_compile_hosts:
+            if seeded_from_stage1_cache:
+                logging.info("Not distributing compile jobs, stage1 is seeded from the cache")
+            elif compiler_facts.c_compiler is None or compiler_facts.cxx_compiler is None:
+                logging.warning("Not distributing compile jobs, the host compilers are unknown")
+            else:
+                distributed_compile = setup_distributed_compile(
+                    os.path.join(
+                        self.build_conf.get_gcc_build_parent_dir(), 'distributed_compile'),
+                    self.build_conf.install_parent_dir,
+                    self.args.distributed_compile_hosts,
+                    self.args.distributed_compile_transport,
+                    local_jobs=self.build_conf.get_parallelism(),
+                    c_compiler=compiler_facts.c_compiler,
+                    cxx_compiler=compiler_facts.cxx_compiler)
+
+        cmd_prefix = get_arch_switch_cmd_prefix(self.build_conf.target_arch)
+        autoconf_cache: Optional[AutoconfCache] = None
+        autoconf_cache_private_dir = os.path.join(
+            self.build_conf.get_gcc_build_parent_dir(), 'autoconf_cache')
+        if self.args.use_autoconf_cache:
+            autoconf_cache = AutoconfCache(
+                os.path.join(
+                    self.build_conf.install_parent_dir, SHARED_CACHE_DIR_NAME, 'autoconf'),
+                self.build_conf.install_parent_dir,
+                {
+                    'gcc_version': self.build_conf.version,
+                    'compilers': compiler_facts.to_dict(),
+                    'compiler_fingerprint': compiler_facts.get_fingerprint(),
+                    'configure_args': get_configure_args_without_prefix(configure_args),
+                    'target_arch': self.build_conf.target_arch,
+                    'host': get_host_facts().to_dict(),
+                })
+            config_site_path = autoconf_cache.prepare(
+                autoconf_cache_private_dir, build_dir,
+                [compiler_facts.c_compiler or 'gcc'] + (
+                    [distributed_compile.get_c_wrapper_path()] if distributed_compile else []))
+            # Passed as a command prefix rather than through os.environ, because other pipeline
+            # tasks are running concurrently in this process.
+            cmd_prefix = ['env', 'CONFIG_SITE=%s' % config_site_path] + cmd_prefix
 
         mkdir_p(build_dir)
-        with ChangeDir(build_dir):
-            configure_args = [
-                f'--prefix={install_prefix}',
-                '--disable-multilib',
-                '--disable-nls',
-                '--enable-languages=c,c++,lto',
-                '--enable-lto',
-                '--with-build-config=bootstrap-O3 bootstrap-lto',
-                f'CC={c_compiler}',
-                f'CXX={cxx_compiler}',
-            ]
+        recent_builds = self.get_recent_builds_of_same_config()
+        progress_tracker = BuildProgressTracker(recent_builds[0] if recent_builds else None)
+        configure_check_stats = ConfigureCheckStats()
 
+        def handle_output_line(line: str) -> None:
+            progress_tracker.handle_output_line(line)
+            configure_check_stats.handle_output_line(line)
+
+        success = False
+        try:
             logging.info("Running configure")
-            run_cmd(get_arch_switch_cmd_prefix(self.build_conf.target_arch) + [
-                os.path.join(self.build_conf.get_gcc_clone_dir(), 'configure')
-            ] + configure_args)
+            run_cmd_with_output_handler(
+                cmd_prefix +
+                self.build_conf.get_configure_cmd_line(
+                    compiler_facts.c_compiler, compiler_facts.cxx_compiler, prerequisites_prefix),
+                handle_output_line,
+                cwd=build_dir)
+
+            if distributed_compile is not None:
+                # Only stage1 is built with the host compiler. The later stages are built by the
+                # full build below with the usual parallelism.
+                logging.info("Building stage1 with compile jobs distributed to %s",
+                             ', '.join(host.name for host in distributed_compile.hosts))
+                run_cmd_with_output_handler(
+                    cmd_prefix +
+                    self.build_conf.get_make_build_args(
+                        'stage1-bubble',
+                        parallelism=distributed_compile.get_num_jobs(),
+                        make_vars=distributed_compile.get_make_vars()),
+                    handle_output_line,
+                    cwd=build_dir)
+            if stage1_cache is not None and not seeded_from_stage1_cache:
+                logging.info("Building stage1 to store it in the stage1 cache")
+                run_cmd_with_output_handler(
+                    cmd_prefix +
+                    self.build_conf.get_make_build_args('stage1-bubble'),
+                    handle_output_line,
+                    cwd=build_dir)
+                stage1_cache.store(
+                    stage1_cache_key, build_dir, stage1_cache_key_inputs,
+                    stage1_cache_location_paths)
 
             logging.info("Building GCC")
-            run_cmd(get_arch_switch_cmd_prefix(self.build_conf.target_arch) + [
-                'make', '-j', str(parallelism), 'profiledbootstrap'
-            ])
+            run_cmd_with_output_handler(
+                cmd_prefix +
+                self.build_conf.get_make_build_args(),
+                handle_output_line,
+                cwd=build_dir)
 
             logging.info("Installing GCC")
-            run_cmd(get_arch_switch_cmd_prefix(self.build_conf.target_arch) + [
-                'make', 'install'
-            ])
-
-            validate_build_output_arch(self.build_conf.target_arch, install_prefix)
+            progress_tracker.set_stage('install')
+            self.install(cmd_prefix, handle_output_line)
+            success = True
+        finally:
+            if stage1_cache is not None:
+                stage1_cache.release_entry_lock(stage1_cache_key)
+            if distributed_compile is not None:
+                self.build_info['distributed_compile'] = distributed_compile.get_stats()
+                logging.info("Distributed compile jobs per host: %s",
+                             self.build_info['distributed_compile']['jobs_per_host'])
+            if autoconf_cache is not None:
+                if success:
+                    autoconf_cache.merge_back(autoconf_cache_private_dir, [
+                        self.build_conf.get_gcc_build_parent_dir(),
+                        self.build_conf.get_install_prefix(),
+                    ])
+                self.build_info['autoconf_cache'] = dict(
+                    configure_check_stats.to_dict(), key=autoconf_cache.key)
+                logging.info(
+                    "Autoconf cache: %d of %d configure checks cached, saving an estimated %.1f "
+                    "seconds", configure_check_stats.num_cached_checks,
+                    configure_check_stats.num_cached_checks +
+                    configure_check_stats.num_uncached_checks,
+                    configure_check_stats.get_estimated_time_saved_sec())
+            progress_tracker.report_progress()
+            disk_usage_bytes = get_disk_usage_bytes([
+                self.build_conf.get_gcc_build_parent_dir(),
+                self.build_conf.get_final_install_dir(),
+            ]) if success else None
+            self.get_build_history().add_build(progress_tracker.create_build_record(
+                gcc_version=self.build_conf.version,
+                profile=self.build_conf.get_build_profile(),
+                target_arch=self.build_conf.target_arch,
+                parallelism=self.build_conf.get_parallelism(),
+                disk_usage_bytes=disk_usage_bytes,
+                success=success))
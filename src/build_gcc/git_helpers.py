@@ -2,10 +2,14 @@ import os
 import subprocess
 import pathlib
 import logging
+import shlex
 import sys
 
+from build_gcc.constants import GCC_CLONE_REL_PATH, GIT_SHA1_PLACEHOLDER_STR
 from build_gcc.helpers import run_cmd, ChangeDir
-from typing import Optional
+from build_gcc.patch_series import is_patched_checkout
+from build_gcc.tree_copy import copy_tree, TreeCopyResult
+from typing import List, Optional
 
 
 CLONE_DEPTH = 10
@@ -15,10 +19,14 @@ def git_clone_tag(
         repo_url: str,
         tag: str,
         dest_path: str,
-        save_git_log_to: Optional[str] = None) -> None:
+        save_git_log_to: Optional[str] = None) -> Optional[TreeCopyResult]:
+    """
+    Clones the given tag into dest_path. Returns the result of copying the directory tree if
+    repo_url is a local shallow checkout that had to be copied instead of cloned.
+    """
     dest_path = os.path.abspath(dest_path)
     if os.path.exists(dest_path):
-        return
+        return None
     cmd_line = ['git', 'clone', repo_url, '--branch', tag, '--depth', str(CLONE_DEPTH), dest_path]
     p = subprocess.Popen(
         cmd_line,
@@ -28,13 +36,12 @@ def git_clone_tag(
     sys.stdout.write(stdout.decode('utf-8') + '\n')
     sys.stderr.write(stderr.decode('utf-8') + '\n')
     if p.returncode == 0:
-        return
+        return None
     if (b'attempt to fetch/clone from a shallow repository' in stderr and
             repo_url.startswith('/') and
             os.path.isdir(repo_url)):
         logging.info("git does not support cloning from a shallow repository, just copying")
-        subprocess.check_call(['cp', '-R', repo_url, dest_path])
-        return
+        return copy_tree(repo_url, dest_path)
 
     raise IOError("git command %s exited with code %d" % (cmd_line, p.returncode))
 
@@ -46,6 +53,13 @@ def get_current_git_sha1(repo_path: str) -> str:
     ).strip().decode('utf-8')
 
 
+def get_current_git_commit_timestamp(repo_path: str) -> int:
+    return int(subprocess.check_output(
+        ['git', 'log', '-1', '--format=%ct'],
+        cwd=repo_path
+    ).strip().decode('utf-8'))
+
+
 def save_git_log_to_file(git_repo_dir: str, dest_file_path: str) -> None:
     dest_file_path = os.path.abspath(dest_file_path)
 
@@ -56,3 +70,57 @@ def save_git_log_to_file(git_repo_dir: str, dest_file_path: str) -> None:
     ], cwd=git_repo_dir).decode('utf-8')
     with open(dest_file_path, 'w') as git_log_output_file:
         git_log_output_file.write(git_log_output)
+
+
+def find_gcc_source_checkouts(install_parent_dir: str) -> List[str]:
+    """
+    Returns the GCC source checkouts in the build directories under install_parent_dir, except
+    for those in directories with the git SHA1 placeholder in their name. Those are being written
+    by another build, or were left behind by a build that failed before renaming them. Checkouts
+    with local patches applied are skipped too.
+    """
+    if not os.path.isdir(install_parent_dir):
+        return []
+    find_cmd = [
+        'find', install_parent_dir, '-mindepth', '3', '-maxdepth', '3',
+        '-wholename', os.path.join('*', GCC_CLONE_REL_PATH)
+    ]
+    logging.info("Searching for existing GCC source directories using command: %s",
+                 ' '.join([shlex.quote(item) for item in find_cmd]))
+    src_dirs = []
+    for src_dir in subprocess.check_output(find_cmd).decode('utf-8').split('\n'):
+        src_dir = src_dir.strip()
+        if not src_dir:
+            continue
+        if GIT_SHA1_PLACEHOLDER_STR in src_dir:
+            logging.info("Skipping incomplete checkout %s", src_dir)
+            continue
+        if is_patched_checkout(src_dir):
+            logging.info("Skipping patched checkout %s", src_dir)
+            continue
+        src_dirs.append(src_dir)
+    return src_dirs
+
+
+def get_tags_at_head(repo_path: str) -> List[str]:
+    """
+    Returns the names of the tags pointing to the current commit of the given repository, or an
+    empty list if it is not a valid repository.
+    """
+    # GitPython is slow to import, and is only needed here.
+    import git
+
+    try:
+        repo = git.Repo(repo_path)
+        head_sha1 = repo.head.commit.hexsha
+    except (git.exc.InvalidGitRepositoryError, git.exc.NoSuchPathError, ValueError) as ex:
+        logging.warning("Skipping invalid checkout %s: %s", repo_path, ex)
+        return []
+    # From https://stackoverflow.com/questions/34932306/get-tags-of-a-commit
+    # Also relevant:
+    # https://stackoverflow.com/questions/32523121/gitpython-get-current-tag-detached-head
+    tag_names = [tag.name for tag in repo.tags if repo.commit(tag).hexsha == head_sha1]
+    for tag_name in tag_names:
+        logging.info("Found tag %s in %s matching the head SHA1 %s",
+                     tag_name, repo_path, head_sha1)
+    return tag_names
@@ -3,14 +3,15 @@ import logging
 import os
 import pathlib
 import hashlib
+import mmap
 import time
 import shlex
 import stat
 import platform
+import tempfile
+import sys
 
-from sys_detection import is_macos
-
-from typing import List, Any, Dict, Optional, Union
+from typing import Callable, List, Any, Dict, Optional, Union
 from datetime import datetime
 
 
@@ -18,7 +19,11 @@ BUILD_GCC_SCRIPTS_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.dirname(
     os.path.abspath(__file__))))
 
 
-def _validate_build_gcc_scripts_root_path() -> None:
+# Environment variable that overrides the directory for small per-user caches, e.g. host facts.
+CACHE_DIR_ENV_VAR_NAME = 'YB_BUILD_GCC_CACHE_DIR'
+
+
+def validate_build_gcc_scripts_root_path() -> None:
     for sub_dir in [
         'bin',
         'src',
@@ -47,6 +52,33 @@ def run_cmd(args: List[Any], cwd: Optional[str] = None) -> None:
     subprocess.check_call(args, cwd=effective_directory)
 
 
+def run_cmd_with_output_handler(
+        args: List[Any],
+        line_handler: Callable[[str], None],
+        cwd: Optional[str] = None) -> None:
+    """
+    Like run_cmd, but also passes every line of the combined stdout and stderr of the command to
+    the given handler. The output is still written to our stdout.
+    """
+    args = [normalize_cmd_arg(arg) for arg in args]
+    effective_directory = cwd or os.getcwd()
+    logging.info(
+        "Running command: %s (in directory: %s)",
+        ' '.join([shlex.quote(arg) for arg in args]),
+        effective_directory)
+    process = subprocess.Popen(
+        args, cwd=effective_directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    assert process.stdout is not None
+    for line_bytes in iter(process.stdout.readline, b''):
+        sys.stdout.buffer.write(line_bytes)
+        sys.stdout.flush()
+        line_handler(line_bytes.decode('utf-8', errors='replace').rstrip('\n'))
+    process.stdout.close()
+    return_code = process.wait()
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, args)
+
+
 # from https://stackoverflow.com/questions/431684/how-do-i-change-the-working-directory-in-python
 class ChangeDir:
     saved_path: str
@@ -75,14 +107,54 @@ def rm_rf(dir_path: str) -> None:
         subprocess.check_call(['rm', '-rf', dir_path])
 
 
-_validate_build_gcc_scripts_root_path()
+def get_disk_usage_bytes(dir_paths: List[str]) -> int:
+    existing_paths = [dir_path for dir_path in dir_paths if os.path.exists(dir_path)]
+    if not existing_paths:
+        return 0
+    du_output = subprocess.check_output(['du', '-sk'] + existing_paths).decode('utf-8')
+    return sum(int(line.split()[0]) * 1024 for line in du_output.strip().split('\n') if line)
+
+
+def get_cache_dir() -> str:
+    return os.environ.get(CACHE_DIR_ENV_VAR_NAME) or os.path.expanduser(
+        os.path.join('~', '.cache', 'yb-build-gcc'))
+
+
+def write_file_atomically(file_path: str, content: str) -> None:
+    """
+    Writes the given content to a temporary file in the same directory and renames it into place,
+    so that concurrent readers never observe a partially written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(file_path)),
+        prefix='.' + os.path.basename(file_path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as output_file:
+            output_file.write(content)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Files at least this large are hashed through a memory mapping rather than chunked reads.
+MMAP_CHECKSUM_MIN_SIZE_BYTES = 1024 * 1024
 
 
 def compute_sha256_checksum(file_path: str) -> str:
+    """
+    hashlib releases the GIL while hashing large buffers, so this can be called from multiple
+    threads to hash files in parallel.
+    """
     sha256_hash = hashlib.sha256()
     with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(65536), b""):
-            sha256_hash.update(byte_block)
+        if os.fstat(f.fileno()).st_size >= MMAP_CHECKSUM_MIN_SIZE_BYTES:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                sha256_hash.update(mapped_file)
+        else:
+            for byte_block in iter(lambda: f.read(65536), b""):
+                sha256_hash.update(byte_block)
     return sha256_hash.hexdigest()
 
 
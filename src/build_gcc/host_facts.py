@@ -0,0 +1,269 @@
+"""
+Facts about the local host (operating system, architecture, compilers) that are expensive enough
+to detect that we cache them on disk between runs. Every cached entry carries a fingerprint of the
+inputs it was computed from, and is recomputed as soon as that fingerprint changes.
+"""
+
+import json
+import logging
+import os
+import platform
+import subprocess
+import threading
+
+from typing import Any, Dict, List, Optional
+
+from build_gcc.helpers import get_cache_dir, mkdir_p, str_md5, write_file_atomically
+
+
+HOST_FACTS_FORMAT_VERSION = 2
+HOST_FACTS_FILE_NAME = 'host_facts.json'
+
+# Files whose modification time and size change when the operating system is upgraded.
+OS_RELEASE_FILE_PATHS = [
+    '/etc/os-release',
+    '/etc/system-release',
+    '/etc/redhat-release',
+    '/System/Library/CoreServices/SystemVersion.plist',
+]
+
+
+def is_linux() -> bool:
+    return platform.system() == 'Linux'
+
+
+def is_macos() -> bool:
+    return platform.system() == 'Darwin'
+
+
+def get_file_fingerprint(file_path: Optional[str]) -> Optional[List[int]]:
+    if file_path is None:
+        return None
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return None
+    return [file_stat.st_mtime_ns, file_stat.st_size]
+
+
+def get_candidate_compiler_dirs() -> List[str]:
+    """
+    The directories the host compilers are looked up in: the PATH, and /usr/bin for the versioned
+    compilers on Amazon Linux 2 (see devtoolset.find_latest_gcc).
+    """
+    dir_paths = [
+        dir_path for dir_path in os.environ.get('PATH', '').split(os.pathsep) if dir_path
+    ]
+    if '/usr/bin' not in dir_paths:
+        dir_paths.append('/usr/bin')
+    return dir_paths
+
+
+def get_compiler_dirs_fingerprint() -> Dict[str, Optional[int]]:
+    """
+    Modification times of the candidate compiler directories. These change when a compiler is
+    installed into or removed from one of them, which may change the compilers we would pick.
+    """
+    fingerprint: Dict[str, Optional[int]] = {}
+    for dir_path in get_candidate_compiler_dirs():
+        try:
+            fingerprint[dir_path] = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            fingerprint[dir_path] = None
+    return fingerprint
+
+
+def get_os_fingerprint() -> Dict[str, Any]:
+    uname = os.uname()
+    return {
+        'format_version': HOST_FACTS_FORMAT_VERSION,
+        'sysname': uname.sysname,
+        'nodename': uname.nodename,
+        'release': uname.release,
+        'machine': uname.machine,
+        'files': {
+            file_path: get_file_fingerprint(file_path) for file_path in OS_RELEASE_FILE_PATHS
+        },
+    }
+
+
+class HostFacts:
+    system: str
+    short_os_name_and_version: str
+    architecture: str
+
+    def __init__(self, system: str, short_os_name_and_version: str, architecture: str) -> None:
+        self.system = system
+        self.short_os_name_and_version = short_os_name_and_version
+        self.architecture = architecture
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'system': self.system,
+            'short_os_name_and_version': self.short_os_name_and_version,
+            'architecture': self.architecture,
+        }
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> 'HostFacts':
+        return HostFacts(
+            system=d['system'],
+            short_os_name_and_version=d['short_os_name_and_version'],
+            architecture=d['architecture'])
+
+
+class CompilerFacts:
+    c_compiler: Optional[str]
+    cxx_compiler: Optional[str]
+    c_compiler_version: Optional[str]
+    cxx_compiler_version: Optional[str]
+
+    def __init__(
+            self,
+            c_compiler: Optional[str],
+            cxx_compiler: Optional[str],
+            c_compiler_version: Optional[str],
+            cxx_compiler_version: Optional[str]) -> None:
+        self.c_compiler = c_compiler
+        self.cxx_compiler = cxx_compiler
+        self.c_compiler_version = c_compiler_version
+        self.cxx_compiler_version = cxx_compiler_version
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'c_compiler': self.c_compiler,
+            'cxx_compiler': self.cxx_compiler,
+            'c_compiler_version': self.c_compiler_version,
+            'cxx_compiler_version': self.cxx_compiler_version,
+        }
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> 'CompilerFacts':
+        return CompilerFacts(
+            c_compiler=d['c_compiler'],
+            cxx_compiler=d['cxx_compiler'],
+            c_compiler_version=d['c_compiler_version'],
+            cxx_compiler_version=d['cxx_compiler_version'])
+
+    def get_fingerprint(self) -> Dict[str, Any]:
+        return {
+            'c_compiler': get_file_fingerprint(self.c_compiler),
+            'cxx_compiler': get_file_fingerprint(self.cxx_compiler),
+        }
+
+    def get_cache_fingerprint(self) -> Dict[str, Any]:
+        """
+        The fingerprint of the compiler binaries, plus that of the directories they were picked
+        from, so that a newly installed compiler is detected too.
+        """
+        return dict(self.get_fingerprint(), compiler_dirs=get_compiler_dirs_fingerprint())
+
+
+def get_compiler_version(compiler_path: Optional[str]) -> Optional[str]:
+    if compiler_path is None:
+        return None
+    version_output = subprocess.check_output([compiler_path, '--version']).decode('utf-8')
+    return version_output.strip().split('\n')[0].strip()
+
+
+def collect_host_facts() -> HostFacts:
+    import sys_detection
+    sys_conf = sys_detection.local_sys_conf()
+    return HostFacts(
+        system=platform.system(),
+        short_os_name_and_version=sys_conf.short_os_name_and_version(),
+        architecture=sys_conf.architecture)
+
+
+def collect_compiler_facts() -> CompilerFacts:
+    from build_gcc.devtoolset import find_latest_gcc
+    c_compiler, cxx_compiler = find_latest_gcc()
+    return CompilerFacts(
+        c_compiler=c_compiler,
+        cxx_compiler=cxx_compiler,
+        c_compiler_version=get_compiler_version(c_compiler),
+        cxx_compiler_version=get_compiler_version(cxx_compiler))
+
+
+class HostFactsCache:
+    """
+    The on-disk cache of host facts. OS facts are stored once per host and are invalidated by the
+    OS fingerprint. Compiler facts depend on PATH (e.g. after a devtoolset is activated), so they
+    are stored per PATH and are additionally invalidated when a compiler binary or one of the
+    directories compilers are looked up in changes.
+
+    Pipeline tasks running concurrently in this process look up facts through the same cache, so
+    lookups are serialized with a lock.
+    """
+    file_path: str
+    data: Dict[str, Any]
+    lock: threading.RLock
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.data = {}
+        self.lock = threading.RLock()
+        if os.path.exists(file_path):
+            try:
+                with open(file_path) as input_file:
+                    self.data = json.load(input_file)
+            except (OSError, ValueError) as ex:
+                logging.warning("Ignoring unreadable host facts cache %s: %s", file_path, ex)
+        if self.data.get('os_fingerprint') != get_os_fingerprint():
+            self.data = {}
+
+    def save(self) -> None:
+        self.data['os_fingerprint'] = get_os_fingerprint()
+        mkdir_p(os.path.dirname(self.file_path))
+        write_file_atomically(
+            self.file_path, json.dumps(self.data, indent=2, sort_keys=True) + '\n')
+
+    def get_host_facts(self) -> HostFacts:
+        with self.lock:
+            host_facts_dict = self.data.get('host_facts')
+            if host_facts_dict is not None:
+                return HostFacts.from_dict(host_facts_dict)
+            host_facts = collect_host_facts()
+            self.data['host_facts'] = host_facts.to_dict()
+            self.save()
+            return host_facts
+
+    def get_compiler_facts(self) -> CompilerFacts:
+        # The lock is reentrant, because collecting compiler facts looks up the host facts.
+        with self.lock:
+            path_key = str_md5(os.environ.get('PATH', ''))
+            entries = self.data.setdefault('compiler_facts', {})
+            entry = entries.get(path_key)
+            if entry is not None:
+                compiler_facts = CompilerFacts.from_dict(entry['facts'])
+                if compiler_facts.get_cache_fingerprint() == entry['fingerprint']:
+                    return compiler_facts
+                logging.info("Host compilers may have changed, re-detecting them")
+            compiler_facts = collect_compiler_facts()
+            entries[path_key] = {
+                'facts': compiler_facts.to_dict(),
+                'fingerprint': compiler_facts.get_cache_fingerprint(),
+            }
+            self.save()
+            return compiler_facts
+
+
+_host_facts_cache: Optional[HostFactsCache] = None
+_host_facts_cache_lock = threading.Lock()
+
+
+def get_host_facts_cache() -> HostFactsCache:
+    global _host_facts_cache
+    with _host_facts_cache_lock:
+        if _host_facts_cache is None:
+            _host_facts_cache = HostFactsCache(
+                os.path.join(get_cache_dir(), HOST_FACTS_FILE_NAME))
+        return _host_facts_cache
+
+
+def get_host_facts() -> HostFacts:
+    return get_host_facts_cache().get_host_facts()
+
+
+def get_compiler_facts() -> CompilerFacts:
+    return get_host_facts_cache().get_compiler_facts()
@@ -0,0 +1,312 @@
+"""
+Installs GCC into a staging directory with a parallel make install using DESTDIR, and moves the
+staged tree into the final installation directory only after the install and the post-processing
+of the installed files have succeeded, so a failed install never leaves a half-populated
+installation directory behind.
+
+The installed files are post-processed while make install is still running: a background thread
+polls the staging directory, and hands each file whose size and modification time have not changed
+since the previous poll to a thread pool that strips it (optionally), validates its architecture
+(on macOS) and computes its SHA-256 checksum. After make install finishes, files that were not
+processed yet or changed after being processed are handled, and identical files can optionally be
+replaced with hard links. The checksums are reused for the manifest of the installation directory.
+
+If GCC was configured with a prefix other than the final installation directory (an existing build
+directory rebuilt with a different patch series), the prefix is replaced with the final
+installation directory in the installed text files and symlinks, e.g. libtool archives, while they
+are post-processed. Binaries keep the configured prefix: the GCC driver finds its components
+relative to its own location, so the installed tree works from the final installation directory.
+"""
+
+import concurrent.futures
+import logging
+import os
+import subprocess
+import threading
+import time
+
+from typing import Dict, List, Optional, Set, Tuple
+
+from build_gcc.architecture import check_file_arch, is_arch_validation_candidate
+from build_gcc.constants import GCC_BUILD_INFO_DIR_NAME
+from build_gcc.helpers import compute_sha256_checksum, mkdir_p, rm_rf, str_md5
+from build_gcc.host_facts import is_macos
+from build_gcc.path_rewriting import PathRewriter
+
+
+POLL_INTERVAL_SEC = 1.0
+
+# Directories of the installed tree with the host executables that are stripped, if requested.
+STRIPPED_DIR_NAMES = ('bin', 'libexec')
+
+ELF_MAGIC = b'\x7fELF'
+
+# The size and the modification time in nanoseconds of a file, used to detect changes.
+FileStat = Tuple[int, int]
+
+# The size, the modification time in seconds and the SHA-256 checksum of a file, as used in the
+# manifest.
+FileChecksum = Tuple[int, int, str]
+
+
+def get_staged_install_dir(staging_dir: str, final_install_dir: str) -> str:
+    """
+    The directory inside the DESTDIR staging directory that make install populates.
+
+    >>> get_staged_install_dir('/opt/b/install_staging', '/opt/yb-gcc-v12')
+    '/opt/b/install_staging/opt/yb-gcc-v12'
+    """
+    return os.path.join(staging_dir, os.path.abspath(final_install_dir).lstrip(os.sep))
+
+
+def is_strippable(rel_path: str, path: str) -> bool:
+    if rel_path.split(os.sep)[0] not in STRIPPED_DIR_NAMES or os.stat(path).st_mode & 0o111 == 0:
+        return False
+    with open(path, 'rb') as input_file:
+        return input_file.read(len(ELF_MAGIC)) == ELF_MAGIC
+
+
+class InstallPostProcessor:
+    staged_install_dir: str
+    target_arch: str
+    strip: bool
+    dedup: bool
+    # Replaces the configured prefix with the final installation directory, if they differ.
+    path_rewriter: Optional[PathRewriter]
+
+    executor: concurrent.futures.ThreadPoolExecutor
+    # Guards the stats, checksums and counters below, which are updated by the worker threads, the
+    # polling thread and finish.
+    lock: threading.Lock
+    install_finished: threading.Event
+    poll_thread: Optional[threading.Thread]
+
+    # The stat of each file when it was last seen by the polling thread.
+    last_seen_stats: Dict[str, FileStat]
+    # The stat of each file when it was submitted for processing, and after it was processed.
+    submitted_stats: Dict[str, FileStat]
+    processed_stats: Dict[str, FileStat]
+
+    futures: List[concurrent.futures.Future]
+    checksums: Dict[str, FileChecksum]
+    arch_errors: Set[str]
+    num_stripped_files: int
+    num_relocated_files: int
+    num_files_processed_during_install: int
+
+    def __init__(
+            self,
+            staged_install_dir: str,
+            target_arch: str,
+            strip: bool,
+            dedup: bool,
+            num_threads: int,
+            path_rewriter: Optional[PathRewriter] = None) -> None:
+        self.staged_install_dir = staged_install_dir
+        self.target_arch = target_arch
+        self.strip = strip
+        self.dedup = dedup
+        self.path_rewriter = path_rewriter
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_threads)
+        self.lock = threading.Lock()
+        self.install_finished = threading.Event()
+        self.poll_thread = None
+        self.last_seen_stats = {}
+        self.submitted_stats = {}
+        self.processed_stats = {}
+        self.futures = []
+        self.checksums = {}
+        self.arch_errors = set()
+        self.num_stripped_files = 0
+        self.num_relocated_files = 0
+        self.num_files_processed_during_install = 0
+
+    def start(self) -> None:
+        self.poll_thread = threading.Thread(target=self.poll_while_installing, daemon=True)
+        self.poll_thread.start()
+
+    def list_files(self) -> Dict[str, FileStat]:
+        file_stats: Dict[str, FileStat] = {}
+        for root, _, file_names in os.walk(self.staged_install_dir):
+            for file_name in file_names:
+                path = os.path.join(root, file_name)
+                try:
+                    st = os.lstat(path)
+                except FileNotFoundError:
+                    # Replaced by make install in the meantime.
+                    continue
+                if not os.path.islink(path):
+                    file_stats[os.path.relpath(path, self.staged_install_dir)] = (
+                        st.st_size, st.st_mtime_ns)
+        return file_stats
+
+    def submit(self, rel_path: str, file_stat: FileStat) -> None:
+        with self.lock:
+            self.submitted_stats[rel_path] = file_stat
+        self.futures.append(self.executor.submit(self.process_file, rel_path))
+
+    def get_processed_stats_snapshot(self) -> Dict[str, FileStat]:
+        with self.lock:
+            return dict(self.processed_stats)
+
+    def poll_while_installing(self) -> None:
+        while not self.install_finished.wait(POLL_INTERVAL_SEC):
+            # Files processed after the snapshot was taken are also in submitted_stats with the
+            # same stat, so they are not submitted again. Only this thread submits files while
+            # installing, so submitted_stats can be read without the lock.
+            processed_stats = self.get_processed_stats_snapshot()
+            for rel_path, file_stat in self.list_files().items():
+                if (self.submitted_stats.get(rel_path) != file_stat and
+                        processed_stats.get(rel_path) != file_stat and
+                        self.last_seen_stats.get(rel_path) == file_stat):
+                    # Not modified since the previous poll, so probably completely installed.
+                    self.submit(rel_path, file_stat)
+                    self.num_files_processed_during_install += 1
+                self.last_seen_stats[rel_path] = file_stat
+
+    def process_file(self, rel_path: str) -> None:
+        try:
+            self.process_file_unchecked(rel_path)
+        except (OSError, subprocess.CalledProcessError) as ex:
+            if self.install_finished.is_set():
+                raise
+            # E.g. the file was replaced while it was being processed. It is processed again
+            # after make install finishes.
+            logging.info("Failed to process %s while installing: %s", rel_path, ex)
+
+    def process_file_unchecked(self, rel_path: str) -> None:
+        path = os.path.join(self.staged_install_dir, rel_path)
+        if self.strip and is_strippable(rel_path, path):
+            subprocess.check_call(['strip', path])
+            with self.lock:
+                self.num_stripped_files += 1
+        if is_macos() and is_arch_validation_candidate(path):
+            is_valid, _ = check_file_arch(self.target_arch, path)
+            with self.lock:
+                if is_valid is False:
+                    self.arch_errors.add(rel_path)
+                else:
+                    self.arch_errors.discard(rel_path)
+        if self.path_rewriter is not None and self.path_rewriter.rewrite_file(path):
+            with self.lock:
+                self.num_relocated_files += 1
+        st = os.lstat(path)
+        sha256 = compute_sha256_checksum(path)
+        with self.lock:
+            self.processed_stats[rel_path] = (st.st_size, st.st_mtime_ns)
+            self.checksums[rel_path] = (st.st_size, int(st.st_mtime), sha256)
+
+    def wait_for_futures(self) -> None:
+        futures = self.futures
+        self.futures = []
+        for future in futures:
+            future.result()
+
+    def finish(self) -> Dict[str, FileChecksum]:
+        """
+        Processes the files that have not been processed while installing, and returns the
+        checksums of all files, keyed by the relative path. Must be called after make install
+        has succeeded.
+        """
+        self.install_finished.set()
+        if self.poll_thread is not None:
+            self.poll_thread.join()
+        # Files may change while they are processed, so check them again afterwards.
+        self.wait_for_futures()
+        processed_stats = self.get_processed_stats_snapshot()
+        for rel_path, file_stat in self.list_files().items():
+            if processed_stats.get(rel_path) != file_stat:
+                self.submit(rel_path, file_stat)
+        self.wait_for_futures()
+        self.executor.shutdown()
+        if self.path_rewriter is not None:
+            self.relocate_symlinks(self.path_rewriter)
+
+        if self.arch_errors:
+            raise ValueError(
+                "Found %d files with the wrong architecture in %s (target architecture: %s): %s" %
+                (len(self.arch_errors), self.staged_install_dir, self.target_arch,
+                 sorted(self.arch_errors)))
+        # Files that were removed by make install after they were processed.
+        file_stats = self.list_files()
+        self.checksums = {
+            rel_path: checksum for rel_path, checksum in self.checksums.items()
+            if rel_path in file_stats
+        }
+        if self.dedup:
+            self.dedup_files()
+        return self.checksums
+
+    def relocate_symlinks(self, path_rewriter: PathRewriter) -> None:
+        for root, dir_names, file_names in os.walk(self.staged_install_dir):
+            for name in dir_names + file_names:
+                path = os.path.join(root, name)
+                if os.path.islink(path) and path_rewriter.rewrite_file(path):
+                    self.num_relocated_files += 1
+
+    def abort(self) -> None:
+        self.install_finished.set()
+        if self.poll_thread is not None:
+            self.poll_thread.join()
+        self.executor.shutdown(cancel_futures=True)
+
+    def dedup_files(self) -> None:
+        """
+        Replaces files with the same contents and mode with hard links to one of them.
+        """
+        first_paths: Dict[Tuple[str, int], str] = {}
+        num_linked_files = 0
+        saved_bytes = 0
+        for rel_path in sorted(self.checksums):
+            size, _, sha256 = self.checksums[rel_path]
+            if size == 0:
+                continue
+            path = os.path.join(self.staged_install_dir, rel_path)
+            st = os.lstat(path)
+            key = (sha256, st.st_mode)
+            first_path = first_paths.setdefault(key, path)
+            if first_path == path or os.path.samefile(first_path, path):
+                continue
+            tmp_path = path + '.tmp.' + str_md5(path)[:8]
+            os.link(first_path, tmp_path)
+            os.rename(tmp_path, path)
+            first_st = os.lstat(first_path)
+            self.checksums[rel_path] = (size, int(first_st.st_mtime), sha256)
+            num_linked_files += 1
+            saved_bytes += size
+        logging.info("Replaced %d duplicate files with hard links, saving %.1f MiB",
+                     num_linked_files, saved_bytes / 1024 ** 2)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'num_files': len(self.checksums),
+            'num_files_processed_during_install': self.num_files_processed_during_install,
+            'num_stripped_files': self.num_stripped_files,
+            'num_relocated_files': self.num_relocated_files,
+        }
+
+
+def move_staged_install_into_place(staged_install_dir: str, final_install_dir: str) -> None:
+    """
+    Replaces the final installation directory with the staged one. Files written to the build
+    info directory of the final installation directory before the install (e.g. the git log) are
+    kept. The installation directory is swapped with two renames, so it is either absent for a
+    moment or complete, but never partially populated.
+    """
+    existing_build_info_dir = os.path.join(final_install_dir, GCC_BUILD_INFO_DIR_NAME)
+    if os.path.isdir(existing_build_info_dir):
+        staged_build_info_dir = os.path.join(staged_install_dir, GCC_BUILD_INFO_DIR_NAME)
+        mkdir_p(staged_build_info_dir)
+        for file_name in os.listdir(existing_build_info_dir):
+            staged_path = os.path.join(staged_build_info_dir, file_name)
+            if not os.path.exists(staged_path):
+                os.rename(os.path.join(existing_build_info_dir, file_name), staged_path)
+
+    old_install_dir: Optional[str] = None
+    if os.path.exists(final_install_dir):
+        old_install_dir = '%s.old.%d' % (final_install_dir, int(time.time()))
+        os.rename(final_install_dir, old_install_dir)
+    os.rename(staged_install_dir, final_install_dir)
+    logging.info("Moved the staged installation %s to %s", staged_install_dir, final_install_dir)
+    if old_install_dir is not None:
+        rm_rf(old_install_dir)
@@ -0,0 +1,87 @@
+"""
+Selection of the linker used for the host (stage1) and bootstrap (stage2 and later) links, and
+checks that the selected linkers are available.
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import tempfile
+
+from typing import Optional
+
+from build_gcc.helpers import which
+
+
+SUPPORTED_LINKERS = ['bfd', 'gold', 'lld', 'mold']
+
+LTO_PARALLELISM_JOBSERVER = 'jobserver'
+LTO_PARALLELISM_AUTO = 'auto'
+
+
+def validate_lto_parallelism(value: str) -> str:
+    """
+    >>> validate_lto_parallelism('jobserver')
+    'jobserver'
+    >>> validate_lto_parallelism('8')
+    '8'
+    """
+    if value in (LTO_PARALLELISM_JOBSERVER, LTO_PARALLELISM_AUTO):
+        return value
+    if value.isdigit() and int(value) > 0:
+        return value
+    raise argparse.ArgumentTypeError(
+        "LTO parallelism must be '%s', '%s', or a positive number, got: %s" % (
+            LTO_PARALLELISM_JOBSERVER, LTO_PARALLELISM_AUTO, value))
+
+
+def get_linker_executable_name(linker: str) -> str:
+    # This is the name GCC looks for in its search path when given -fuse-ld=<linker>.
+    return 'ld.' + linker
+
+
+def get_linker_version(linker: str) -> Optional[str]:
+    linker_path = which(get_linker_executable_name(linker))
+    if linker_path is None:
+        return None
+    version_output = subprocess.check_output([linker_path, '--version']).decode('utf-8')
+    return version_output.strip().split('\n')[0].strip()
+
+
+def check_linker_works_with_compiler(linker: str, c_compiler: Optional[str]) -> None:
+    """
+    Links a trivial program with the given compiler and linker.
+    """
+    if c_compiler is None:
+        raise ValueError(
+            "Cannot check that linker %s works: the host C compiler could not be determined" %
+            linker)
+    with tempfile.TemporaryDirectory(prefix='yb_gcc_linker_check_') as tmp_dir:
+        src_path = os.path.join(tmp_dir, 'linker_check.c')
+        with open(src_path, 'w') as src_file:
+            src_file.write('int main(void) { return 0; }\n')
+        result = subprocess.run(
+            [c_compiler, f'-fuse-ld={linker}', src_path, '-o',
+             os.path.join(tmp_dir, 'linker_check')],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        if result.returncode != 0:
+            raise ValueError(
+                "Linker %s does not work with the host compiler %s:\n%s" % (
+                    linker, c_compiler, result.stdout.decode('utf-8', errors='replace')))
+    logging.info("Verified that linker %s works with the host compiler %s", linker, c_compiler)
+
+
+def check_bootstrap_linker_available(linker: str) -> None:
+    """
+    The bootstrap stages are linked by the GCC being built, so we can only check that the linker
+    executable is on PATH.
+    """
+    executable_name = get_linker_executable_name(linker)
+    linker_path = which(executable_name)
+    if linker_path is None:
+        raise ValueError(
+            "Linker %s selected for the bootstrap stages, but %s was not found on PATH" % (
+                linker, executable_name))
+    logging.info("Found linker %s for the bootstrap stages at %s", linker, linker_path)
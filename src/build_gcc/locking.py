@@ -0,0 +1,99 @@
+"""
+File locks used to coordinate concurrent builds on the same host. Each shared directory (a source
+checkout, a cache entry, an installation directory) is protected by a lock file in the .locks
+directory under the install parent directory. Builds that only read a directory take a shared
+lock, and builds that create, modify or delete it take an exclusive lock.
+
+The locks are based on flock(2), so they are released automatically when the process holding them
+exits, and two locks on the same file conflict even within one process. Lock files are never
+deleted, because another process might be waiting on a lock file that is being deleted.
+"""
+
+import fcntl
+import logging
+import os
+import time
+
+from types import TracebackType
+from typing import Optional, Type
+
+from build_gcc.constants import LOCKS_DIR_NAME
+from build_gcc.helpers import mkdir_p, str_md5
+
+
+class FileLock:
+    lock_path: str
+    description: str
+    fd: Optional[int]
+    shared: bool
+
+    def __init__(self, lock_path: str, description: str) -> None:
+        self.lock_path = lock_path
+        self.description = description
+        self.fd = None
+        self.shared = False
+
+    def is_held(self) -> bool:
+        return self.fd is not None
+
+    def acquire(self, shared: bool = False, blocking: bool = True) -> bool:
+        """
+        Acquires the lock in shared or exclusive mode. If the lock is already held by this object,
+        converts it to the requested mode. Returns False if blocking is False and the lock is held
+        by someone else in a conflicting mode.
+        """
+        was_held = self.is_held()
+        if self.fd is None:
+            mkdir_p(os.path.dirname(self.lock_path))
+            self.fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        mode_str = 'shared' if shared else 'exclusive'
+        try:
+            fcntl.flock(self.fd, mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if not blocking:
+                if not was_held:
+                    os.close(self.fd)
+                    self.fd = None
+                return False
+            logging.info("Waiting for a %s lock on %s (%s)",
+                         mode_str, self.description, self.lock_path)
+            start_time_sec = time.time()
+            fcntl.flock(self.fd, mode)
+            logging.info("Acquired a %s lock on %s after %.1f seconds",
+                         mode_str, self.description, time.time() - start_time_sec)
+        self.shared = shared
+        return True
+
+    def release(self) -> None:
+        if self.fd is None:
+            return
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc_value: Optional[BaseException],
+            traceback: Optional[TracebackType]) -> None:
+        self.release()
+
+
+def get_lock_file_path(install_parent_dir: str, path: str) -> str:
+    """
+    Returns the lock file protecting the given path. The file name contains the base name of the
+    path for readability, and a hash of the full path to make it unique.
+    """
+    abs_path = os.path.abspath(path)
+    return os.path.join(
+        install_parent_dir, LOCKS_DIR_NAME,
+        '%s-%s.lock' % (os.path.basename(abs_path), str_md5(abs_path)[:12]))
+
+
+def get_path_lock(install_parent_dir: str, path: str) -> FileLock:
+    return FileLock(get_lock_file_path(install_parent_dir, path), description=path)
@@ -0,0 +1,223 @@
+"""
+A per-file manifest of an installed GCC tree (path, size, mode, modification time and SHA-256 of
+every file, and the target of every symlink), stored in the build info directory of the tree. It
+is written before packaging and can be used later to check an installed toolchain with the
+verify subcommand.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import stat
+import sys
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from build_gcc.constants import GCC_BUILD_INFO_DIR_NAME
+from build_gcc.helpers import compute_sha256_checksum, mkdir_p, write_file_atomically
+
+
+MANIFEST_FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = 'manifest.json'
+
+ENTRY_TYPE_FILE = 'file'
+ENTRY_TYPE_SYMLINK = 'symlink'
+
+
+def get_manifest_path(install_dir: str) -> str:
+    return os.path.join(install_dir, GCC_BUILD_INFO_DIR_NAME, MANIFEST_FILE_NAME)
+
+
+def get_default_num_threads() -> int:
+    return os.cpu_count() or 1
+
+
+def list_install_dir(install_dir: str) -> List[str]:
+    """
+    Returns the sorted relative paths of all files and symlinks in install_dir, except for the
+    manifest itself.
+    """
+    manifest_rel_path = os.path.relpath(get_manifest_path(install_dir), install_dir)
+    rel_paths: List[str] = []
+    for root, dir_names, file_names in os.walk(install_dir):
+        rel_root = os.path.relpath(root, install_dir)
+        for name in dir_names + file_names:
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+            path = os.path.join(install_dir, rel_path)
+            if rel_path != manifest_rel_path and (
+                    os.path.islink(path) or not os.path.isdir(path)):
+                rel_paths.append(rel_path)
+    return sorted(rel_paths)
+
+
+# Checksums computed earlier, keyed by relative path: the size, the modification time in seconds and
+# the SHA-256 checksum of each file. Used when the size and the modification time still match.
+KnownChecksums = Dict[str, Tuple[int, int, str]]
+
+
+def create_manifest_entry(
+        install_dir: str,
+        rel_path: str,
+        known_checksums: Optional[KnownChecksums] = None) -> Dict[str, Any]:
+    path = os.path.join(install_dir, rel_path)
+    st = os.lstat(path)
+    if stat.S_ISLNK(st.st_mode):
+        return {
+            'path': rel_path,
+            'type': ENTRY_TYPE_SYMLINK,
+            'target': os.readlink(path),
+        }
+    return {
+        'path': rel_path,
+        'type': ENTRY_TYPE_FILE,
+        'size': st.st_size,
+        'mode': stat.S_IMODE(st.st_mode),
+        'mtime': int(st.st_mtime),
+        'sha256': get_sha256_checksum(path, rel_path, st, known_checksums),
+    }
+
+
+def get_sha256_checksum(
+        path: str,
+        rel_path: str,
+        st: os.stat_result,
+        known_checksums: Optional[KnownChecksums]) -> str:
+    known_checksum = known_checksums.get(rel_path) if known_checksums else None
+    if known_checksum is not None and known_checksum[:2] == (st.st_size, int(st.st_mtime)):
+        return known_checksum[2]
+    return compute_sha256_checksum(path)
+
+
+def create_manifest(
+        install_dir: str,
+        num_threads: Optional[int] = None,
+        known_checksums: Optional[KnownChecksums] = None) -> Dict[str, Any]:
+    start_time_sec = time.time()
+    rel_paths = list_install_dir(install_dir)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=num_threads or get_default_num_threads()) as executor:
+        entries = list(executor.map(
+            lambda rel_path: create_manifest_entry(install_dir, rel_path, known_checksums),
+            rel_paths))
+    logging.info("Computed the manifest of %d files in %s in %.1f seconds",
+                 len(entries), install_dir, time.time() - start_time_sec)
+    return {
+        'format_version': MANIFEST_FORMAT_VERSION,
+        'files': entries,
+    }
+
+
+def write_manifest(
+        install_dir: str,
+        num_threads: Optional[int] = None,
+        known_checksums: Optional[KnownChecksums] = None) -> str:
+    manifest = create_manifest(install_dir, num_threads, known_checksums)
+    manifest_path = get_manifest_path(install_dir)
+    mkdir_p(os.path.dirname(manifest_path))
+    write_file_atomically(manifest_path, json.dumps(manifest, indent=1, sort_keys=True) + '\n')
+    logging.info("Wrote manifest to %s", manifest_path)
+    return manifest_path
+
+
+def read_manifest(install_dir: str) -> Dict[str, Any]:
+    manifest_path = get_manifest_path(install_dir)
+    if not os.path.exists(manifest_path):
+        raise IOError("Manifest not found: %s" % manifest_path)
+    with open(manifest_path) as manifest_file:
+        manifest: Dict[str, Any] = json.load(manifest_file)
+    if manifest.get('format_version') != MANIFEST_FORMAT_VERSION:
+        raise ValueError("Unsupported manifest format version in %s: %s" % (
+            manifest_path, manifest.get('format_version')))
+    return manifest
+
+
+def verify_manifest_entry(
+        install_dir: str,
+        entry: Dict[str, Any],
+        changed_only: bool) -> Optional[str]:
+    """
+    Checks one file or symlink against its manifest entry. Returns a description of the problem,
+    or None if the file matches. With changed_only, files whose size and modification time match
+    the manifest are assumed to be intact and are not hashed.
+    """
+    rel_path = entry['path']
+    path = os.path.join(install_dir, rel_path)
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return "%s: missing" % rel_path
+
+    if entry['type'] == ENTRY_TYPE_SYMLINK:
+        if not stat.S_ISLNK(st.st_mode):
+            return "%s: expected a symlink" % rel_path
+        target = os.readlink(path)
+        if target != entry['target']:
+            return "%s: symlink target is %s, expected %s" % (rel_path, target, entry['target'])
+        return None
+
+    if not stat.S_ISREG(st.st_mode):
+        return "%s: expected a regular file" % rel_path
+    if st.st_size != entry['size']:
+        return "%s: size is %d, expected %d" % (rel_path, st.st_size, entry['size'])
+    if stat.S_IMODE(st.st_mode) != entry['mode']:
+        return "%s: mode is %o, expected %o" % (rel_path, stat.S_IMODE(st.st_mode), entry['mode'])
+    if changed_only and int(st.st_mtime) == entry['mtime']:
+        return None
+    sha256 = compute_sha256_checksum(path)
+    if sha256 != entry['sha256']:
+        return "%s: SHA-256 is %s, expected %s" % (rel_path, sha256, entry['sha256'])
+    return None
+
+
+def verify_install_dir(
+        install_dir: str,
+        changed_only: bool = False,
+        num_threads: Optional[int] = None) -> List[str]:
+    """
+    Checks an installed tree against its manifest in parallel, and returns the list of problems
+    found, including files that are not in the manifest.
+    """
+    start_time_sec = time.time()
+    entries = read_manifest(install_dir)['files']
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=num_threads or get_default_num_threads()) as executor:
+        results = list(executor.map(
+            lambda entry: verify_manifest_entry(install_dir, entry, changed_only), entries))
+    problems = [result for result in results if result is not None]
+
+    expected_rel_paths = set(entry['path'] for entry in entries)
+    problems.extend(
+        "%s: not in the manifest" % rel_path
+        for rel_path in list_install_dir(install_dir)
+        if rel_path not in expected_rel_paths)
+
+    logging.info("Verified %d files in %s in %.1f seconds, %d problems found",
+                 len(entries), install_dir, time.time() - start_time_sec, len(problems))
+    return problems
+
+
+def verify_main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog='build_gcc.sh verify',
+        description='Verify an installed GCC tree against its manifest')
+    parser.add_argument('install_dir', help='Installed GCC directory to verify')
+    parser.add_argument(
+        '--changed_only',
+        action='store_true',
+        help='Only hash files whose size or modification time differ from the manifest')
+    parser.add_argument(
+        '-j', '--parallelism',
+        type=int,
+        help='Number of files to hash in parallel. Default: number of CPUs.')
+    args = parser.parse_args(argv)
+
+    problems = verify_install_dir(
+        os.path.abspath(args.install_dir),
+        changed_only=args.changed_only,
+        num_threads=args.parallelism)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    return 1 if problems else 0
@@ -0,0 +1,213 @@
+"""
+A series of local patches applied to the GCC source code after cloning. The hash of the series is
+part of the tag, so patched toolchains get their own build and installation directories.
+
+Applying a series to a checkout records it in a marker file in the .git directory of the checkout.
+When a different series is applied to the same checkout later (e.g. with --existing_build_dir),
+the files changed by the old or the new series are brought to their new contents, and all other
+files are left alone. Their modification times do not change, so make only rebuilds what depends
+on the patched files. Patched checkouts are not used as clone sources for other builds.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+
+from typing import Any, Dict, List, Optional
+
+from build_gcc.helpers import compute_sha256_checksum, write_file_atomically
+
+
+PATCH_SERIES_HASH_LENGTH = 8
+PATCH_SERIES_TAG_COMPONENT_PREFIX = 'p'
+
+# The quilt convention: a file in the patch directory listing the patches in order.
+SERIES_FILE_NAME = 'series'
+PATCH_FILE_SUFFIXES = ('.patch', '.diff')
+
+APPLIED_PATCH_SERIES_FILE_NAME = 'yb-applied-patch-series.json'
+
+GIT_REGULAR_FILE_MODE = '100644'
+GIT_EXECUTABLE_FILE_MODE = '100755'
+
+
+class PatchSeries:
+    patch_paths: List[str]
+
+    def __init__(self, patch_paths: List[str]) -> None:
+        self.patch_paths = patch_paths
+
+    @staticmethod
+    def from_path(path: str) -> 'PatchSeries':
+        """
+        Loads a patch series from a directory or a series file. A directory with a series file in
+        it is read the same way as that file. Otherwise, all .patch and .diff files in the
+        directory are applied in the order of their names. A series file lists one patch per line,
+        relative to the directory of the series file. Empty lines and lines starting with # are
+        ignored.
+        """
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            series_file_path = os.path.join(path, SERIES_FILE_NAME)
+            if not os.path.exists(series_file_path):
+                return PatchSeries([
+                    os.path.join(path, file_name) for file_name in sorted(os.listdir(path))
+                    if file_name.endswith(PATCH_FILE_SUFFIXES)
+                ])
+            path = series_file_path
+
+        patch_paths = []
+        with open(path) as series_file:
+            for line in series_file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    patch_paths.append(os.path.join(os.path.dirname(path), line.split()[0]))
+        for patch_path in patch_paths:
+            if not os.path.isfile(patch_path):
+                raise IOError("Patch file %s listed in %s does not exist" % (patch_path, path))
+        return PatchSeries(patch_paths)
+
+    def get_hash(self) -> str:
+        """
+        The hash of the contents of the patches, in order. Patch file names do not matter.
+        """
+        series_hash = hashlib.sha256()
+        for patch_path in self.patch_paths:
+            series_hash.update(compute_sha256_checksum(patch_path).encode('utf-8'))
+        return series_hash.hexdigest()
+
+    def get_tag_component(self) -> str:
+        return PATCH_SERIES_TAG_COMPONENT_PREFIX + self.get_hash()[:PATCH_SERIES_HASH_LENGTH]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'hash': self.get_hash(),
+            'patches': [
+                {
+                    'name': os.path.basename(patch_path),
+                    'sha256': compute_sha256_checksum(patch_path),
+                }
+                for patch_path in self.patch_paths
+            ],
+        }
+
+
+def is_patch_series_tag_component(component: str) -> bool:
+    """
+    >>> is_patch_series_tag_component('p0123abcd')
+    True
+    >>> is_patch_series_tag_component('1618898532')
+    False
+    """
+    hash_part = component[len(PATCH_SERIES_TAG_COMPONENT_PREFIX):]
+    return (component.startswith(PATCH_SERIES_TAG_COMPONENT_PREFIX) and
+            len(hash_part) == PATCH_SERIES_HASH_LENGTH and
+            all(c in '0123456789abcdef' for c in hash_part))
+
+
+def get_applied_patch_series_path(repo_path: str) -> str:
+    return os.path.join(repo_path, '.git', APPLIED_PATCH_SERIES_FILE_NAME)
+
+
+def read_applied_patch_series(repo_path: str) -> Optional[Dict[str, Any]]:
+    marker_path = get_applied_patch_series_path(repo_path)
+    if not os.path.exists(marker_path):
+        return None
+    with open(marker_path) as marker_file:
+        applied_series: Dict[str, Any] = json.load(marker_file)
+    return applied_series
+
+
+def is_patched_checkout(repo_path: str) -> bool:
+    return os.path.exists(get_applied_patch_series_path(repo_path))
+
+
+def git_output(repo_path: str, args: List[str], index_file: str) -> str:
+    return subprocess.check_output(
+        ['git'] + args, cwd=repo_path,
+        env=dict(os.environ, GIT_INDEX_FILE=index_file)).decode('utf-8')
+
+
+def update_file_from_index(repo_path: str, rel_path: str, index_file: str) -> bool:
+    """
+    Brings one file in the working tree to its contents in the given index, and returns whether
+    it had to be changed. The file is deleted if it is not in the index.
+    """
+    path = os.path.join(repo_path, rel_path)
+    index_entry = git_output(repo_path, ['ls-files', '--stage', '--', rel_path], index_file)
+    if not index_entry:
+        if not os.path.lexists(path):
+            return False
+        os.remove(path)
+        return True
+
+    mode, blob_sha1 = index_entry.split()[:2]
+    if mode not in (GIT_REGULAR_FILE_MODE, GIT_EXECUTABLE_FILE_MODE):
+        raise ValueError("Patches may only change regular files, %s has mode %s" % (
+            rel_path, mode))
+    file_mode = 0o755 if mode == GIT_EXECUTABLE_FILE_MODE else 0o644
+    if (os.path.isfile(path) and not os.path.islink(path) and
+            git_output(repo_path, ['hash-object', '--', rel_path], index_file).strip() ==
+            blob_sha1):
+        if os.stat(path).st_mode & 0o777 != file_mode:
+            os.chmod(path, file_mode)
+        return False
+
+    contents = subprocess.check_output(['git', 'cat-file', 'blob', blob_sha1], cwd=repo_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.lexists(path):
+        os.remove(path)
+    with open(path, 'wb') as output_file:
+        output_file.write(contents)
+    os.chmod(path, file_mode)
+    return True
+
+
+def apply_patch_series(repo_path: str, patch_series: PatchSeries) -> List[str]:
+    """
+    Applies the patch series to the checkout at repo_path, replacing the series applied earlier,
+    if any. The patches are applied on top of HEAD in a temporary index, and only the files that
+    differ from it are written. Returns the relative paths of the files changed in the working
+    tree.
+    """
+    series_hash = patch_series.get_hash()
+    applied_series = read_applied_patch_series(repo_path)
+    if applied_series is None and not patch_series.patch_paths:
+        return []
+    if applied_series is not None and applied_series['hash'] == series_hash:
+        logging.info("Patch series %s is already applied to %s", series_hash, repo_path)
+        return []
+
+    with tempfile.TemporaryDirectory(prefix='yb-patch-series-') as temp_dir:
+        index_file = os.path.join(temp_dir, 'index')
+        git_output(repo_path, ['read-tree', 'HEAD'], index_file)
+        for patch_path in patch_series.patch_paths:
+            logging.info("Applying patch %s", patch_path)
+            try:
+                git_output(repo_path, ['apply', '--cached', patch_path], index_file)
+            except subprocess.CalledProcessError:
+                raise ValueError("Patch %s does not apply to %s" % (patch_path, repo_path))
+
+        patched_files = git_output(
+            repo_path, ['diff', '--cached', '--name-only', 'HEAD'], index_file).split('\n')
+        patched_files = [rel_path for rel_path in patched_files if rel_path]
+        earlier_patched_files = applied_series['files'] if applied_series is not None else []
+        changed_files = [
+            rel_path for rel_path in sorted(set(patched_files + earlier_patched_files))
+            if update_file_from_index(repo_path, rel_path, index_file)
+        ]
+
+    if patch_series.patch_paths:
+        write_file_atomically(
+            get_applied_patch_series_path(repo_path),
+            json.dumps(dict(patch_series.to_dict(), files=patched_files), indent=2,
+                       sort_keys=True) + '\n')
+    else:
+        # The checkout is pristine again.
+        os.remove(get_applied_patch_series_path(repo_path))
+    logging.info("Applied patch series %s (%d patches) to %s, %d files changed",
+                 series_hash, len(patch_series.patch_paths), repo_path, len(changed_files))
+    return changed_files
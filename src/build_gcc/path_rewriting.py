@@ -0,0 +1,154 @@
+"""
+Rewriting of absolute paths embedded in a directory tree, for reusing a build directory or an
+installed tree at a different location. Only text files and symlinks are rewritten. The paths
+compiled into binaries are left as they are: GCC finds its own components relative to the location
+of its executables, so those paths only serve as defaults that are not used after a move.
+
+Rewritten files keep their modification times, so that make does not consider anything that
+depends on them out of date.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+
+from typing import Dict, List, Pattern
+
+
+# Like git, a file is considered binary if there is a NUL byte in its first few kilobytes.
+BINARY_CHECK_SIZE = 8000
+
+
+def is_binary_content(content: bytes) -> bool:
+    """
+    >>> is_binary_content(b'prefix=/opt/yb-gcc\\n')
+    False
+    >>> is_binary_content(b'\\x7fELF\\x02\\x01\\x01\\x00')
+    True
+    """
+    return b'\0' in content[:BINARY_CHECK_SIZE]
+
+
+def get_path_variants(path: str) -> List[str]:
+    """
+    The spellings of a path that tools may record: the absolute path as given, and the path with
+    symlinks resolved, which is what e.g. the pwd command of configure may return.
+    """
+    abs_path = os.path.abspath(path)
+    return [abs_path, os.path.realpath(abs_path)]
+
+
+def get_path_replacements(old_paths: List[str], new_paths: List[str]) -> Dict[str, str]:
+    """
+    Maps the variants of each old path to the corresponding variants of the new path.
+
+    >>> get_path_replacements(['/a/b'], ['/c/d'])
+    {'/a/b': '/c/d'}
+    """
+    replacements: Dict[str, str] = {}
+    for old_path, new_path in zip(old_paths, new_paths):
+        for old_variant, new_variant in zip(
+                get_path_variants(old_path), get_path_variants(new_path)):
+            replacements.setdefault(old_variant, new_variant)
+    return replacements
+
+
+class PathRewriter:
+    replacements: Dict[bytes, bytes]
+    pattern: Pattern[bytes]
+
+    def __init__(self, replacements: Dict[str, str]) -> None:
+        """
+        replacements maps old paths to new ones. Old paths may be prefixes of each other, e.g. an
+        installation directory and the build directory next to it with an added suffix, so longer
+        paths are matched first.
+        """
+        self.replacements = {
+            old_path.encode('utf-8'): new_path.encode('utf-8')
+            for old_path, new_path in replacements.items()
+        }
+        self.pattern = re.compile(b'|'.join(
+            re.escape(old_path)
+            for old_path in sorted(self.replacements, key=len, reverse=True)))
+
+    def is_noop(self) -> bool:
+        return all(old_path == new_path for old_path, new_path in self.replacements.items())
+
+    def rewrite_content(self, content: bytes) -> bytes:
+        """
+        >>> PathRewriter({'/x/v1': '/x/v2', '/x/v1-build': '/y/b'}).rewrite_content(
+        ...     b'prefix=/x/v1 srcdir=/x/v1-build/gcc')
+        b'prefix=/x/v2 srcdir=/y/b/gcc'
+        """
+        return self.pattern.sub(lambda match: self.replacements[match.group(0)], content)
+
+    def needs_rewriting(self, path: str) -> bool:
+        """
+        Returns True if path is a text file or a symlink that refers to any of the old paths.
+        """
+        if os.path.islink(path):
+            return self.pattern.search(os.fsencode(os.readlink(path))) is not None
+        with open(path, 'rb') as input_file:
+            head = input_file.read(BINARY_CHECK_SIZE)
+            if is_binary_content(head):
+                return False
+            content = head + input_file.read()
+        return self.pattern.search(content) is not None
+
+    def find_files(self, root_dir: str) -> List[str]:
+        """
+        Returns the paths, relative to root_dir, of the text files and symlinks in root_dir that
+        refer to any of the old paths.
+        """
+        rel_paths = []
+        for root, dir_names, file_names in os.walk(root_dir):
+            for name in file_names + [
+                    name for name in dir_names if os.path.islink(os.path.join(root, name))]:
+                path = os.path.join(root, name)
+                if self.needs_rewriting(path):
+                    rel_paths.append(os.path.relpath(path, root_dir))
+        return sorted(rel_paths)
+
+    def rewrite_file(self, path: str) -> bool:
+        """
+        Replaces the old paths in a text file or in the target of a symlink, keeping the
+        modification time. Returns True if the file was changed.
+        """
+        if os.path.islink(path):
+            target = os.fsencode(os.readlink(path))
+            new_target = self.rewrite_content(target)
+            if new_target == target:
+                return False
+            os.remove(path)
+            os.symlink(os.fsdecode(new_target), path)
+            return True
+
+        st = os.stat(path)
+        with open(path, 'rb') as input_file:
+            content = input_file.read()
+        if is_binary_content(content):
+            return False
+        new_content = self.rewrite_content(content)
+        if new_content == content:
+            return False
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix='.' + os.path.basename(path) + '.')
+        try:
+            with os.fdopen(fd, 'wb') as output_file:
+                output_file.write(new_content)
+            shutil.copymode(path, tmp_path)
+            os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return True
+
+    def rewrite_files(self, root_dir: str, rel_paths: List[str]) -> int:
+        """
+        Rewrites the given files in root_dir, and returns the number of files changed.
+        """
+        return sum(1 for rel_path in rel_paths
+                   if self.rewrite_file(os.path.join(root_dir, rel_path)))
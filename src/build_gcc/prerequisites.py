@@ -0,0 +1,159 @@
+"""
+Information about the libraries GCC needs to build (gmp, mpfr, mpc, isl), as specified by the
+contrib/download_prerequisites script in the GCC source tree, and a host-wide prefix of these
+libraries prebuilt once per library versions, OS and architecture and reused across GCC builds.
+"""
+
+import logging
+import os
+import re
+import time
+
+from typing import Dict, List, Optional
+
+from build_gcc.constants import SHARED_CACHE_DIR_NAME
+from build_gcc.helpers import mkdir_p, rm_rf, run_cmd
+
+
+PREREQUISITE_NAMES = ['gmp', 'mpfr', 'mpc', 'isl']
+
+# Matches lines such as gmp='gmp-6.2.1.tar.bz2' in contrib/download_prerequisites.
+PREREQUISITE_ARCHIVE_RE = re.compile(
+    r"^(%s)='(\S+?)\.tar\.(?:gz|bz2|xz)'\s*$" % '|'.join(PREREQUISITE_NAMES))
+
+# Used in place of the library versions when they are not known yet, i.e. before cloning.
+PREREQUISITE_VERSIONS_PLACEHOLDER_STR = 'PREREQUISITE_VERSIONS_PLACEHOLDER'
+
+
+def get_download_prerequisites_path(gcc_src_dir: str) -> str:
+    return os.path.join(gcc_src_dir, 'contrib', 'download_prerequisites')
+
+
+def get_prerequisite_versions(gcc_src_dir: str) -> Dict[str, str]:
+    """
+    Returns a map from a prerequisite library name to its versioned name, e.g. 'gmp-6.2.1'.
+    """
+    versions: Dict[str, str] = {}
+    with open(get_download_prerequisites_path(gcc_src_dir)) as script_file:
+        for line in script_file:
+            match = PREREQUISITE_ARCHIVE_RE.match(line.strip())
+            if match:
+                versions[match.group(1)] = match.group(2)
+    missing_names = [name for name in PREREQUISITE_NAMES if name not in versions]
+    if missing_names:
+        raise ValueError("Could not determine versions of %s from %s" % (
+            missing_names, get_download_prerequisites_path(gcc_src_dir)))
+    return versions
+
+
+def get_prerequisites_prefix_name(
+        versions: Optional[Dict[str, str]],
+        short_os_name_and_version: str,
+        architecture: str) -> str:
+    """
+    >>> get_prerequisites_prefix_name(
+    ...     {'gmp': 'gmp-6.2.1', 'mpfr': 'mpfr-4.1.0', 'mpc': 'mpc-1.2.1', 'isl': 'isl-0.24'},
+    ...     'centos7', 'x86_64')
+    'gmp-6.2.1-mpfr-4.1.0-mpc-1.2.1-isl-0.24-centos7-x86_64'
+    >>> get_prerequisites_prefix_name(None, 'centos7', 'x86_64')
+    'PREREQUISITE_VERSIONS_PLACEHOLDER-centos7-x86_64'
+    """
+    version_components = [PREREQUISITE_VERSIONS_PLACEHOLDER_STR]
+    if versions is not None:
+        version_components = [versions[name] for name in PREREQUISITE_NAMES]
+    return '-'.join(version_components + [short_os_name_and_version, architecture])
+
+
+def get_prerequisites_prefix_dir(
+        install_parent_dir: str,
+        versions: Optional[Dict[str, str]],
+        short_os_name_and_version: str,
+        architecture: str) -> str:
+    """
+    The host-wide prefix of prebuilt prerequisite libraries, shared by the GCC builds in
+    install_parent_dir that need the same library versions.
+    """
+    return os.path.join(
+        install_parent_dir, SHARED_CACHE_DIR_NAME, 'prerequisites',
+        get_prerequisites_prefix_name(versions, short_os_name_and_version, architecture))
+
+
+def get_prerequisites_configure_args(prefix_dir: str) -> List[str]:
+    return ['--with-%s=%s' % (name, prefix_dir) for name in PREREQUISITE_NAMES]
+
+
+def get_prerequisites_lib_dir(prefix_dir: str) -> str:
+    return os.path.join(prefix_dir, 'lib')
+
+
+def get_prerequisite_configure_args(name: str, prefix_dir: str) -> List[str]:
+    """
+    Configure arguments for building one prerequisite library as a static library with
+    position-independent code, so that it can be linked into GCC's executables and plugins.
+    The library directory is specified explicitly, because a site config may default to lib64,
+    while GCC's --with-gmp and similar options look for the libraries in <prefix>/lib.
+    """
+    args = [
+        f'--prefix={prefix_dir}',
+        f'--libdir={get_prerequisites_lib_dir(prefix_dir)}',
+        '--disable-shared',
+        '--enable-static',
+        '--with-pic',
+    ]
+    if name == 'mpfr':
+        args.append(f'--with-gmp={prefix_dir}')
+    elif name == 'mpc':
+        args += [f'--with-gmp={prefix_dir}', f'--with-mpfr={prefix_dir}']
+    elif name == 'isl':
+        args.append(f'--with-gmp-prefix={prefix_dir}')
+    return args
+
+
+def build_prerequisites_prefix(
+        gcc_src_dir: str,
+        prefix_dir: str,
+        parallelism: int,
+        cmd_prefix: List[str],
+        c_compiler: Optional[str],
+        cxx_compiler: Optional[str]) -> None:
+    """
+    Downloads the prerequisite libraries specified by the GCC source tree and builds them into
+    prefix_dir. The libraries are built and installed in a temporary directory next to prefix_dir,
+    which is then renamed into place, so prefix_dir is either complete or does not exist.
+    """
+    work_dir = '%s.tmp.%d' % (prefix_dir, os.getpid())
+    tmp_prefix_dir = os.path.join(work_dir, 'prefix')
+    download_dir = os.path.join(work_dir, 'src')
+    rm_rf(work_dir)
+    mkdir_p(download_dir)
+    start_time_sec = time.time()
+    try:
+        run_cmd(cmd_prefix + [
+            get_download_prerequisites_path(gcc_src_dir),
+            f'--directory={download_dir}',
+        ], cwd=gcc_src_dir)
+
+        for name in PREREQUISITE_NAMES:
+            lib_build_dir = os.path.join(work_dir, 'build', name)
+            mkdir_p(lib_build_dir)
+            logging.info("Building %s into %s", name, tmp_prefix_dir)
+            run_cmd(cmd_prefix + [
+                os.path.join(download_dir, name, 'configure')
+            ] + get_prerequisite_configure_args(name, tmp_prefix_dir) + [
+                f'CC={c_compiler}',
+                f'CXX={cxx_compiler}',
+            ], cwd=lib_build_dir)
+            run_cmd(cmd_prefix + ['make', '-j', str(parallelism)], cwd=lib_build_dir)
+            run_cmd(cmd_prefix + ['make', 'install'], cwd=lib_build_dir)
+
+        # Libtool archives refer to the temporary prefix, and GCC does not need them.
+        lib_dir = get_prerequisites_lib_dir(tmp_prefix_dir)
+        for file_name in os.listdir(lib_dir):
+            if file_name.endswith('.la'):
+                os.remove(os.path.join(lib_dir, file_name))
+
+        os.rename(tmp_prefix_dir, prefix_dir)
+    finally:
+        rm_rf(work_dir)
+    logging.info("Built GCC prerequisites in %s in %.1f seconds",
+                 prefix_dir, time.time() - start_time_sec)
@@ -0,0 +1,397 @@
+"""
+Publishes a release archive to a multipart upload target while the archive is being created. The
+output of tar is written to the local archive file, hashed, and cut into parts that are uploaded
+by a thread pool as soon as they are complete, so that compression, hashing and uploading overlap.
+The uploaded parts are not visible to consumers until the upload is committed. The target
+assembles the parts, and publishes the archive only if the SHA-256 checksum of the assembled
+archive matches the checksum computed while streaming. The .sha256 file is published after the
+archive.
+
+The state of an upload is kept next to the local archive, so an interrupted publish can be
+resumed: parts that the target already has with the same checksum are not uploaded again.
+
+Two kinds of targets are supported. A local directory (a path or a file:// URL) is a stand-in for
+testing and for publishing to a shared file system. An http(s):// URL is a server implementing
+the following protocol for an object <name> under the URL:
+
+    POST <url>/<name>?uploads                      starts an upload, returns {"upload_id": ...}
+    PUT  <url>/<name>?upload_id=<id>&part=<n>      stores part n (starting at 1), returns
+                                                   {"sha256": <checksum of the received part>}
+    GET  <url>/<name>?upload_id=<id>               returns {"parts": {"<n>": <sha256>, ...}}
+    POST <url>/<name>?upload_id=<id>&complete      with {"num_parts": ..., "sha256": ...}, assembles
+                                                   and publishes the object if the checksum
+                                                   matches, and fails with 409 otherwise
+"""
+
+import abc
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from typing import Any, Dict, IO, List, Optional
+
+from build_gcc.helpers import mkdir_p, rm_rf, write_file_atomically
+
+
+DEFAULT_PART_SIZE_MB = 16
+DEFAULT_NUM_UPLOAD_THREADS = 4
+
+# How many parts per upload thread may be waiting for upload. This bounds the memory used for
+# parts when the upload is slower than the compression.
+PARTS_AHEAD_PER_THREAD = 2
+
+NUM_PART_ATTEMPTS = 3
+HTTP_TIMEOUT_SEC = 300
+
+# Environment variable with a bearer token for http(s) upload targets.
+PUBLISH_TOKEN_ENV_VAR_NAME = 'YB_BUILD_GCC_PUBLISH_TOKEN'
+
+UPLOAD_STATE_FILE_SUFFIX = '.upload.json'
+SHA256_SUFFIX = '.sha256'
+LOCAL_UPLOADS_DIR_NAME = '.uploads'
+STREAM_READ_SIZE = 1024 * 1024
+
+
+class UploadTarget(abc.ABC):
+    """
+    A multipart upload target. Subclasses implement the operations for one kind of target.
+    """
+
+    @abc.abstractmethod
+    def get_url(self, name: str) -> str:
+        """
+        The URL under which the object with the given name is published.
+        """
+
+    @abc.abstractmethod
+    def start_upload(self, name: str) -> str:
+        """
+        Starts an upload of the given object, and returns the upload id.
+        """
+
+    @abc.abstractmethod
+    def list_parts(self, name: str, upload_id: str) -> Dict[int, str]:
+        """
+        Returns the SHA-256 checksums of the parts uploaded so far, keyed by the part number.
+        Raises IOError if the upload does not exist.
+        """
+
+    @abc.abstractmethod
+    def upload_part(self, name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        """
+        Uploads one part, and returns the SHA-256 checksum of the part as received by the target.
+        """
+
+    @abc.abstractmethod
+    def complete_upload(self, name: str, upload_id: str, num_parts: int, sha256: str) -> None:
+        """
+        Assembles the parts into the object and publishes it. Raises ValueError without
+        publishing anything if the checksum of the assembled object does not match.
+        """
+
+
+class LocalUploadTarget(UploadTarget):
+    """
+    Publishes into a local directory. Parts are stored in a directory per upload until the upload
+    is completed, and the assembled object is renamed into place.
+    """
+    root_dir: str
+
+    def __init__(self, root_dir: str) -> None:
+        self.root_dir = root_dir
+
+    def get_upload_dir(self, upload_id: str) -> str:
+        return os.path.join(self.root_dir, LOCAL_UPLOADS_DIR_NAME, upload_id)
+
+    def get_part_path(self, upload_id: str, part_number: int) -> str:
+        return os.path.join(self.get_upload_dir(upload_id), 'part-%05d' % part_number)
+
+    def get_url(self, name: str) -> str:
+        return 'file://' + os.path.join(os.path.abspath(self.root_dir), name)
+
+    def start_upload(self, name: str) -> str:
+        upload_id = '%s-%d-%d' % (name, int(time.time()), os.getpid())
+        mkdir_p(self.get_upload_dir(upload_id))
+        return upload_id
+
+    def list_parts(self, name: str, upload_id: str) -> Dict[int, str]:
+        upload_dir = self.get_upload_dir(upload_id)
+        if not os.path.isdir(upload_dir):
+            raise IOError("Upload %s of %s not found in %s" % (upload_id, name, self.root_dir))
+        parts = {}
+        for file_name in os.listdir(upload_dir):
+            if file_name.startswith('part-'):
+                with open(os.path.join(upload_dir, file_name), 'rb') as part_file:
+                    parts[int(file_name[len('part-'):])] = hashlib.sha256(
+                        part_file.read()).hexdigest()
+        return parts
+
+    def upload_part(self, name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        part_path = self.get_part_path(upload_id, part_number)
+        tmp_part_path = part_path + '.tmp'
+        with open(tmp_part_path, 'wb') as part_file:
+            part_file.write(data)
+        os.rename(tmp_part_path, part_path)
+        with open(part_path, 'rb') as part_file:
+            return hashlib.sha256(part_file.read()).hexdigest()
+
+    def complete_upload(self, name: str, upload_id: str, num_parts: int, sha256: str) -> None:
+        assembled_path = os.path.join(self.get_upload_dir(upload_id), 'assembled')
+        sha256_hash = hashlib.sha256()
+        with open(assembled_path, 'wb') as assembled_file:
+            for part_number in range(1, num_parts + 1):
+                with open(self.get_part_path(upload_id, part_number), 'rb') as part_file:
+                    while True:
+                        data = part_file.read(STREAM_READ_SIZE)
+                        if not data:
+                            break
+                        sha256_hash.update(data)
+                        assembled_file.write(data)
+        if sha256_hash.hexdigest() != sha256:
+            raise ValueError("Checksum mismatch for upload %s of %s: expected %s, got %s" % (
+                upload_id, name, sha256, sha256_hash.hexdigest()))
+        os.rename(assembled_path, os.path.join(self.root_dir, name))
+        rm_rf(self.get_upload_dir(upload_id))
+
+
+class HttpUploadTarget(UploadTarget):
+    """
+    Publishes to a server implementing the protocol described at the top of this module.
+    """
+    base_url: str
+    token: Optional[str]
+
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.token = os.getenv(PUBLISH_TOKEN_ENV_VAR_NAME)
+
+    def get_url(self, name: str) -> str:
+        return '%s/%s' % (self.base_url, urllib.parse.quote(name))
+
+    def request(
+            self,
+            method: str,
+            name: str,
+            query: str,
+            data: Optional[bytes] = None) -> Dict[str, Any]:
+        headers = {}
+        if self.token:
+            headers['Authorization'] = 'Bearer %s' % self.token
+        request = urllib.request.Request(
+            '%s?%s' % (self.get_url(name), query), data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT_SEC) as response:
+                response_json: Dict[str, Any] = json.loads(response.read() or b'{}')
+                return response_json
+        except urllib.error.HTTPError as ex:
+            if ex.code == 409:
+                raise ValueError("%s rejected the upload of %s: %s" % (
+                    self.base_url, name, ex.read().decode('utf-8', errors='replace')))
+            raise
+
+    def start_upload(self, name: str) -> str:
+        upload_id: str = self.request('POST', name, 'uploads', data=b'')['upload_id']
+        return upload_id
+
+    def list_parts(self, name: str, upload_id: str) -> Dict[int, str]:
+        parts = self.request(
+            'GET', name, urllib.parse.urlencode({'upload_id': upload_id}))['parts']
+        return {int(part_number): sha256 for part_number, sha256 in parts.items()}
+
+    def upload_part(self, name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        sha256: str = self.request(
+            'PUT', name, urllib.parse.urlencode({'upload_id': upload_id, 'part': part_number}),
+            data=data)['sha256']
+        return sha256
+
+    def complete_upload(self, name: str, upload_id: str, num_parts: int, sha256: str) -> None:
+        self.request(
+            'POST', name, urllib.parse.urlencode({'upload_id': upload_id}) + '&complete',
+            data=json.dumps({'num_parts': num_parts, 'sha256': sha256}).encode('utf-8'))
+
+
+def get_upload_target(url: str) -> UploadTarget:
+    """
+    >>> type(get_upload_target('file:///srv/releases')).__name__
+    'LocalUploadTarget'
+    >>> type(get_upload_target('https://releases.example.com/gcc')).__name__
+    'HttpUploadTarget'
+    """
+    if url.startswith(('http://', 'https://')):
+        return HttpUploadTarget(url)
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    return LocalUploadTarget(url)
+
+
+class ArchivePublisher:
+    target: UploadTarget
+    archive_path: str
+    name: str
+    part_size: int
+    num_threads: int
+
+    upload_id: Optional[str]
+    sha256: Optional[str]
+    num_parts: int
+    num_uploaded_parts: int
+    lock: threading.Lock
+
+    def __init__(
+            self,
+            target: UploadTarget,
+            archive_path: str,
+            part_size: int = DEFAULT_PART_SIZE_MB * 1024 * 1024,
+            num_threads: int = DEFAULT_NUM_UPLOAD_THREADS) -> None:
+        self.target = target
+        self.archive_path = archive_path
+        self.name = os.path.basename(archive_path)
+        self.part_size = part_size
+        self.num_threads = num_threads
+        self.upload_id = None
+        self.sha256 = None
+        self.num_parts = 0
+        self.num_uploaded_parts = 0
+        self.lock = threading.Lock()
+
+    def get_state_path(self) -> str:
+        return self.archive_path + UPLOAD_STATE_FILE_SUFFIX
+
+    def start_or_resume_upload(self) -> Dict[int, str]:
+        """
+        Resumes the upload recorded in the state file if the target still has it, or starts a new
+        one. Returns the checksums of the parts already uploaded.
+        """
+        if os.path.exists(self.get_state_path()):
+            with open(self.get_state_path()) as state_file:
+                state = json.load(state_file)
+            if state.get('url') == self.target.get_url(self.name):
+                try:
+                    parts = self.target.list_parts(self.name, state['upload_id'])
+                    self.upload_id = state['upload_id']
+                    logging.info("Resuming upload %s of %s with %d parts already uploaded",
+                                 self.upload_id, self.name, len(parts))
+                    return parts
+                except (IOError, urllib.error.URLError) as ex:
+                    logging.info("Can not resume upload %s of %s: %s",
+                                 state['upload_id'], self.name, ex)
+        self.upload_id = self.target.start_upload(self.name)
+        write_file_atomically(self.get_state_path(), json.dumps({
+            'url': self.target.get_url(self.name),
+            'upload_id': self.upload_id,
+        }))
+        logging.info("Started upload %s of %s to %s",
+                     self.upload_id, self.name, self.target.get_url(self.name))
+        return {}
+
+    def upload_part(self, part_number: int, data: bytes, existing_sha256: Optional[str]) -> None:
+        assert self.upload_id is not None
+        sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 == existing_sha256:
+            return
+        for attempt in range(1, NUM_PART_ATTEMPTS + 1):
+            try:
+                received_sha256 = self.target.upload_part(
+                    self.name, self.upload_id, part_number, data)
+                if received_sha256 != sha256:
+                    raise IOError("Part %d of %s was corrupted in transit: sent %s, received %s" % (
+                        part_number, self.name, sha256, received_sha256))
+                with self.lock:
+                    self.num_uploaded_parts += 1
+                return
+            except (IOError, urllib.error.URLError) as ex:
+                if attempt == NUM_PART_ATTEMPTS:
+                    raise
+                logging.warning("Attempt %d to upload part %d of %s failed: %s",
+                                attempt, part_number, self.name, ex)
+
+    def upload(self, source: IO[bytes], write_archive: bool) -> str:
+        """
+        Reads the archive from source, uploads it in parts and, if write_archive is true, also
+        writes it to the local archive file. Returns the SHA-256 checksum of the archive. The
+        upload is not visible until commit() is called.
+        """
+        start_time_sec = time.time()
+        existing_parts = self.start_or_resume_upload()
+        sha256_hash = hashlib.sha256()
+        num_bytes = 0
+        max_parts_ahead = self.num_threads * PARTS_AHEAD_PER_THREAD
+        archive_file: Optional[IO[bytes]] = (
+            open(self.archive_path + '.tmp', 'wb') if write_archive else None)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+                futures: List[concurrent.futures.Future] = []
+                part_number = 0
+                while True:
+                    part = read_part(source, self.part_size)
+                    if not part and part_number > 0:
+                        break
+                    part_number += 1
+                    sha256_hash.update(part)
+                    num_bytes += len(part)
+                    if archive_file is not None:
+                        archive_file.write(part)
+                    futures.append(executor.submit(
+                        self.upload_part, part_number, part, existing_parts.get(part_number)))
+                    # Wait for the oldest parts, so that at most max_parts_ahead parts are held
+                    # in memory.
+                    while len(futures) >= max_parts_ahead:
+                        futures.pop(0).result()
+                    if len(part) < self.part_size:
+                        break
+                for future in futures:
+                    future.result()
+        finally:
+            if archive_file is not None:
+                archive_file.close()
+        if archive_file is not None:
+            os.rename(self.archive_path + '.tmp', self.archive_path)
+
+        self.num_parts = part_number
+        self.sha256 = sha256_hash.hexdigest()
+        logging.info(
+            "Uploaded %.1f MiB of %s in %d parts (%d of them already uploaded earlier) in %.1f "
+            "seconds, SHA-256: %s", num_bytes / 1024 ** 2, self.name, self.num_parts,
+            self.num_parts - self.num_uploaded_parts, time.time() - start_time_sec, self.sha256)
+        return self.sha256
+
+    def commit(self, sha256_file_path: str) -> None:
+        """
+        Publishes the uploaded archive after the target has verified its checksum, and then the
+        checksum file.
+        """
+        assert self.upload_id is not None and self.sha256 is not None
+        self.target.complete_upload(self.name, self.upload_id, self.num_parts, self.sha256)
+        os.remove(self.get_state_path())
+        logging.info("Published %s", self.target.get_url(self.name))
+
+        with open(sha256_file_path, 'rb') as sha256_file:
+            sha256_file_content = sha256_file.read()
+        sha256_file_name = self.name + SHA256_SUFFIX
+        upload_id = self.target.start_upload(sha256_file_name)
+        self.target.upload_part(sha256_file_name, upload_id, 1, sha256_file_content)
+        self.target.complete_upload(
+            sha256_file_name, upload_id, 1, hashlib.sha256(sha256_file_content).hexdigest())
+        logging.info("Published %s", self.target.get_url(sha256_file_name))
+
+
+def read_part(source: IO[bytes], part_size: int) -> bytes:
+    """
+    Reads up to part_size bytes, fewer only at the end of the stream.
+    """
+    chunks = []
+    num_bytes = 0
+    while num_bytes < part_size:
+        data = source.read(min(STREAM_READ_SIZE, part_size - num_bytes))
+        if not data:
+            break
+        chunks.append(data)
+        num_bytes += len(data)
+    return b''.join(chunks)
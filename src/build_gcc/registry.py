@@ -0,0 +1,304 @@
+"""
+An index of the toolchains installed in the install parent directory, kept in a SQLite database
+next to them. Builds and fetches register the toolchains they install, and the garbage collector
+removes the entries of the toolchains it deletes, so that finding the newest toolchain matching a
+version, OS and architecture is one indexed query instead of a scan of the directory and parsing
+of directory names. The index can be rebuilt from the build_info.json files of the installed
+toolchains with the registry rebuild subcommand.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from typing import Any, Dict, List, Optional
+
+from build_gcc.constants import (
+    DEFAULT_INSTALL_PARENT_DIR,
+    GCC_BUILD_INFO_DIR_NAME,
+    REGISTRY_FILE_NAME,
+    YB_GCC_ARCHIVE_NAME_PREFIX,
+)
+from build_gcc.helpers import get_major_version, mkdir_p
+
+
+CREATE_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS toolchains (
+    install_dir TEXT PRIMARY KEY,
+    tag TEXT NOT NULL,
+    gcc_version TEXT NOT NULL,
+    gcc_major_version INTEGER NOT NULL,
+    git_sha1 TEXT,
+    os_name TEXT,
+    target_arch TEXT NOT NULL,
+    profile TEXT,
+    patch_series_hash TEXT,
+    archive_sha256 TEXT,
+    build_time REAL NOT NULL,
+    registered_time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS toolchains_by_config
+    ON toolchains (gcc_major_version, os_name, target_arch, build_time);
+"""
+
+TOOLCHAIN_COLUMNS = [
+    'install_dir', 'tag', 'gcc_version', 'gcc_major_version', 'git_sha1', 'os_name', 'target_arch',
+    'profile', 'patch_series_hash', 'archive_sha256', 'build_time', 'registered_time',
+]
+
+
+class ToolchainRecord:
+    install_dir: str
+    tag: str
+    gcc_version: str
+    gcc_major_version: int
+    git_sha1: Optional[str]
+    os_name: Optional[str]
+    target_arch: str
+    profile: Optional[str]
+    patch_series_hash: Optional[str]
+    archive_sha256: Optional[str]
+    build_time: float
+    registered_time: float
+
+    def __init__(
+            self,
+            install_dir: str,
+            tag: str,
+            gcc_version: str,
+            git_sha1: Optional[str],
+            os_name: Optional[str],
+            target_arch: str,
+            profile: Optional[str],
+            patch_series_hash: Optional[str],
+            archive_sha256: Optional[str],
+            build_time: float,
+            registered_time: Optional[float] = None) -> None:
+        self.install_dir = install_dir
+        self.tag = tag
+        self.gcc_version = gcc_version
+        self.gcc_major_version = get_major_version(gcc_version)
+        self.git_sha1 = git_sha1
+        self.os_name = os_name
+        self.target_arch = target_arch
+        self.profile = profile
+        self.patch_series_hash = patch_series_hash
+        self.archive_sha256 = archive_sha256
+        self.build_time = build_time
+        self.registered_time = registered_time or time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {column: getattr(self, column) for column in TOOLCHAIN_COLUMNS}
+
+    @staticmethod
+    def from_row(row: sqlite3.Row) -> 'ToolchainRecord':
+        return ToolchainRecord(
+            install_dir=row['install_dir'],
+            tag=row['tag'],
+            gcc_version=row['gcc_version'],
+            git_sha1=row['git_sha1'],
+            os_name=row['os_name'],
+            target_arch=row['target_arch'],
+            profile=row['profile'],
+            patch_series_hash=row['patch_series_hash'],
+            archive_sha256=row['archive_sha256'],
+            build_time=row['build_time'],
+            registered_time=row['registered_time'])
+
+    @staticmethod
+    def from_install_dir(
+            install_dir: str, archive_sha256: Optional[str] = None) -> 'ToolchainRecord':
+        """
+        Creates a record from the build_info.json file of an installed toolchain.
+        """
+        build_info_path = os.path.join(install_dir, GCC_BUILD_INFO_DIR_NAME, 'build_info.json')
+        if not os.path.exists(build_info_path):
+            raise IOError("Build info not found: %s" % build_info_path)
+        with open(build_info_path) as build_info_file:
+            build_info: Dict[str, Any] = json.load(build_info_file)
+        patch_series = build_info.get('patch_series')
+        return ToolchainRecord(
+            install_dir=os.path.abspath(install_dir),
+            tag=build_info['tag'],
+            gcc_version=build_info['gcc_version'],
+            git_sha1=build_info.get('git_sha1'),
+            os_name=build_info.get('host', {}).get('short_os_name_and_version'),
+            target_arch=build_info['target_arch'],
+            profile=build_info.get('profile'),
+            patch_series_hash=patch_series['hash'] if patch_series else None,
+            archive_sha256=archive_sha256,
+            build_time=build_info.get('build_time') or os.stat(build_info_path).st_mtime)
+
+
+class ToolchainRegistry:
+    db_path: str
+
+    def __init__(self, install_parent_dir: str) -> None:
+        self.db_path = os.path.join(install_parent_dir, REGISTRY_FILE_NAME)
+        mkdir_p(install_parent_dir)
+        with self.connect() as connection:
+            connection.executescript(CREATE_TABLES_SQL)
+
+    def connect(self) -> sqlite3.Connection:
+        # Concurrent builds, fetches and lookups on the same host may use the database at the
+        # same time. Each update is one transaction.
+        connection = sqlite3.connect(self.db_path, timeout=60)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def register(self, record: ToolchainRecord) -> None:
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO toolchains (%s) VALUES (%s)" % (
+                    ', '.join(TOOLCHAIN_COLUMNS), ', '.join('?' * len(TOOLCHAIN_COLUMNS))),
+                [getattr(record, column) for column in TOOLCHAIN_COLUMNS])
+        logging.info("Registered toolchain %s", record.install_dir)
+
+    def unregister(self, install_dir: str) -> None:
+        with self.connect() as connection:
+            connection.execute(
+                "DELETE FROM toolchains WHERE install_dir = ?", (os.path.abspath(install_dir),))
+
+    def find(
+            self,
+            gcc_version: Optional[str] = None,
+            os_name: Optional[str] = None,
+            target_arch: Optional[str] = None,
+            git_sha1: Optional[str] = None,
+            profile: Optional[str] = None,
+            patch_series_hash: Optional[str] = None,
+            limit: Optional[int] = None) -> List[ToolchainRecord]:
+        """
+        Returns the registered toolchains matching all the given criteria, newest first. A GCC
+        version matches itself and longer versions starting with it, e.g. 12 matches 12.2.0. A git
+        SHA1 or patch series hash may be a prefix. Entries of toolchains that no longer exist are
+        removed.
+        """
+        conditions = []
+        params: List[Any] = []
+        if gcc_version is not None:
+            conditions.append('gcc_major_version = ?')
+            params.append(get_major_version(gcc_version))
+            if '.' in gcc_version:
+                conditions.append('(gcc_version = ? OR gcc_version LIKE ?)')
+                params.extend([gcc_version, gcc_version + '.%'])
+        for column, value in [('os_name', os_name), ('target_arch', target_arch),
+                              ('profile', profile)]:
+            if value is not None:
+                conditions.append('%s = ?' % column)
+                params.append(value)
+        for column, value in [('git_sha1', git_sha1), ('patch_series_hash', patch_series_hash)]:
+            if value is not None:
+                conditions.append('%s LIKE ?' % column)
+                params.append(value + '%')
+
+        query = "SELECT * FROM toolchains"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY build_time DESC"
+        with self.connect() as connection:
+            rows = connection.execute(query, params).fetchall()
+
+        records = []
+        for row in rows:
+            record = ToolchainRecord.from_row(row)
+            if not os.path.isdir(record.install_dir):
+                logging.info("Removing registry entry of deleted toolchain %s",
+                             record.install_dir)
+                self.unregister(record.install_dir)
+                continue
+            records.append(record)
+            if limit is not None and len(records) >= limit:
+                break
+        return records
+
+    def find_newest(self, **kwargs: Any) -> Optional[ToolchainRecord]:
+        records = self.find(limit=1, **kwargs)
+        return records[0] if records else None
+
+    def rebuild(self, install_parent_dir: str) -> int:
+        """
+        Registers all toolchains installed in install_parent_dir and removes the entries of
+        toolchains that no longer exist. Returns the number of toolchains registered.
+        """
+        existing_archive_sha256s = {
+            record.install_dir: record.archive_sha256 for record in self.find()}
+        num_registered = 0
+        for name in sorted(os.listdir(install_parent_dir)):
+            install_dir = os.path.join(install_parent_dir, name)
+            if not name.startswith(YB_GCC_ARCHIVE_NAME_PREFIX) or not os.path.isdir(install_dir):
+                continue
+            try:
+                record = ToolchainRecord.from_install_dir(
+                    install_dir, existing_archive_sha256s.get(os.path.abspath(install_dir)))
+            except (IOError, KeyError, ValueError) as ex:
+                logging.info("Not registering %s: %s", install_dir, ex)
+                continue
+            self.register(record)
+            num_registered += 1
+        return num_registered
+
+
+def register_install_dir(install_dir: str, archive_sha256: Optional[str] = None) -> None:
+    ToolchainRegistry(os.path.dirname(os.path.abspath(install_dir))).register(
+        ToolchainRecord.from_install_dir(install_dir, archive_sha256))
+
+
+def registry_main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog='build_gcc.sh registry',
+        description='Look up installed GCC toolchains')
+    parser.add_argument(
+        '--install_parent_dir',
+        default=DEFAULT_INSTALL_PARENT_DIR,
+        help='Directory the toolchains are installed in. Default: %s' %
+             DEFAULT_INSTALL_PARENT_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    find_parser = subparsers.add_parser(
+        'find',
+        help='Print the installation directory of the newest matching toolchain')
+    find_parser.add_argument('--gcc_version', help='GCC version or version prefix, e.g. 12')
+    find_parser.add_argument('--os', help='Short OS name and version, e.g. almalinux8')
+    find_parser.add_argument('--target_arch', help='Target architecture, e.g. x86_64')
+    find_parser.add_argument('--git_sha1', help='GCC git SHA1 or SHA1 prefix')
+    find_parser.add_argument('--profile', help='Build profile, as in build_info.json')
+    find_parser.add_argument('--patch_series_hash', help='Patch series hash or hash prefix')
+    find_parser.add_argument(
+        '--all', action='store_true', help='Print all matching toolchains, newest first')
+    find_parser.add_argument(
+        '--json', action='store_true', help='Print the full registry entries as JSON')
+
+    subparsers.add_parser(
+        'rebuild',
+        help='Rebuild the registry from the build_info.json files of the installed toolchains')
+    args = parser.parse_args(argv)
+
+    install_parent_dir = os.path.abspath(args.install_parent_dir)
+    registry = ToolchainRegistry(install_parent_dir)
+    if args.command == 'rebuild':
+        num_registered = registry.rebuild(install_parent_dir)
+        logging.info("Registered %d toolchains in %s", num_registered, registry.db_path)
+        return 0
+
+    records = registry.find(
+        gcc_version=args.gcc_version,
+        os_name=args.os,
+        target_arch=args.target_arch,
+        git_sha1=args.git_sha1,
+        profile=args.profile,
+        patch_series_hash=args.patch_series_hash,
+        limit=None if args.all else 1)
+    if not records:
+        print("No matching toolchain found", file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps([record.to_dict() for record in records], indent=2, sort_keys=True))
+    else:
+        for record in records:
+            print(record.install_dir)
+    return 0
@@ -0,0 +1,240 @@
+"""
+A host-wide cache of GCC build directories snapshotted right after stage1 of the bootstrap. The
+cache key covers everything stage1 depends on: the source code, the host compiler and the configure
+options other than the installation prefix. A new build with a matching key seeds its build
+directory from the snapshot and starts at the next stage, even if its tag, and so its build and
+installation directories, differ from those of the build that stored the snapshot.
+
+The snapshot refers to the directories of the build that stored it by absolute path. The prefix is
+recorded in the top-level Makefile and config.status, and the config.status files, Makefiles and
+libtool files of the subdirectories embed the absolute build directory. The text files referring
+to these directories are found when a snapshot is stored, and the paths in them are rewritten when
+a build directory is seeded from it (see path_rewriting.py). The paths compiled into the stage1
+binaries are left alone. They only affect the default search paths of the stage1 compiler, which
+the bootstrap overrides.
+
+This also relies on two things. Configure is run with a relative path to the source directory, so
+the snapshot does not refer to the source directory by absolute path. And source file modification
+times are set to the commit time, so that make considers the stage1 objects in the snapshot up to
+date.
+
+Concurrent builds coordinate through a lock per cache entry. Seeding from an entry takes a shared
+lock, and eviction skips entries that are locked. A build that misses the cache keeps an exclusive
+lock on the entry until it has stored it, so that other builds with the same key wait and seed from
+it instead of building the same stage1 again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+from typing import Any, Dict, List, Optional
+
+from build_gcc.helpers import get_disk_usage_bytes, mkdir_p, rm_rf, write_file_atomically
+from build_gcc.locking import FileLock, get_path_lock
+from build_gcc.path_rewriting import get_path_replacements, PathRewriter
+from build_gcc.tree_copy import copy_tree
+
+
+STAGE1_CACHE_FORMAT_VERSION = 3
+
+DEFAULT_STAGE1_CACHE_MAX_SIZE_GB = 50
+
+METADATA_FILE_NAME = 'metadata.json'
+SNAPSHOT_DIR_NAME = 'build'
+TMP_ENTRY_DIR_INFIX = '.tmp.'
+
+
+def compute_stage1_cache_key(key_inputs: Dict[str, Any]) -> str:
+    """
+    >>> compute_stage1_cache_key({'b': 1, 'a': 2}) == compute_stage1_cache_key({'a': 2, 'b': 1})
+    True
+    """
+    key_json = json.dumps(
+        dict(key_inputs, format_version=STAGE1_CACHE_FORMAT_VERSION), sort_keys=True)
+    return hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+
+
+def set_source_mtimes(src_dir: str, timestamp: int) -> None:
+    """
+    Sets the modification time of all files in the source directory (except for the .git
+    directory) to the given timestamp.
+    """
+    start_time_sec = time.time()
+    num_files = 0
+    for root, dir_names, file_names in os.walk(src_dir):
+        dir_names[:] = [name for name in dir_names if name != '.git']
+        for name in file_names:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                os.utime(file_path, (timestamp, timestamp))
+                num_files += 1
+    logging.info("Set modification times of %d files in %s in %.1f seconds",
+                 num_files, src_dir, time.time() - start_time_sec)
+
+
+class Stage1Cache:
+    cache_dir: str
+    max_size_bytes: int
+    install_parent_dir: str
+
+    # Exclusive locks on the entries this build has missed and is going to store.
+    entry_locks: Dict[str, FileLock]
+
+    def __init__(self, cache_dir: str, max_size_bytes: int, install_parent_dir: str) -> None:
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.install_parent_dir = install_parent_dir
+        self.entry_locks = {}
+
+    def get_entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get_entry_lock(self, key: str) -> FileLock:
+        return get_path_lock(self.install_parent_dir, self.get_entry_dir(key))
+
+    def release_entry_lock(self, key: str) -> None:
+        entry_lock = self.entry_locks.pop(key, None)
+        if entry_lock is not None:
+            entry_lock.release()
+
+    def read_metadata(self, key: str) -> Optional[Dict[str, Any]]:
+        metadata_path = os.path.join(self.get_entry_dir(key), METADATA_FILE_NAME)
+        if not os.path.exists(metadata_path):
+            return None
+        with open(metadata_path) as metadata_file:
+            metadata: Dict[str, Any] = json.load(metadata_file)
+        return metadata
+
+    def write_metadata(self, key: str, metadata: Dict[str, Any]) -> None:
+        write_file_atomically(
+            os.path.join(self.get_entry_dir(key), METADATA_FILE_NAME),
+            json.dumps(metadata, indent=2, sort_keys=True) + '\n')
+
+    def seed_build_dir(self, key: str, build_dir: str, location_paths: List[str]) -> bool:
+        """
+        Copies the cached stage1 snapshot with the given key into build_dir, which must not exist,
+        and replaces the location paths of the build that stored the snapshot with the given ones
+        (see store). Returns False if there is no such snapshot. In that case, an exclusive lock on
+        the entry is kept until store or release_entry_lock is called.
+        """
+        entry_lock = self.get_entry_lock(key)
+        entry_lock.acquire(shared=True)
+        try:
+            metadata = self.read_metadata(key)
+            if metadata is None:
+                # Another build may be storing this entry. Wait for it, and check again.
+                entry_lock.acquire(shared=False)
+                metadata = self.read_metadata(key)
+                if metadata is None:
+                    logging.info("Stage1 cache miss for key %s", key)
+                    self.entry_locks[key] = entry_lock
+                    return False
+            logging.info("Stage1 cache hit for key %s, seeding %s", key, build_dir)
+            copy_tree(
+                os.path.join(self.get_entry_dir(key), SNAPSHOT_DIR_NAME),
+                build_dir,
+                allow_hardlinks=False)
+            path_rewriter = PathRewriter(
+                get_path_replacements(metadata['location_paths'], location_paths))
+            if not path_rewriter.is_noop():
+                num_rewritten_files = path_rewriter.rewrite_files(
+                    build_dir, metadata['files_with_location_paths'])
+                logging.info("Replaced %s with %s in %d files in %s",
+                             metadata['location_paths'], location_paths, num_rewritten_files,
+                             build_dir)
+            metadata['last_used_time'] = time.time()
+            self.write_metadata(key, metadata)
+            return True
+        finally:
+            if key not in self.entry_locks:
+                entry_lock.release()
+
+    def store(
+            self,
+            key: str,
+            build_dir: str,
+            key_inputs: Dict[str, Any],
+            location_paths: List[str]) -> None:
+        """
+        Snapshots build_dir, where stage1 has just been built, under the given key. location_paths
+        are the absolute directories of this build that the build directory may refer to, e.g. the
+        parent of the build directory and the installation prefix.
+        """
+        try:
+            self.store_locked(key, build_dir, key_inputs, location_paths)
+        finally:
+            self.release_entry_lock(key)
+        self.evict(keep_key=key)
+
+    def store_locked(
+            self,
+            key: str,
+            build_dir: str,
+            key_inputs: Dict[str, Any],
+            location_paths: List[str]) -> None:
+        entry_dir = self.get_entry_dir(key)
+        if os.path.exists(entry_dir):
+            logging.info("Stage1 cache already has an entry for key %s", key)
+            return
+        tmp_entry_dir = '%s%s%d' % (entry_dir, TMP_ENTRY_DIR_INFIX, os.getpid())
+        rm_rf(tmp_entry_dir)
+        mkdir_p(tmp_entry_dir)
+        try:
+            snapshot_dir = os.path.join(tmp_entry_dir, SNAPSHOT_DIR_NAME)
+            copy_tree(build_dir, snapshot_dir, allow_hardlinks=False)
+            files_with_location_paths = PathRewriter(
+                get_path_replacements(location_paths, location_paths)).find_files(snapshot_dir)
+            current_time = time.time()
+            size_bytes = get_disk_usage_bytes([tmp_entry_dir])
+            metadata = {
+                'key_inputs': key_inputs,
+                'location_paths': location_paths,
+                'files_with_location_paths': files_with_location_paths,
+                'created_time': current_time,
+                'last_used_time': current_time,
+                'size_bytes': size_bytes,
+            }
+            write_file_atomically(
+                os.path.join(tmp_entry_dir, METADATA_FILE_NAME),
+                json.dumps(metadata, indent=2, sort_keys=True) + '\n')
+            os.rename(tmp_entry_dir, entry_dir)
+        except BaseException:
+            rm_rf(tmp_entry_dir)
+            raise
+        logging.info("Stored stage1 snapshot of %s in the cache as %s (%.1f GiB)",
+                     build_dir, key, size_bytes / 1024 ** 3)
+
+    def evict(self, keep_key: Optional[str] = None) -> None:
+        """
+        Removes least recently used entries until the cache fits into its size budget.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            if TMP_ENTRY_DIR_INFIX in key:
+                # An entry that is still being written by some build.
+                continue
+            metadata = self.read_metadata(key)
+            if metadata is not None:
+                entries.append((metadata['last_used_time'], key, metadata['size_bytes']))
+        total_size_bytes = sum(size_bytes for _, _, size_bytes in entries)
+        for _, key, size_bytes in sorted(entries):
+            if total_size_bytes <= self.max_size_bytes:
+                break
+            if key == keep_key:
+                continue
+            entry_lock = self.get_entry_lock(key)
+            if not entry_lock.acquire(blocking=False):
+                logging.info("Not evicting stage1 cache entry %s, it is in use", key)
+                continue
+            try:
+                logging.info(
+                    "Evicting stage1 cache entry %s (%.1f GiB)", key, size_bytes / 1024 ** 3)
+                rm_rf(self.get_entry_dir(key))
+            finally:
+                entry_lock.release()
+            total_size_bytes -= size_bytes
@@ -0,0 +1,206 @@
+"""
+A small scheduler for running the build pipeline as a DAG of tasks. Each task declares the
+artifacts it consumes (inputs) and produces (outputs), the dependencies between tasks are derived
+from those declarations, and independent tasks are run concurrently on a thread pool.
+"""
+
+import concurrent.futures
+import logging
+import time
+
+from typing import Callable, Dict, List, Optional, Set
+
+
+class Task:
+    name: str
+    func: Callable[[], None]
+    inputs: List[str]
+    outputs: List[str]
+
+    # Whether the task is run even when it is not selected with --only or --from, e.g. because
+    # it sets up state (credentials, resolved directories, locks) that the other tasks rely on.
+    always_run: bool
+
+    start_time_sec: Optional[float]
+    end_time_sec: Optional[float]
+
+    def __init__(
+            self,
+            name: str,
+            func: Callable[[], None],
+            inputs: List[str],
+            outputs: List[str],
+            always_run: bool = False) -> None:
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.always_run = always_run
+        self.start_time_sec = None
+        self.end_time_sec = None
+
+    def get_elapsed_time_sec(self) -> float:
+        if self.start_time_sec is None or self.end_time_sec is None:
+            return 0.0
+        return self.end_time_sec - self.start_time_sec
+
+    def run(self) -> None:
+        logging.info("Starting task %s", self.name)
+        self.start_time_sec = time.time()
+        try:
+            self.func()
+        finally:
+            self.end_time_sec = time.time()
+        logging.info("Finished task %s in %.1f seconds", self.name, self.get_elapsed_time_sec())
+
+
+class TaskGraph:
+    tasks: Dict[str, Task]
+
+    # Maps each artifact name to the name of the task producing it.
+    producers: Dict[str, str]
+
+    # Names of the tasks that have been run, in the order of completion.
+    completed_task_names: List[str]
+
+    def __init__(self) -> None:
+        self.tasks = {}
+        self.producers = {}
+        self.completed_task_names = []
+
+    def add_task(
+            self,
+            name: str,
+            func: Callable[[], None],
+            inputs: Optional[List[str]] = None,
+            outputs: Optional[List[str]] = None,
+            always_run: bool = False) -> None:
+        inputs = inputs or []
+        outputs = outputs or []
+        if name in self.tasks:
+            raise ValueError("Duplicate task name: %s" % name)
+        for output in outputs:
+            if output in self.producers:
+                raise ValueError("Artifact %s is produced by both %s and %s" % (
+                    output, self.producers[output], name))
+            self.producers[output] = name
+        self.tasks[name] = Task(
+            name=name, func=func, inputs=inputs, outputs=outputs, always_run=always_run)
+
+    def get_dependencies(self, task_name: str) -> List[str]:
+        """
+        Returns the names of the tasks producing the inputs of the given task. Inputs that no task
+        produces are assumed to already exist, e.g. from an earlier run.
+        """
+        return sorted(set(
+            self.producers[input_name] for input_name in self.tasks[task_name].inputs
+            if input_name in self.producers))
+
+    def get_dependents(self, task_name: str) -> List[str]:
+        return [
+            other_name for other_name in self.tasks
+            if task_name in self.get_dependencies(other_name)
+        ]
+
+    def validate_task_names(self, task_names: List[str]) -> None:
+        unknown_names = [name for name in task_names if name not in self.tasks]
+        if unknown_names:
+            raise ValueError("Unknown task names: %s. Valid task names: %s" % (
+                unknown_names, list(self.tasks)))
+
+    def select_tasks(
+            self,
+            only: Optional[List[str]] = None,
+            from_task: Optional[str] = None) -> List[str]:
+        """
+        Returns the names of the tasks to run. With only, just the given tasks are run. With
+        from_task, the given task and everything that transitively depends on it are run. Tasks
+        added with always_run are run in either case.
+        """
+        selected: Set[str] = set(self.tasks)
+        if only:
+            self.validate_task_names(only)
+            selected &= set(only)
+        if from_task:
+            self.validate_task_names([from_task])
+            downstream: Set[str] = set()
+            stack = [from_task]
+            while stack:
+                name = stack.pop()
+                if name in downstream:
+                    continue
+                downstream.add(name)
+                stack.extend(self.get_dependents(name))
+            selected &= downstream
+        return [name for name in self.tasks if name in selected or self.tasks[name].always_run]
+
+    def run(self, selected_task_names: List[str], max_workers: int) -> None:
+        pending = list(selected_task_names)
+        selected = set(selected_task_names)
+        done: Set[str] = set()
+        running: Dict[concurrent.futures.Future, str] = {}
+        first_error: Optional[BaseException] = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                if first_error is None:
+                    for name in list(pending):
+                        if all(dep in done or dep not in selected
+                               for dep in self.get_dependencies(name)):
+                            pending.remove(name)
+                            running[executor.submit(self.tasks[name].run)] = name
+                if not running:
+                    if first_error is not None:
+                        break
+                    raise ValueError("Dependency cycle among tasks: %s" % pending)
+
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        logging.error("Task %s failed: %s", name, error)
+                        if first_error is None:
+                            first_error = error
+                        continue
+                    done.add(name)
+                    self.completed_task_names.append(name)
+
+        if first_error is not None:
+            raise first_error
+
+    def get_critical_path(self) -> List[Task]:
+        """
+        Returns the chain of completed tasks with the largest total elapsed time.
+        """
+        longest_path: Dict[str, List[str]] = {}
+        longest_time: Dict[str, float] = {}
+        for name in self.completed_task_names:
+            best_dep: Optional[str] = None
+            for dep in self.get_dependencies(name):
+                if dep in longest_time and (
+                        best_dep is None or longest_time[dep] > longest_time[best_dep]):
+                    best_dep = dep
+            elapsed_time_sec = self.tasks[name].get_elapsed_time_sec()
+            if best_dep is None:
+                longest_path[name] = [name]
+                longest_time[name] = elapsed_time_sec
+            else:
+                longest_path[name] = longest_path[best_dep] + [name]
+                longest_time[name] = longest_time[best_dep] + elapsed_time_sec
+        if not longest_time:
+            return []
+        last_name = max(longest_time, key=lambda name: longest_time[name])
+        return [self.tasks[name] for name in longest_path[last_name]]
+
+    def log_critical_path(self) -> None:
+        critical_path = self.get_critical_path()
+        if not critical_path:
+            return
+        logging.info(
+            "Critical path (%.1f seconds): %s",
+            sum(task.get_elapsed_time_sec() for task in critical_path),
+            ' -> '.join(
+                '%s (%.1f s)' % (task.name, task.get_elapsed_time_sec())
+                for task in critical_path))
@@ -0,0 +1,433 @@
+"""
+Runs the DejaGnu testsuites of GCC (gcc, g++, libstdc++) in parallel shards after the build.
+
+Each testsuite is split into units that can be run by one runtest invocation: one unit per .exp
+file name, except for the libstdc++ conformance tests, which are split by test directory. Units
+are assigned to shards using the longest-processing-time-first rule, with unit run times taken
+from earlier runs on this host, or estimated from the number of test files on the first run.
+Each shard runs its units one after another in its own working directory, either locally or on a
+remote host over ssh. Remote hosts must see the build directory at the same path, e.g. on a
+shared file system.
+
+The .sum files of all units of a testsuite are merged into one with the dg-extract-results.py
+script from the GCC source tree, and the failures are compared to those of a baseline run.
+"""
+
+import concurrent.futures
+import glob
+import json
+import logging
+import os
+import re
+import shlex
+import subprocess
+import time
+
+from typing import Dict, List, Optional, Set, Tuple
+
+from build_gcc.helpers import mkdir_p, rm_rf, run_cmd, which, write_file_atomically
+
+
+SUPPORTED_TESTSUITE_TOOLS = ['gcc', 'g++', 'libstdc++']
+
+LOCAL_HOST = 'localhost'
+
+# DejaGnu result line prefixes that are counted in the summary, and those that are failures.
+RESULT_KINDS = ['PASS', 'FAIL', 'XPASS', 'XFAIL', 'UNRESOLVED', 'UNSUPPORTED', 'UNTESTED']
+FAILURE_KINDS = ['FAIL', 'XPASS', 'UNRESOLVED']
+
+RESULT_LINE_RE = re.compile(r'^(%s): ' % '|'.join(RESULT_KINDS))
+
+# runtest exits with 1 when there are test failures, and with a higher code when it could not run
+# the tests. ssh exits with 255 when it cannot connect.
+MAX_RUNTEST_SUCCESS_EXIT_CODE = 1
+
+# Matches libstdc++ test directories such as 23_containers.
+LIBSTDCXX_TEST_DIR_RE = re.compile(r'^\d\d_\w+$')
+
+SUMMARY_FILE_NAME = 'testsuite_summary.json'
+
+
+class TestsuiteUnit:
+    """
+    A part of a testsuite run by one runtest invocation.
+    """
+    tool: str
+    name: str
+    runtest_args: List[str]
+    estimated_time_sec: float
+
+    def __init__(
+            self,
+            tool: str,
+            name: str,
+            runtest_args: List[str],
+            estimated_time_sec: float) -> None:
+        self.tool = tool
+        self.name = name
+        self.runtest_args = runtest_args
+        self.estimated_time_sec = estimated_time_sec
+
+    def get_safe_name(self) -> str:
+        """
+        >>> TestsuiteUnit('libstdc++', 'conformance.exp=23_containers/*', [], 1).get_safe_name()
+        'conformance.exp_23_containers__'
+        """
+        return re.sub(r'[^A-Za-z0-9_.+-]', '_', self.name)
+
+
+class TestsuiteShard:
+    index: int
+    host: str
+    units: List[TestsuiteUnit]
+
+    def __init__(self, index: int, host: str) -> None:
+        self.index = index
+        self.host = host
+        self.units = []
+
+    def get_estimated_time_sec(self) -> float:
+        return sum(unit.estimated_time_sec for unit in self.units)
+
+
+def assign_units_to_shards(units: List[TestsuiteUnit], hosts: List[str]) -> List[TestsuiteShard]:
+    """
+    Assigns units to one shard per host entry, longest units first, each to the shard with the
+    smallest total estimated time so far.
+
+    >>> shards = assign_units_to_shards(
+    ...     [TestsuiteUnit('gcc', name, [], t) for name, t in [('a', 5), ('b', 4), ('c', 3),
+    ...                                                       ('d', 3), ('e', 1)]],
+    ...     ['localhost', 'localhost'])
+    >>> [[unit.name for unit in shard.units] for shard in shards]
+    [['a', 'd'], ['b', 'c', 'e']]
+    """
+    shards = [TestsuiteShard(index, host) for index, host in enumerate(hosts)]
+    for unit in sorted(units, key=lambda unit: (-unit.estimated_time_sec, unit.name)):
+        shard = min(shards, key=lambda shard: (shard.get_estimated_time_sec(), shard.index))
+        shard.units.append(unit)
+    return shards
+
+
+def count_test_files(dir_path: str) -> int:
+    return len([
+        name for name in os.listdir(dir_path)
+        if os.path.isfile(os.path.join(dir_path, name)) and not name.endswith('.exp')
+    ])
+
+
+def find_gcc_testsuite_units(gcc_src_dir: str, tool: str) -> Dict[str, Tuple[List[str], int]]:
+    """
+    Returns a map from a unit name to its runtest arguments and the number of test files in it,
+    for the gcc or g++ testsuite. runtest runs all .exp files with the given name in the
+    directories of the tool (gcc.* or g++.*).
+    """
+    testsuite_dir = os.path.join(gcc_src_dir, 'gcc', 'testsuite')
+    num_files_by_exp: Dict[str, int] = {}
+    for tool_dir in glob.glob(os.path.join(testsuite_dir, tool + '.*')):
+        for root, _, file_names in os.walk(tool_dir):
+            for file_name in file_names:
+                if file_name.endswith('.exp'):
+                    num_files_by_exp[file_name] = (
+                        num_files_by_exp.get(file_name, 0) + count_test_files(root))
+    return {
+        exp_name: ([exp_name], num_files)
+        for exp_name, num_files in num_files_by_exp.items()
+    }
+
+
+def find_libstdcxx_testsuite_units(gcc_src_dir: str) -> Dict[str, Tuple[List[str], int]]:
+    """
+    Like find_gcc_testsuite_units, but for libstdc++. Almost all libstdc++ tests are run by
+    conformance.exp, so it is split into one unit per test directory.
+    """
+    testsuite_dir = os.path.join(gcc_src_dir, 'libstdc++-v3', 'testsuite')
+    units: Dict[str, Tuple[List[str], int]] = {}
+    for exp_path in glob.glob(os.path.join(testsuite_dir, 'libstdc++-*', '*.exp')):
+        exp_name = os.path.basename(exp_path)
+        if exp_name != 'conformance.exp':
+            units[exp_name] = ([exp_name], 1)
+    for dir_name in sorted(os.listdir(testsuite_dir)):
+        dir_path = os.path.join(testsuite_dir, dir_name)
+        if LIBSTDCXX_TEST_DIR_RE.match(dir_name) and os.path.isdir(dir_path):
+            num_files = sum(len(file_names) for _, _, file_names in os.walk(dir_path))
+            unit_name = 'conformance.exp=%s/*' % dir_name
+            units[unit_name] = ([unit_name], num_files)
+    return units
+
+
+def estimate_unit_times(
+        num_files_by_unit: Dict[Tuple[str, str], int],
+        earlier_times: Dict[Tuple[str, str], float]) -> Dict[Tuple[str, str], float]:
+    """
+    Uses run times from earlier runs where available. Other units are estimated from their number
+    of test files, using the average time per file of the units with known times.
+
+    >>> estimate_unit_times({('gcc', 'a'): 10, ('gcc', 'b'): 20}, {('gcc', 'a'): 30.0})
+    {('gcc', 'a'): 30.0, ('gcc', 'b'): 60.0}
+    """
+    known_units = [unit for unit in num_files_by_unit if unit in earlier_times]
+    known_files = sum(num_files_by_unit[unit] for unit in known_units)
+    sec_per_file = 1.0
+    if known_files:
+        sec_per_file = sum(earlier_times[unit] for unit in known_units) / known_files
+    return {
+        unit: earlier_times.get(unit, num_files * sec_per_file)
+        for unit, num_files in num_files_by_unit.items()
+    }
+
+
+def parse_sum_file(sum_path: str) -> Tuple[Dict[str, int], Set[str]]:
+    """
+    Returns the number of results of each kind and the set of failure lines in a .sum file.
+    """
+    counts = {kind: 0 for kind in RESULT_KINDS}
+    failures: Set[str] = set()
+    if not os.path.exists(sum_path):
+        return counts, failures
+    with open(sum_path, errors='replace') as sum_file:
+        for line in sum_file:
+            match = RESULT_LINE_RE.match(line)
+            if match:
+                counts[match.group(1)] += 1
+                if match.group(1) in FAILURE_KINDS:
+                    failures.add(line.strip())
+    return counts, failures
+
+
+class TestsuiteRunner:
+    gcc_src_dir: str
+    gcc_build_dir: str
+    results_dir: str
+    tools: List[str]
+    hosts: List[str]
+    cmd_prefix: List[str]
+
+    # Elapsed times of the units run by this runner.
+    unit_times: Dict[Tuple[str, str], float]
+
+    # The units that did not complete, e.g. because runtest crashed or the ssh connection failed,
+    # with the reason.
+    incomplete_units: Dict[Tuple[str, str], str]
+
+    def __init__(
+            self,
+            gcc_src_dir: str,
+            gcc_build_dir: str,
+            results_dir: str,
+            tools: List[str],
+            hosts: List[str],
+            cmd_prefix: List[str]) -> None:
+        self.gcc_src_dir = gcc_src_dir
+        self.gcc_build_dir = gcc_build_dir
+        self.results_dir = results_dir
+        self.tools = tools
+        self.hosts = hosts
+        self.cmd_prefix = cmd_prefix
+        self.unit_times = {}
+        self.incomplete_units = {}
+
+    def get_site_exp_dir(self, tool: str) -> str:
+        """
+        Returns the build directory where site.exp for the given tool is generated.
+        """
+        if tool != 'libstdc++':
+            return os.path.join(self.gcc_build_dir, 'gcc')
+        testsuite_dirs = glob.glob(
+            os.path.join(self.gcc_build_dir, '*', 'libstdc++-v3', 'testsuite'))
+        if len(testsuite_dirs) != 1:
+            raise IOError("Expected one libstdc++ testsuite directory in %s, found: %s" % (
+                self.gcc_build_dir, testsuite_dirs))
+        return testsuite_dirs[0]
+
+    def get_shard_work_dir(self, tool: str, shard_index: int) -> str:
+        return os.path.join(
+            self.get_site_exp_dir(tool), 'testsuite-yb-shard%d' % shard_index, tool)
+
+    def find_units(self, earlier_times: Dict[Tuple[str, str], float]) -> List[TestsuiteUnit]:
+        runtest_args_by_unit: Dict[Tuple[str, str], List[str]] = {}
+        num_files_by_unit: Dict[Tuple[str, str], int] = {}
+        for tool in self.tools:
+            if tool == 'libstdc++':
+                tool_units = find_libstdcxx_testsuite_units(self.gcc_src_dir)
+            else:
+                tool_units = find_gcc_testsuite_units(self.gcc_src_dir, tool)
+            for unit_name, (runtest_args, num_files) in tool_units.items():
+                runtest_args_by_unit[(tool, unit_name)] = runtest_args
+                num_files_by_unit[(tool, unit_name)] = num_files
+        estimated_times = estimate_unit_times(num_files_by_unit, earlier_times)
+        return [
+            TestsuiteUnit(
+                tool=tool,
+                name=unit_name,
+                runtest_args=runtest_args_by_unit[(tool, unit_name)],
+                estimated_time_sec=estimated_times[(tool, unit_name)])
+            for tool, unit_name in sorted(runtest_args_by_unit)
+        ]
+
+    def prepare_shard_work_dirs(self, num_shards: int) -> None:
+        """
+        Generates site.exp for each tool, and creates a working directory with a copy of it for
+        each shard, pointing the temporary directory of the tests to the working directory, like
+        the check-<tool> targets of the GCC makefile do.
+        """
+        for tool in self.tools:
+            site_exp_dir = self.get_site_exp_dir(tool)
+            run_cmd(self.cmd_prefix + ['make', 'site.exp'], cwd=site_exp_dir)
+            with open(os.path.join(site_exp_dir, 'site.exp')) as site_exp_file:
+                site_exp = site_exp_file.read()
+            for shard_index in range(num_shards):
+                work_dir = self.get_shard_work_dir(tool, shard_index)
+                rm_rf(work_dir)
+                mkdir_p(work_dir)
+                with open(os.path.join(work_dir, 'site.exp'), 'w') as shard_site_exp_file:
+                    shard_site_exp_file.write(re.sub(
+                        r'^set tmpdir .*$', 'set tmpdir "%s"' % work_dir, site_exp,
+                        flags=re.MULTILINE))
+
+    def get_unit_results_dir(self, unit: TestsuiteUnit) -> str:
+        return os.path.join(self.results_dir, 'units', unit.tool, unit.get_safe_name())
+
+    def run_unit(self, shard: TestsuiteShard, unit: TestsuiteUnit) -> None:
+        unit_results_dir = self.get_unit_results_dir(unit)
+        rm_rf(unit_results_dir)
+        mkdir_p(unit_results_dir)
+        work_dir = self.get_shard_work_dir(unit.tool, shard.index)
+        runtest_cmd_line = self.cmd_prefix + [
+            'runtest', '--tool', unit.tool, '--outdir', unit_results_dir
+        ] + unit.runtest_args
+        if shard.host != LOCAL_HOST:
+            runtest_cmd_line = ['ssh', shard.host, 'cd %s && %s' % (
+                shlex.quote(work_dir),
+                ' '.join(shlex.quote(arg) for arg in runtest_cmd_line))]
+
+        start_time_sec = time.time()
+        output_path = os.path.join(unit_results_dir, 'runtest_output.txt')
+        with open(output_path, 'wb') as output_file:
+            # Test failures are reported in the .sum file.
+            exit_code = subprocess.call(
+                runtest_cmd_line, cwd=work_dir, stdout=output_file, stderr=subprocess.STDOUT)
+        elapsed_time_sec = time.time() - start_time_sec
+        self.unit_times[(unit.tool, unit.name)] = elapsed_time_sec
+        logging.info("Ran %s testsuite unit %s in shard %d on %s in %.1f seconds "
+                     "(estimated: %.1f), exit code %d",
+                     unit.tool, unit.name, shard.index, shard.host, elapsed_time_sec,
+                     unit.estimated_time_sec, exit_code)
+        if exit_code > MAX_RUNTEST_SUCCESS_EXIT_CODE:
+            reason = 'exit code %d on %s' % (exit_code, shard.host)
+        elif not os.path.exists(os.path.join(unit_results_dir, unit.tool + '.sum')):
+            reason = 'no %s.sum file produced on %s' % (unit.tool, shard.host)
+        else:
+            return
+        logging.warning("%s testsuite unit %s did not complete: %s, see %s",
+                        unit.tool, unit.name, reason, output_path)
+        self.incomplete_units[(unit.tool, unit.name)] = reason
+
+    def run_shard(self, shard: TestsuiteShard) -> None:
+        for unit in shard.units:
+            self.run_unit(shard, unit)
+
+    def merge_sum_files(self, tool: str, units: List[TestsuiteUnit]) -> str:
+        sum_file_name = tool + '.sum'
+        unit_sum_paths = [
+            os.path.join(self.get_unit_results_dir(unit), sum_file_name)
+            for unit in units if unit.tool == tool
+        ]
+        unit_sum_paths = [path for path in unit_sum_paths if os.path.exists(path)]
+        merged_sum_path = os.path.join(self.results_dir, sum_file_name)
+        extract_results_script = os.path.join(
+            self.gcc_src_dir, 'contrib', 'dg-extract-results.py')
+        if unit_sum_paths and os.path.exists(extract_results_script):
+            merged_sum = subprocess.check_output(
+                ['python3', extract_results_script] + unit_sum_paths).decode(
+                    'utf-8', errors='replace')
+        else:
+            merged_sum = ''
+            for unit_sum_path in unit_sum_paths:
+                with open(unit_sum_path, errors='replace') as unit_sum_file:
+                    merged_sum += unit_sum_file.read()
+        # Incomplete units are reported as unresolved, so that they count as failures.
+        for unit in units:
+            reason = self.incomplete_units.get((unit.tool, unit.name))
+            if unit.tool == tool and reason is not None:
+                merged_sum += 'UNRESOLVED: testsuite unit %s did not complete: %s\n' % (
+                    unit.name, reason)
+        write_file_atomically(merged_sum_path, merged_sum)
+        return merged_sum_path
+
+    def run(self, earlier_times: Dict[Tuple[str, str], float]) -> Dict[str, Dict[str, int]]:
+        """
+        Runs the testsuites and returns the number of results of each kind for each tool.
+        """
+        if which('runtest') is None:
+            raise IOError("runtest (DejaGnu) is required to run the GCC testsuite")
+        units = self.find_units(earlier_times)
+        shards = assign_units_to_shards(units, self.hosts)
+        for shard in shards:
+            logging.info("Testsuite shard %d on %s: %d units, estimated %.1f seconds",
+                         shard.index, shard.host, len(shard.units),
+                         shard.get_estimated_time_sec())
+        rm_rf(self.results_dir)
+        mkdir_p(self.results_dir)
+        self.prepare_shard_work_dirs(len(shards))
+
+        start_time_sec = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            for _ in executor.map(self.run_shard, shards):
+                pass
+        logging.info("Ran %d testsuite units in %d shards in %.1f seconds",
+                     len(units), len(shards), time.time() - start_time_sec)
+
+        counts_by_tool = {}
+        for tool in self.tools:
+            merged_sum_path = self.merge_sum_files(tool, units)
+            counts_by_tool[tool], _ = parse_sum_file(merged_sum_path)
+            logging.info("%s testsuite results: %s", tool, ', '.join(
+                '%s: %d' % (kind, count) for kind, count in counts_by_tool[tool].items()))
+        return counts_by_tool
+
+
+def compare_to_baseline(
+        results_dir: str,
+        baseline_dir: str,
+        tools: List[str]) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Compares the failures in the merged .sum files in results_dir with those in the .sum files of
+    the same name in baseline_dir. Returns the new and the fixed failures for each tool.
+    """
+    comparison = {}
+    for tool in tools:
+        sum_file_name = tool + '.sum'
+        baseline_sum_path = os.path.join(baseline_dir, sum_file_name)
+        if not os.path.exists(baseline_sum_path):
+            logging.warning("No baseline results for %s: %s not found", tool, baseline_sum_path)
+            continue
+        _, failures = parse_sum_file(os.path.join(results_dir, sum_file_name))
+        _, baseline_failures = parse_sum_file(baseline_sum_path)
+        comparison[tool] = {
+            'new_failures': sorted(failures - baseline_failures),
+            'fixed_failures': sorted(baseline_failures - failures),
+        }
+        logging.info("%s testsuite compared to the baseline: %d new failures, %d fixed",
+                     tool, len(comparison[tool]['new_failures']),
+                     len(comparison[tool]['fixed_failures']))
+        for failure in comparison[tool]['new_failures']:
+            logging.warning("New failure: %s", failure)
+    return comparison
+
+
+def write_testsuite_summary(
+        results_dir: str,
+        counts_by_tool: Dict[str, Dict[str, int]],
+        baseline_comparison: Optional[Dict[str, Dict[str, List[str]]]],
+        incomplete_units: Dict[Tuple[str, str], str]) -> None:
+    write_file_atomically(
+        os.path.join(results_dir, SUMMARY_FILE_NAME),
+        json.dumps({
+            'results': counts_by_tool,
+            'baseline_comparison': baseline_comparison,
+            'incomplete_units': [
+                {'tool': tool, 'unit': unit_name, 'reason': reason}
+                for (tool, unit_name), reason in sorted(incomplete_units.items())
+            ],
+        }, indent=2, sort_keys=True) + '\n')
@@ -0,0 +1,253 @@
+"""
+Fast copying of large directory trees, such as a GCC source checkout. Tries copy-on-write clones
+(reflinks) first, then hard links for files that are never modified in place, and falls back to
+a parallel copy. Files that cannot be copied with the chosen strategy, e.g. because they are on a
+different file system, are copied normally.
+"""
+
+import concurrent.futures
+import errno
+import logging
+import os
+import shutil
+import subprocess
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from build_gcc.host_facts import is_linux, is_macos
+
+
+# The FICLONE ioctl request number from linux/fs.h.
+FICLONE = 0x40049409
+
+STRATEGY_REFLINK = 'reflink'
+STRATEGY_HARDLINK = 'hardlink'
+STRATEGY_COPY = 'copy'
+
+# Errors indicating that the file system does not support reflinks or hard links between the
+# source and the destination.
+UNSUPPORTED_ERRNOS = {
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.EPERM,
+    errno.EMLINK,
+}
+
+DEFAULT_NUM_COPY_THREADS = 16
+
+
+class StrategyNotSupported(Exception):
+    pass
+
+
+class TreeCopyResult:
+    # The fastest strategy that was actually used for at least one file.
+    strategy: str
+    elapsed_time_sec: float
+    num_files: int
+    num_files_by_strategy: Dict[str, int]
+
+    def __init__(
+            self,
+            strategy: str,
+            elapsed_time_sec: float,
+            num_files: int,
+            num_files_by_strategy: Dict[str, int]) -> None:
+        self.strategy = strategy
+        self.elapsed_time_sec = elapsed_time_sec
+        self.num_files = num_files
+        self.num_files_by_strategy = num_files_by_strategy
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'strategy': self.strategy,
+            'elapsed_time_sec': self.elapsed_time_sec,
+            'num_files': self.num_files,
+            'num_files_by_strategy': self.num_files_by_strategy,
+        }
+
+
+def is_git_object_path(rel_path: str) -> bool:
+    """
+    Git objects and packs are immutable once written, so they can be safely shared between
+    checkouts using hard links.
+
+    >>> is_git_object_path('.git/objects/pack/pack-1234.pack')
+    True
+    >>> is_git_object_path('gcc/tree.cc')
+    False
+    """
+    return rel_path.startswith(os.path.join('.git', 'objects') + os.sep)
+
+
+# Each of the functions below copies one file and returns the strategy that was used for it, or
+# raises StrategyNotSupported.
+
+def reflink_file(src_path: str, dest_path: str, rel_path: str) -> str:
+    if is_macos():
+        # cp -c uses clonefile(2) on APFS.
+        result = subprocess.run(['cp', '-c', '-p', src_path, dest_path], capture_output=True)
+        if result.returncode != 0:
+            raise StrategyNotSupported(result.stderr.decode('utf-8', errors='replace').strip())
+        return STRATEGY_REFLINK
+    if not is_linux():
+        raise StrategyNotSupported("Reflinks are only supported on Linux and macOS")
+
+    import fcntl
+    with open(src_path, 'rb') as src_file, open(dest_path, 'wb') as dest_file:
+        try:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+        except OSError as ex:
+            if ex.errno in UNSUPPORTED_ERRNOS:
+                raise StrategyNotSupported(str(ex))
+            raise
+    shutil.copystat(src_path, dest_path)
+    return STRATEGY_REFLINK
+
+
+def hardlink_or_copy_file(src_path: str, dest_path: str, rel_path: str) -> str:
+    if not is_git_object_path(rel_path):
+        return copy_file(src_path, dest_path, rel_path)
+    try:
+        os.link(src_path, dest_path)
+    except OSError as ex:
+        if ex.errno in UNSUPPORTED_ERRNOS:
+            raise StrategyNotSupported(str(ex))
+        raise
+    return STRATEGY_HARDLINK
+
+
+def copy_file(src_path: str, dest_path: str, rel_path: str) -> str:
+    shutil.copy2(src_path, dest_path)
+    return STRATEGY_COPY
+
+
+def copy_file_with_fallback(
+        copy_func: Callable[[str, str, str], str],
+        src_path: str,
+        dest_path: str,
+        rel_path: str) -> str:
+    """
+    A strategy that works for the tree as a whole may still fail for individual files, e.g. files
+    on a different file system mounted inside the tree, or files that have reached the hard link
+    limit. Those are copied normally.
+    """
+    try:
+        return copy_func(src_path, dest_path, rel_path)
+    except StrategyNotSupported as ex:
+        logging.debug("Falling back to a plain copy for %s: %s", src_path, ex)
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        return copy_file(src_path, dest_path, rel_path)
+
+
+def create_dirs_and_symlinks(src_dir: str, dest_dir: str) -> List[str]:
+    """
+    Recreates the directory structure and symlinks of src_dir in dest_dir, and returns the
+    relative paths of regular files that still need to be copied.
+    """
+    file_rel_paths: List[str] = []
+    os.makedirs(dest_dir)
+    for root, dir_names, file_names in os.walk(src_dir):
+        rel_root = os.path.relpath(root, src_dir)
+        for name in dir_names + file_names:
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+            src_path = os.path.join(src_dir, rel_path)
+            dest_path = os.path.join(dest_dir, rel_path)
+            if os.path.islink(src_path):
+                os.symlink(os.readlink(src_path), dest_path)
+            elif os.path.isdir(src_path):
+                os.mkdir(dest_path)
+                shutil.copymode(src_path, dest_path)
+            else:
+                file_rel_paths.append(rel_path)
+        # Do not descend into symlinks to directories.
+        dir_names[:] = [
+            name for name in dir_names if not os.path.islink(os.path.join(root, name))
+        ]
+    return file_rel_paths
+
+
+def copy_files_in_parallel(
+        src_dir: str,
+        dest_dir: str,
+        file_rel_paths: List[str],
+        copy_func: Callable[[str, str, str], str],
+        num_threads: int) -> Dict[str, int]:
+    """
+    Returns the number of files copied with each strategy.
+    """
+    def copy_one(rel_path: str) -> str:
+        return copy_file_with_fallback(
+            copy_func,
+            os.path.join(src_dir, rel_path), os.path.join(dest_dir, rel_path), rel_path)
+
+    num_files_by_strategy: Dict[str, int] = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        # Consuming the results also raises the first error.
+        for strategy_name in executor.map(copy_one, file_rel_paths):
+            num_files_by_strategy[strategy_name] = num_files_by_strategy.get(strategy_name, 0) + 1
+    return num_files_by_strategy
+
+
+def copy_tree(
+        src_dir: str,
+        dest_dir: str,
+        allow_hardlinks: bool = True,
+        num_threads: Optional[int] = None) -> TreeCopyResult:
+    """
+    Copies src_dir to dest_dir, which must not exist, using the fastest strategy that works on
+    the underlying file systems. Hard links are only used for git objects, and only if
+    allow_hardlinks is set.
+    """
+    num_threads = num_threads or DEFAULT_NUM_COPY_THREADS
+    start_time_sec = time.time()
+    file_rel_paths = create_dirs_and_symlinks(src_dir, dest_dir)
+
+    strategies: List[Tuple[str, Callable[[str, str, str], str]]] = [
+        (STRATEGY_REFLINK, reflink_file),
+    ]
+    if allow_hardlinks:
+        strategies.append((STRATEGY_HARDLINK, hardlink_or_copy_file))
+    strategies.append((STRATEGY_COPY, copy_file))
+
+    for strategy_name, copy_func in strategies:
+        if strategy_name != STRATEGY_COPY and file_rel_paths:
+            # Probe the strategy on one file before committing to it.
+            probe_rel_path = next(
+                (rel_path for rel_path in file_rel_paths
+                 if strategy_name != STRATEGY_HARDLINK or is_git_object_path(rel_path)),
+                file_rel_paths[0])
+            probe_dest_path = os.path.join(dest_dir, probe_rel_path)
+            try:
+                copy_func(
+                    os.path.join(src_dir, probe_rel_path), probe_dest_path, probe_rel_path)
+            except StrategyNotSupported as ex:
+                logging.info("Cannot use %s strategy to copy %s to %s: %s",
+                             strategy_name, src_dir, dest_dir, ex)
+                if os.path.lexists(probe_dest_path):
+                    os.remove(probe_dest_path)
+                continue
+            os.remove(probe_dest_path)
+
+        num_files_by_strategy = copy_files_in_parallel(
+            src_dir, dest_dir, file_rel_paths, copy_func, num_threads)
+        result = TreeCopyResult(
+            strategy=next(
+                (name for name, _ in strategies if num_files_by_strategy.get(name)),
+                STRATEGY_COPY),
+            elapsed_time_sec=time.time() - start_time_sec,
+            num_files=len(file_rel_paths),
+            num_files_by_strategy=num_files_by_strategy)
+        logging.info(
+            "Copied %d files from %s to %s using the %s strategy in %.1f seconds "
+            "(files per strategy: %s)",
+            result.num_files, src_dir, dest_dir, result.strategy, result.elapsed_time_sec,
+            num_files_by_strategy)
+        return result
+
+    raise AssertionError("The copy strategy must always succeed")
@@ -0,0 +1,66 @@
+import functools
+import http.server
+import os
+import threading
+
+from typing import Any, Callable, Iterator, List, Type
+
+import pytest
+
+
+class QuietRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves the files of a directory, like a release server without range request support.
+    """
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class RangeRequestHandler(QuietRequestHandler):
+    """
+    Also supports single byte range requests, like the servers releases are published to.
+    """
+    def do_GET(self) -> None:
+        range_header = self.headers.get('Range')
+        path = self.translate_path(self.path)
+        if range_header is None or not os.path.isfile(path):
+            super().do_GET()
+            return
+        start_str, end_str = range_header[len('bytes='):].split('-')
+        with open(path, 'rb') as input_file:
+            data = input_file.read()
+        start = int(start_str)
+        end = min(int(end_str), len(data) - 1)
+        if start >= len(data):
+            self.send_error(416)
+            return
+        body = data[start:end + 1]
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+ServeDirectory = Callable[[str, Type[http.server.SimpleHTTPRequestHandler]], str]
+
+
+@pytest.fixture
+def serve_directory() -> Iterator[ServeDirectory]:
+    """
+    Returns a function that serves a directory over HTTP on a local port with the given handler
+    class, and returns the base URL. The servers are shut down after the test.
+    """
+    servers: List[http.server.ThreadingHTTPServer] = []
+
+    def serve(root_dir: str, handler_class: Type[http.server.SimpleHTTPRequestHandler]) -> str:
+        server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), functools.partial(handler_class, directory=root_dir))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return 'http://127.0.0.1:%d' % server.server_address[1]
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
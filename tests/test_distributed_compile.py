@@ -0,0 +1,83 @@
+import json
+import os
+import shutil
+
+from typing import Any, Dict, List
+
+import pytest
+
+from build_gcc import distributed_compile
+from build_gcc.distributed_compile import (
+    CompileHost,
+    DistributedCompileConfig,
+    TRANSPORT_LOCAL,
+    run_compiler,
+)
+
+
+pytestmark = pytest.mark.skipif(shutil.which('gcc') is None, reason='gcc is not installed')
+
+
+@pytest.fixture
+def config(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> DistributedCompileConfig:
+    """
+    A configuration with no local job slots and one worker reached by the local transport, so
+    that every compile job goes to the worker.
+    """
+    monkeypatch.chdir(tmp_path)
+    with open('a.c', 'w') as source_file:
+        source_file.write('int f(int x) { return x + 1; }\n')
+    for dir_name in ['slots', 'work']:
+        os.mkdir(dir_name)
+    return DistributedCompileConfig(
+        hosts=[CompileHost('worker1', 1)],
+        transport=TRANSPORT_LOCAL,
+        local_jobs=0,
+        slots_dir=os.path.join(tmp_path, 'slots'),
+        work_dir=os.path.join(tmp_path, 'work'))
+
+
+def get_jobs(config: DistributedCompileConfig) -> List[Dict[str, Any]]:
+    with open(config.get_stats_path()) as stats_file:
+        return [json.loads(line) for line in stats_file]
+
+
+def test_compile_on_worker(config: DistributedCompileConfig) -> None:
+    assert run_compiler(config, 'gcc', ['-O2', '-c', 'a.c', '-o', 'a.o']) == 0
+    assert os.path.getsize('a.o') > 0
+    assert [(job['host'], job['fallback_reason']) for job in get_jobs(config)] == [
+        ('worker1', None)]
+
+
+def test_unreachable_worker_falls_back_to_local_compile(
+        config: DistributedCompileConfig, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        distributed_compile, 'get_transport_cmd',
+        lambda transport, host_name, script: ['sh', '-c', 'echo unreachable >&2; exit 255'])
+    assert run_compiler(config, 'gcc', ['-c', 'a.c', '-o', 'a.o']) == 0
+    assert os.path.getsize('a.o') > 0
+    [job] = get_jobs(config)
+    assert job['host'] == 'worker1'
+    assert job['fallback_reason'] == 'could not reach worker1: unreachable'
+    assert config.is_host_down('worker1')
+
+
+def test_failed_remote_compile_falls_back_to_local_compile(
+        config: DistributedCompileConfig, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        distributed_compile, 'get_transport_cmd',
+        lambda transport, host_name, script: ['sh', '-c', 'exit 1'])
+    assert run_compiler(config, 'gcc', ['-c', 'a.c', '-o', 'a.o']) == 0
+    assert os.path.getsize('a.o') > 0
+    [job] = get_jobs(config)
+    assert job['fallback_reason'] == 'compilation failed on worker1 with exit code 1'
+    assert not config.is_host_down('worker1')
+
+
+def test_preprocessing_errors_are_reported_once(
+        config: DistributedCompileConfig, capfd: pytest.CaptureFixture[str]) -> None:
+    assert run_compiler(
+        config, 'gcc', ['-MD', '-MF', 'missing/a.d', '-c', 'a.c', '-o', 'a.o']) != 0
+    assert capfd.readouterr().err.count('missing/a.d') == 1
+    [job] = get_jobs(config)
+    assert job['fallback_reason'].startswith('preprocessing failed with exit code')
@@ -0,0 +1,85 @@
+import hashlib
+import http.server
+import os
+import subprocess
+
+from typing import Type
+
+import pytest
+
+from build_gcc.fetch import fetch_release
+
+from conftest import QuietRequestHandler, RangeRequestHandler, ServeDirectory
+
+
+INSTALL_DIR_NAME = 'yb-gcc-v12.2.0-1-abc-centos7-x86_64'
+ARCHIVE_NAME = INSTALL_DIR_NAME + '.tar.gz'
+CHUNK_SIZE = 64 * 1024
+
+
+def create_release(tmp_path: str, sha256: str = '') -> str:
+    """
+    Creates a release archive spanning several download chunks and its .sha256 file in a
+    directory to be served, and returns that directory.
+    """
+    src_dir = os.path.join(tmp_path, 'src', INSTALL_DIR_NAME, 'bin')
+    os.makedirs(src_dir)
+    with open(os.path.join(src_dir, 'gcc'), 'wb') as output_file:
+        output_file.write(os.urandom(5 * CHUNK_SIZE))
+    served_dir = os.path.join(tmp_path, 'served')
+    os.makedirs(served_dir)
+    archive_path = os.path.join(served_dir, ARCHIVE_NAME)
+    subprocess.check_call(
+        ['tar', 'czf', archive_path, INSTALL_DIR_NAME], cwd=os.path.join(tmp_path, 'src'))
+    with open(archive_path, 'rb') as archive_file:
+        actual_sha256 = hashlib.sha256(archive_file.read()).hexdigest()
+    with open(archive_path + '.sha256', 'w') as sha256_file:
+        sha256_file.write('%s  %s\n' % (sha256 or actual_sha256, ARCHIVE_NAME))
+    return served_dir
+
+
+def check_fetched(tmp_path: str, install_dir: str) -> None:
+    assert install_dir == os.path.join(tmp_path, 'dest', INSTALL_DIR_NAME)
+    with open(os.path.join(install_dir, 'bin', 'gcc'), 'rb') as fetched_file, \
+            open(os.path.join(tmp_path, 'src', INSTALL_DIR_NAME, 'bin', 'gcc'), 'rb') as src_file:
+        assert fetched_file.read() == src_file.read()
+
+
+@pytest.mark.parametrize('handler_class', [RangeRequestHandler, QuietRequestHandler])
+def test_fetch_release(
+        tmp_path: str,
+        serve_directory: ServeDirectory,
+        handler_class: Type[http.server.SimpleHTTPRequestHandler]) -> None:
+    base_url = serve_directory(create_release(str(tmp_path)), handler_class)
+    dest_dir = os.path.join(tmp_path, 'dest')
+
+    install_dir, fetched = fetch_release(
+        base_url + '/' + ARCHIVE_NAME, dest_dir, num_connections=3, chunk_size=CHUNK_SIZE)
+    assert fetched
+    check_fetched(str(tmp_path), install_dir)
+
+    install_dir, fetched = fetch_release(base_url + '/' + ARCHIVE_NAME, dest_dir)
+    assert not fetched
+
+
+def test_fetch_release_uses_range_requests(
+        tmp_path: str,
+        serve_directory: ServeDirectory,
+        caplog: pytest.LogCaptureFixture) -> None:
+    base_url = serve_directory(create_release(str(tmp_path)), RangeRequestHandler)
+    caplog.set_level('INFO')
+    fetch_release(
+        base_url + '/' + ARCHIVE_NAME, os.path.join(tmp_path, 'dest'), num_connections=3,
+        chunk_size=CHUNK_SIZE)
+    assert 'using 3 connections' in caplog.text
+    assert 'single stream' not in caplog.text
+
+
+def test_fetch_release_checksum_mismatch(tmp_path: str, serve_directory: ServeDirectory) -> None:
+    base_url = serve_directory(create_release(str(tmp_path), sha256='0' * 64), RangeRequestHandler)
+    dest_dir = os.path.join(tmp_path, 'dest')
+    with pytest.raises(IOError, match='SHA-256 mismatch'):
+        fetch_release(
+            base_url + '/' + ARCHIVE_NAME, dest_dir, num_connections=3, chunk_size=CHUNK_SIZE)
+    # Neither the installation directory nor the temporary extraction directory is left behind.
+    assert [name for name in os.listdir(dest_dir) if not name.startswith('.locks')] == []
@@ -0,0 +1,77 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from build_gcc.publish import ArchivePublisher, LocalUploadTarget
+
+
+ARCHIVE_NAME = 'yb-gcc-v12.2.0-1-abc-centos7-x86_64.tar.gz'
+PART_SIZE = 1024
+DATA = os.urandom(10 * PART_SIZE + 100)
+NUM_PARTS = 11
+
+
+class FlakyUploadTarget(LocalUploadTarget):
+    """
+    Fails to upload all parts from a given part number, like a connection that went down in the
+    middle of an upload.
+    """
+    first_failing_part_number: int
+
+    def __init__(self, root_dir: str, first_failing_part_number: int) -> None:
+        super().__init__(root_dir)
+        self.first_failing_part_number = first_failing_part_number
+
+    def upload_part(self, name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        if part_number >= self.first_failing_part_number:
+            raise IOError("Connection reset while uploading part %d" % part_number)
+        return super().upload_part(name, upload_id, part_number, data)
+
+
+def create_publisher(target: LocalUploadTarget, tmp_path: str) -> ArchivePublisher:
+    return ArchivePublisher(
+        target, os.path.join(tmp_path, ARCHIVE_NAME), part_size=PART_SIZE, num_threads=1)
+
+
+def write_sha256_file(tmp_path: str, sha256: str) -> str:
+    sha256_file_path = os.path.join(tmp_path, ARCHIVE_NAME + '.sha256')
+    with open(sha256_file_path, 'w') as sha256_file:
+        sha256_file.write('%s  %s\n' % (sha256, ARCHIVE_NAME))
+    return sha256_file_path
+
+
+def test_resumed_upload(tmp_path: str) -> None:
+    root_dir = os.path.join(tmp_path, 'releases')
+    with pytest.raises(IOError, match='Connection reset'):
+        create_publisher(FlakyUploadTarget(root_dir, 3), str(tmp_path)).upload(
+            io.BytesIO(DATA), write_archive=False)
+
+    publisher = create_publisher(LocalUploadTarget(root_dir), str(tmp_path))
+    sha256 = publisher.upload(io.BytesIO(DATA), write_archive=False)
+    assert sha256 == hashlib.sha256(DATA).hexdigest()
+    assert publisher.num_parts == NUM_PARTS
+    # The two parts uploaded before the failure are not uploaded again.
+    assert publisher.num_uploaded_parts == NUM_PARTS - 2
+
+    publisher.commit(write_sha256_file(str(tmp_path), sha256))
+    with open(os.path.join(root_dir, ARCHIVE_NAME), 'rb') as archive_file:
+        assert archive_file.read() == DATA
+    assert os.path.exists(os.path.join(root_dir, ARCHIVE_NAME + '.sha256'))
+    assert not os.path.exists(publisher.get_state_path())
+
+
+def test_commit_rejects_checksum_mismatch(tmp_path: str) -> None:
+    root_dir = os.path.join(tmp_path, 'releases')
+    target = LocalUploadTarget(root_dir)
+    publisher = create_publisher(target, str(tmp_path))
+    sha256 = publisher.upload(io.BytesIO(DATA), write_archive=False)
+    assert publisher.upload_id is not None
+    with open(target.get_part_path(publisher.upload_id, 1), 'wb') as part_file:
+        part_file.write(b'corrupted')
+
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        publisher.commit(write_sha256_file(str(tmp_path), sha256))
+    assert not os.path.exists(os.path.join(root_dir, ARCHIVE_NAME))
+    assert not os.path.exists(os.path.join(root_dir, ARCHIVE_NAME + '.sha256'))